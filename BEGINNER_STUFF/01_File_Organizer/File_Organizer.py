@@ -1,51 +1,296 @@
+import argparse
 import os
-import shutil
+import sys
 from datetime import datetime
 
+from classify import classify
+from dedupe import (
+    CACHE_NAME,
+    HashCache,
+    default_cache,
+    find_duplicates,
+    hard_link,
+    plan_duplicate_moves,
+)
+from engine import organize, plan_moves, print_progress
+from journal import JOURNAL_NAME, Journal, default_journal
+from rules import RuleSet
+from watcher import watch
+
 # Path to the folder you want to organize
 TARGET_FOLDER = (
     "/home/udit/Documents/Github/Python_Projects/BEGINNER_STUFF/01_File_Organizer/test"
 )
 
 
-def organize_by_type(folder_path):
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
+# Used by the "rules" mode when no --rules file is given.
+DEFAULT_RULES = os.path.join(os.path.dirname(__file__), "organizer-rules.toml")
+
+
+def type_folder(entry):
+    # From the first bytes of the file, not the text after the last dot.
+    return classify(entry).type.upper()
+
+
+def date_folder(entry):
+    # DirEntry caches its stat(), so this is at most one syscall per file.
+    mod_time = entry.stat().st_mtime
+    return datetime.fromtimestamp(mod_time).strftime("%Y-%m-%d")
+
+
+MODES = {"type": type_folder, "date": date_folder}
+
+
+def destination_for(mode, rules=None):
+    if mode == "rules":
+        return RuleSet.load(rules or DEFAULT_RULES).destination
+    return MODES[mode]
+
+
+def plan(folder_path, mode, dest_root=None, recursive=False, journal=None, rules=None):
+    exclude = {os.path.normpath(journal)} if journal else ()
+    destination = destination_for(mode, rules)
+    return plan_moves(folder_path, destination, dest_root, recursive, exclude)
+
+
+def organize_folder(
+    folder_path,
+    mode,
+    dest_root=None,
+    recursive=False,
+    journal=None,
+    progress=None,
+    rules=None,
+):
+    """Organize `folder_path` by `mode`: "type", "date", or "rules" from
+    the TOML file `rules` (see rules.py).
+
+    With a `journal` path, the whole plan is written to it before anything
+    moves, then each move as it is done, so the run can be resumed or
+    undone (see journal.py).
+    """
+    if journal is None:
+        destination = destination_for(mode, rules)
+        return organize(
+            folder_path, destination, dest_root, recursive, progress=progress
+        )
+    moves = plan(folder_path, mode, dest_root, recursive, journal, rules)
+    journal = Journal(journal)
+    return journal.execute(journal.plan(mode, folder_path, moves), progress=progress)
+
+
+def organize_by_type(
+    folder_path, dest_root=None, recursive=False, journal=None, progress=None
+):
+    return organize_folder(folder_path, "type", dest_root, recursive, journal, progress)
+
+
+def organize_by_date(
+    folder_path, dest_root=None, recursive=False, journal=None, progress=None
+):
+    return organize_folder(folder_path, "date", dest_root, recursive, journal, progress)
+
+
+def print_summary(stats, verb="Moved"):
+    print(
+        f"{verb} {stats.renamed + stats.copied:,} files in {stats.seconds:.1f}s "
+        f"({stats.files_per_sec:,.0f} files/s, {stats.copied:,} across filesystems)."
+    )
+    for src, error in stats.failed:
+        print(f"Failed: {src}: {error}")
+
+
+def resume_interrupted(journal):
+    run = Journal(journal).unfinished()
+    if run is not None:
+        print(f"Resuming the interrupted {run.mode} run of {run.folder}...")
+        print_summary(
+            Journal(journal).execute(run, resume=True, progress=print_progress)
+        )
+
+
+def cmd_watch(args, journal):
+    resume_interrupted(journal)
+    journal = Journal(journal)
+
+    def run(moves):
+        return journal.execute(journal.plan(args.mode, args.folder, moves))
+
+    print(f"Watching {args.folder}; Ctrl+C to stop.")
+    watch(
+        args.folder,
+        destination_for(args.mode, args.rules),
+        args.dest,
+        settle=args.settle,
+        interval=args.interval,
+        poll=args.poll,
+        run=run,
+        report=print_summary,
+    )
+
+
+def cmd_organize(args):
+    journal = args.journal or default_journal(args.folder)
+    if args.watch:
+        return cmd_watch(args, journal)
+    if args.dry_run:
+        count = 0
+        moves = plan(
+            args.folder, args.mode, args.dest, args.recursive, journal, args.rules
+        )
+        for move in moves:
+            print(f"{move.src} -> {move.dest}")
+            count += 1
+        print(f"{count:,} files would be moved.")
+        return
+
+    resume_interrupted(journal)
+    print_summary(
+        organize_folder(
+            args.folder,
+            args.mode,
+            args.dest,
+            args.recursive,
+            journal,
+            print_progress,
+            args.rules,
+        )
+    )
+
+
+def cmd_dedupe(args):
+    journal = args.journal or default_journal(args.folder)
+    dest = args.dest or os.path.join(args.folder, "DUPLICATES")
+    cache = None if args.no_cache else HashCache(default_cache(args.folder))
+    exclude = {os.path.normpath(path) for path in (journal, dest)}
+    if cache:
+        exclude.add(os.path.normpath(default_cache(args.folder)))
+    try:
+        groups, stats = find_duplicates(
+            args.folder, cache=cache, workers=args.workers, exclude=exclude
+        )
+    finally:
+        if cache:
+            cache.close()
+
+    print(
+        f"{stats.files:,} files: {stats.same_size:,} share a size, "
+        f"{stats.edge_hashed:,} had their ends hashed and "
+        f"{stats.full_hashed:,} their contents (the rest were cached)."
+    )
+    print(
+        f"{stats.duplicates:,} duplicates in {len(groups):,} groups, "
+        f"taking {stats.wasted / 2**20:,.1f} MiB."
+    )
+    if args.action == "report":
+        for keep, *copies in groups:
+            print(f"\n{keep}")
+            for path in copies:
+                print(f"  = {path}")
+    elif args.action == "link":
+        failed = hard_link(groups)
+        print(f"Hard-linked {stats.duplicates - len(failed):,} duplicates.")
+        for path, error in failed:
+            print(f"Failed: {path}: {error}")
+    else:
+        resume_interrupted(journal)
+        moves = plan_duplicate_moves(groups, args.folder, dest)
+        journal = Journal(journal)
+        run = journal.plan("dedupe", args.folder, moves)
+        print_summary(journal.execute(run, progress=print_progress))
+
+
+def cmd_undo(args):
+    journal = Journal(args.journal or default_journal(args.folder))
+    run = journal.last_run()
+    if run is None:
+        print("Nothing to undo.")
+        return
+    print(f"Undoing the {run.mode} run of {run.folder}...")
+    print_summary(journal.undo(run, progress=print_progress), "Moved back")
 
-        if os.path.isfile(item_path):
-            ext = item.split(".")[-1].lower()
-            if ext == item:  # No extension
-                ext = "no_extension"
 
-            dest_dir = os.path.join(folder_path, ext.upper())
-            os.makedirs(dest_dir, exist_ok=True)
-            shutil.move(item_path, os.path.join(dest_dir, item))
+def build_parser():
+    parser = argparse.ArgumentParser(description="Organize files into folders")
+    parser.add_argument(
+        "--journal", help=f"move journal (default: FOLDER/{JOURNAL_NAME})"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
 
+    for mode, help in (
+        ("type", "by file type, read from their contents"),
+        ("date", "by modified date"),
+        ("rules", "by the rules in a TOML file"),
+    ):
+        p = sub.add_parser(mode, help=f"Organize files {help}")
+        p.add_argument("folder", nargs="?", default=TARGET_FOLDER)
+        p.add_argument(
+            "-r", "--recursive", action="store_true", help="include subfolders"
+        )
+        p.add_argument("--dest", help="root of the new folders (default: FOLDER)")
+        p.add_argument(
+            "-n", "--dry-run", action="store_true", help="print the plan, move nothing"
+        )
+        p.add_argument(
+            "-w", "--watch", action="store_true", help="keep organizing new arrivals"
+        )
+        p.add_argument(
+            "--settle",
+            type=float,
+            default=2.0,
+            help="seconds a new file must stay unchanged before it moves",
+        )
+        p.add_argument(
+            "--interval", type=float, default=1.0, help="seconds between polls"
+        )
+        p.add_argument(
+            "--poll", action="store_true", help="poll even where inotify works"
+        )
+        if mode == "rules":
+            default = os.path.basename(DEFAULT_RULES)
+            p.add_argument("--rules", help=f"rules file (default: {default})")
+        p.set_defaults(func=cmd_organize, mode=mode, rules=None)
 
-def organize_by_date(folder_path):
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
+    p = sub.add_parser("dedupe", help="Find files with identical contents")
+    p.add_argument("folder", nargs="?", default=TARGET_FOLDER)
+    p.add_argument(
+        "--action",
+        choices=("report", "link", "move"),
+        default="report",
+        help="list the copies, replace them with hard links, or move them "
+        "to --dest (default: FOLDER/DUPLICATES; undo moves them back)",
+    )
+    p.add_argument("--dest")
+    p.add_argument("--workers", type=int, help="hashing processes (default: CPUs)")
+    p.add_argument(
+        "--no-cache", action="store_true", help=f"don't use FOLDER/{CACHE_NAME}"
+    )
+    p.set_defaults(func=cmd_dedupe)
 
-        if os.path.isfile(item_path):
-            mod_time = os.path.getmtime(item_path)
-            date_folder = datetime.fromtimestamp(mod_time).strftime("%Y-%m-%d")
+    p = sub.add_parser("undo", help="Move the files of the last run back")
+    p.add_argument("folder", nargs="?", default=TARGET_FOLDER)
+    p.set_defaults(func=cmd_undo)
+    return parser
 
-            dest_dir = os.path.join(folder_path, date_folder)
-            os.makedirs(dest_dir, exist_ok=True)
-            shutil.move(item_path, os.path.join(dest_dir, item))
 
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        parser = build_parser()
+        args = parser.parse_args(argv)
+        if getattr(args, "watch", False) and (args.recursive or args.dry_run):
+            parser.error("--watch works on the top folder only, for real")
+        return args.func(args)
 
-def main():
     print("Choose organization method:")
     print("1. By file type")
     print("2. By modified date")
+    print("3. Find duplicates")
 
-    choice = input("Enter 1 or 2: ")
+    choice = input("Enter 1, 2 or 3: ")
 
-    if choice == "1":
-        organize_by_type(TARGET_FOLDER)
-    elif choice == "2":
-        organize_by_date(TARGET_FOLDER)
+    if choice in ("1", "2", "3"):
+        main([{"1": "type", "2": "date", "3": "dedupe"}[choice]])
     else:
         print("Invalid choice.")
 
@@ -0,0 +1,173 @@
+from collections import defaultdict, namedtuple
+
+HEADER = 2048  # bytes read from the start of each file, in one read()
+
+Kind = namedtuple("Kind", "type category")
+
+# (magic bytes at offset 0, type, category). Longer magics are tried first.
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png", "image"),
+    (b"\xff\xd8\xff", "jpg", "image"),
+    (b"GIF87a", "gif", "image"),
+    (b"GIF89a", "gif", "image"),
+    (b"BM", "bmp", "image"),
+    (b"II*\x00", "tiff", "image"),
+    (b"MM\x00*", "tiff", "image"),
+    (b"\x00\x00\x01\x00", "ico", "image"),
+    (b"8BPS", "psd", "image"),
+    (b"%PDF-", "pdf", "document"),
+    (b"{\\rtf", "rtf", "document"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "doc", "document"),  # old Office
+    (b"PK\x03\x04", "zip", "archive"),
+    (b"PK\x05\x06", "zip", "archive"),  # empty zip
+    (b"\x1f\x8b", "gz", "archive"),
+    (b"BZh", "bz2", "archive"),
+    (b"\xfd7zXZ\x00", "xz", "archive"),
+    (b"(\xb5/\xfd", "zst", "archive"),
+    (b"7z\xbc\xaf'\x1c", "7z", "archive"),
+    (b"Rar!\x1a\x07", "rar", "archive"),
+    (b"\x7fELF", "elf", "executable"),
+    (b"MZ", "exe", "executable"),
+    (b"\xcf\xfa\xed\xfe", "macho", "executable"),
+    (b"\xca\xfe\xba\xbe", "macho", "executable"),
+    (b"\x00asm", "wasm", "executable"),
+    (b"ID3", "mp3", "audio"),
+    (b"\xff\xfb", "mp3", "audio"),
+    (b"\xff\xf3", "mp3", "audio"),
+    (b"fLaC", "flac", "audio"),
+    (b"OggS", "ogg", "audio"),
+    (b"MThd", "mid", "audio"),
+    (b"\x1aE\xdf\xa3", "mkv", "video"),
+    (b"SQLite format 3\x00", "sqlite", "data"),
+    (b"RIFF", "riff", "data"),  # refined below
+]
+
+# RIFF's real type is at offset 8, ISO media's brand ("ftyp") at 8 too.
+RIFF_TYPES = {
+    b"WAVE": Kind("wav", "audio"),
+    b"AVI ": Kind("avi", "video"),
+    b"WEBP": Kind("webp", "image"),
+}
+FTYP_BRANDS = {
+    b"qt  ": Kind("mov", "video"),
+    b"M4A ": Kind("m4a", "audio"),
+    b"M4B ": Kind("m4a", "audio"),
+    b"heic": Kind("heic", "image"),
+    b"heix": Kind("heic", "image"),
+    b"mif1": Kind("heic", "image"),
+    b"avif": Kind("avif", "image"),
+    b"3gp4": Kind("3gp", "video"),
+    b"3gp5": Kind("3gp", "video"),
+}
+# Formats that are zip files inside; which one it is, the name says.
+ZIP_TYPES = {
+    "docx": "document",
+    "xlsx": "document",
+    "pptx": "document",
+    "odt": "document",
+    "ods": "document",
+    "odp": "document",
+    "epub": "document",
+    "jar": "executable",
+    "apk": "executable",
+}
+TEXT_CATEGORIES = {
+    "txt": "text",
+    "md": "text",
+    "csv": "data",
+    "json": "data",
+    "xml": "data",
+    "html": "text",
+    "py": "code",
+    "js": "code",
+    "sh": "code",
+    "c": "code",
+    "svg": "image",
+}
+
+# First byte -> [(magic, Kind)], so each file is compared with the few
+# signatures that can match rather than all of them.
+_BY_FIRST_BYTE = defaultdict(list)
+for _magic, _type, _category in sorted(SIGNATURES, key=lambda s: -len(s[0])):
+    _BY_FIRST_BYTE[_magic[0]].append((_magic, Kind(_type, _category)))
+
+# Every type the header can prove, so an extension claiming one of them
+# without the bytes to match is not believed.
+MAGIC_TYPES = {
+    *(kind.type for kinds in _BY_FIRST_BYTE.values() for _, kind in kinds),
+    *(kind.type for kind in (*RIFF_TYPES.values(), *FTYP_BRANDS.values())),
+    *ZIP_TYPES,
+    "jpeg",
+    "tif",
+    "mp4",
+}
+
+
+def extension(name):
+    stem, dot, ext = name.rpartition(".")
+    return ext.lower() if stem else ""
+
+
+def looks_like_text(header):
+    if not header or b"\x00" in header:
+        return False
+    try:
+        header.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the end of the buffer is fine.
+        return e.start >= len(header) - 3 and e.reason == "unexpected end of data"
+    return True
+
+
+def sniff(header, name):
+    """The Kind of a file from its first bytes, using its name only to
+    tell apart formats that share a container."""
+    ext = extension(name)
+    for magic, kind in _BY_FIRST_BYTE.get(header[:1] and header[0], ()):
+        if header.startswith(magic):
+            if len(magic) <= 2 and looks_like_text(header):
+                continue  # "BM..." or "MZ..." can start a text file too
+            if kind.type == "riff":
+                return RIFF_TYPES.get(header[8:12], kind)
+            if kind.type == "zip" and ext in ZIP_TYPES:
+                return Kind(ext, ZIP_TYPES[ext])
+            return kind
+    if header[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(header[8:12], Kind("mp4", "video"))
+    text = looks_like_text(header)
+    if ext in MAGIC_TYPES:
+        # Named like a format we'd have recognized, and it isn't one.
+        return Kind("txt", "text") if text else Kind("unknown", "other")
+    if ext:
+        return Kind(ext, TEXT_CATEGORIES.get(ext, "text" if text else "other"))
+    return Kind("txt", "text") if text else Kind("no_extension", "other")
+
+
+class Classifier:
+    """Reads each file's first HEADER bytes once and remembers the Kind by
+    (device, inode, mtime), so a moved file isn't read again and a
+    rewritten one is. The extension is part of the key too, since it
+    decides between formats that share a container."""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self.cache = {}
+
+    def __call__(self, entry):
+        st = entry.stat()
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, extension(entry.name))
+        kind = self.cache.get(key)
+        if kind is None:
+            try:
+                with open(entry.path, "rb") as f:
+                    header = f.read(HEADER)
+            except OSError:
+                header = b""
+            kind = sniff(header, entry.name)
+            if len(self.cache) >= self.maxsize:
+                del self.cache[next(iter(self.cache))]  # the oldest
+            self.cache[key] = kind
+        return kind
+
+
+classify = Classifier()
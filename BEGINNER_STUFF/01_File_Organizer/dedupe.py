@@ -0,0 +1,229 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from engine import OWN_PREFIX, Move, free_name, scan_files, taken_names
+
+CACHE_NAME = ".organizer-hashes.sqlite"
+EDGE = 64 * 1024  # bytes hashed at each end of a file before reading it all
+
+File = namedtuple("File", "path size mtime_ns")
+
+
+@dataclass
+class DedupeStats:
+    files: int = 0
+    same_size: int = 0  # files sharing their size with another file
+    edge_hashed: int = 0  # ... whose ends had to be read (not cached)
+    full_hashed: int = 0  # ... whose whole contents had to be read
+    duplicates: int = 0  # files that are a copy of an earlier one
+    wasted: int = 0  # bytes the duplicates take up
+
+
+def default_cache(folder):
+    return os.path.join(folder, CACHE_NAME)
+
+
+def edge_hash(file):
+    """Hash of the first and last EDGE bytes, which for files up to
+    2 * EDGE is all of them. None if the file can't be read."""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(file.path, "rb") as f:
+            if file.size <= 2 * EDGE:
+                h.update(f.read())
+            else:
+                h.update(f.read(EDGE))
+                f.seek(-EDGE, os.SEEK_END)
+                h.update(f.read(EDGE))
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def full_hash(file):
+    """Hash of the whole file, read through mmap: the pages go from the
+    page cache straight into the hash, with no copies in between."""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(file.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                h.update(data)
+    except (OSError, ValueError):  # ValueError: emptied since the scan
+        return None
+    return h.hexdigest()
+
+
+class HashCache:
+    """(path, size, mtime) -> hashes, in SQLite. A file whose size and
+    mtime haven't changed since it was hashed isn't read again."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                edge TEXT,
+                full TEXT
+            )
+            """
+        )
+
+    def get(self, file, kind):
+        row = self.conn.execute(
+            f"SELECT {kind} FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            file,
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, kind, hashed):
+        """Store [(File, hash)] for `kind`, "edge" or "full". The other
+        hash is kept if the file hasn't changed, and dropped if it has."""
+        other = "full" if kind == "edge" else "edge"
+        self.conn.executemany(
+            f"""
+            INSERT INTO hashes (path, size, mtime_ns, {kind}) VALUES (?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                {kind} = excluded.{kind},
+                {other} = CASE
+                    WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns
+                    THEN {other}
+                END,
+                size = excluded.size,
+                mtime_ns = excluded.mtime_ns
+            """,
+            [(*file, value) for file, value in hashed],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def hash_all(files, kind, cache, pool, stats):
+    """{File: hash} for `files`, from the cache where it can, and the rest
+    hashed by `pool()`'s processes. Files that can't be read are left out."""
+    hashes = {}
+    missing = []
+    for file in files:
+        value = cache.get(file, kind) if cache else None
+        if value is None:
+            missing.append(file)
+        else:
+            hashes[file] = value
+    if missing:
+        func = edge_hash if kind == "edge" else full_hash
+        hashed = list(zip(missing, pool().map(func, missing, chunksize=16)))
+        hashed = [(file, value) for file, value in hashed if value is not None]
+        if cache:
+            cache.put(kind, hashed)
+        hashes.update(hashed)
+        if kind == "edge":
+            stats.edge_hashed += len(missing)
+        else:
+            stats.full_hashed += len(missing)
+    return hashes
+
+
+def regroup(groups, hashes):
+    """Split each group by hash, keeping the groups of two or more."""
+    for group in groups:
+        by_hash = defaultdict(list)
+        for file in group:
+            if file in hashes:
+                by_hash[hashes[file]].append(file)
+        yield from (files for files in by_hash.values() if len(files) > 1)
+
+
+def find_duplicates(folder, recursive=True, cache=None, workers=None, exclude=()):
+    """Return ([[path, ...]], DedupeStats): groups of files in `folder`
+    with identical contents, each sorted by path.
+
+    Each step only looks at the files the one before couldn't tell apart:
+    files of a unique size are never opened, then the first and last
+    EDGE bytes are hashed, and only files that match on those are read in
+    full. Hashing runs in a pool of `workers` processes, and `cache` (a
+    HashCache) skips the files hashed before. Empty files, and hard links
+    to a file already seen, are not counted as duplicates.
+    """
+    folder = os.path.normpath(folder)
+    stats = DedupeStats()
+    by_size = defaultdict(list)
+    inodes = set()
+    for entry in scan_files(folder, recursive, set(exclude)):
+        stats.files += 1
+        st = entry.stat()
+        if st.st_size == 0 or (st.st_dev, st.st_ino) in inodes:
+            continue
+        inodes.add((st.st_dev, st.st_ino))
+        by_size[st.st_size].append(File(entry.path, st.st_size, st.st_mtime_ns))
+    del inodes
+    groups = [files for files in by_size.values() if len(files) > 1]
+    stats.same_size = sum(map(len, groups))
+
+    executor = None
+
+    def pool():
+        nonlocal executor
+        if executor is None:
+            executor = ProcessPoolExecutor(workers)
+        return executor
+
+    try:
+        files = [file for group in groups for file in group]
+        groups = list(regroup(groups, hash_all(files, "edge", cache, pool, stats)))
+        # Up to 2 * EDGE bytes, the edge hash already covered everything.
+        small = [group for group in groups if group[0].size <= 2 * EDGE]
+        large = [group for group in groups if group[0].size > 2 * EDGE]
+        files = [file for group in large for file in group]
+        hashes = hash_all(files, "full", cache, pool, stats)
+        groups = small + list(regroup(large, hashes))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    stats.duplicates = sum(len(group) - 1 for group in groups)
+    stats.wasted = sum(group[0].size * (len(group) - 1) for group in groups)
+    return sorted(sorted(file.path for file in group) for group in groups), stats
+
+
+def hard_link(groups):
+    """Replace every copy with a hard link to the first file of its group;
+    return [(path, error)] for the ones that couldn't be."""
+    failed = []
+    for keep, *copies in groups:
+        for path in copies:
+            # Named so that scan_files skips one a crash leaves behind.
+            folder, name = os.path.split(path)
+            tmp = os.path.join(folder, f"{OWN_PREFIX}link-{name}")
+            try:
+                os.link(keep, tmp)
+                os.replace(tmp, path)  # atomic: path is never missing
+            except OSError as e:
+                failed.append((path, e))
+                if os.path.lexists(tmp):
+                    os.unlink(tmp)
+    return failed
+
+
+def plan_duplicate_moves(groups, folder, dest_root):
+    """Yield a Move for every copy but the first of each group, to the
+    same relative path under `dest_root`. A name that is already taken
+    there (say, by a copy moved on an earlier run) is numbered instead of
+    overwritten, as in engine.plan_moves."""
+    taken = {}
+    for _, *copies in groups:
+        for path in copies:
+            dest = os.path.join(dest_root, os.path.relpath(path, folder))
+            dest_dir, name = os.path.split(dest)
+            names = taken_names(taken, dest_dir)
+            name = free_name(name, names)
+            names.add(name)
+            yield Move(path, os.path.join(dest_dir, name))
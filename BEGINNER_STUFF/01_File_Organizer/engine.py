@@ -0,0 +1,204 @@
+import errno
+import os
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+
+# `key` is for the caller, e.g. a move's position in a journal.
+Move = namedtuple("Move", "src dest key", defaults=(None,))
+
+# Our own files (journal, hash cache) start with this and are never moved.
+OWN_PREFIX = ".organizer-"
+
+
+@dataclass
+class MoveStats:
+    files: int = 0
+    renamed: int = 0  # same filesystem: one os.rename, no data copied
+    copied: int = 0  # across filesystems: copy + delete on a worker thread
+    failed: list = field(default_factory=list)  # [(src, error)]
+    seconds: float = 0.0
+
+    @property
+    def files_per_sec(self):
+        return self.files / self.seconds if self.seconds else 0.0
+
+
+def print_progress(stats):
+    print(f"{stats.files:,} files ({stats.files_per_sec:,.0f} files/s)")
+
+
+def scan_files(folder, recursive=False, exclude=()):
+    """Yield a DirEntry for each file in `folder`, and with `recursive`
+    in its subfolders too, leaving out the paths in `exclude`.
+
+    os.scandir gets the file type from the directory listing itself, so
+    unlike os.path.isfile() there is no stat() per entry, and the stat()
+    a DirEntry does make is cached on it for later (e.g. mtime).
+
+    Subfolders are walked depth first from a stack of paths, one open
+    directory at a time, so memory and file handles stay flat however
+    deep the tree. `exclude` is checked when a folder's turn comes, so
+    paths added to it while walking are skipped too. Symlinked folders
+    are not followed, and files named OWN_PREFIX* are left out.
+    """
+    stack = [folder]
+    while stack:
+        path = stack.pop()
+        if path in exclude:
+            continue
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                elif (
+                    entry.is_file()
+                    and entry.path not in exclude
+                    and not entry.name.startswith(OWN_PREFIX)
+                ):
+                    yield entry
+
+
+def split_name(name):
+    stem, dot, ext = name.rpartition(".")
+    return (stem, dot + ext) if stem else (name, "")
+
+
+def free_name(name, taken):
+    """`name`, or "stem (1).ext", "stem (2).ext", ... if it is in `taken`."""
+    if name not in taken:
+        return name
+    stem, ext = split_name(name)
+    n = 1
+    while f"{stem} ({n}){ext}" in taken:
+        n += 1
+    return f"{stem} ({n}){ext}"
+
+
+def taken_names(taken, dest_dir):
+    """The set of names in `dest_dir`, listed the first time it comes up
+    and kept in `taken` ({dest_dir: names}) for the caller to add to."""
+    names = taken.get(dest_dir)
+    if names is None:
+        try:
+            names = taken[dest_dir] = set(os.listdir(dest_dir))
+        except (FileNotFoundError, NotADirectoryError):
+            # A file in its place fails the moves there, in move_files.
+            names = taken[dest_dir] = set()
+    return names
+
+
+def plan_moves(folder, destination, dest_root=None, recursive=False, exclude=()):
+    """Yield a Move for each file in `folder` (see scan_files), to
+    dest_root/destination(entry)/name; dest_root defaults to `folder`.
+
+    Nothing is touched, so the plan can be printed or journaled first.
+    Files already in their destination stay, and destination folders
+    inside the tree are not walked.
+
+    A name that is already taken in its destination is numbered instead of
+    overwritten. Each destination is listed once, the first time a file
+    goes there. Names in one folder are unique, so without `recursive`
+    only the files that were there before (and the numbered names) need
+    remembering.
+    """
+    folder = os.path.normpath(folder)
+    dest_root = folder if dest_root is None else os.path.normpath(dest_root)
+    exclude = set(exclude)
+    taken = {}
+    for entry in scan_files(folder, recursive, exclude):
+        dest_dir = os.path.join(dest_root, destination(entry))
+        if os.path.dirname(entry.path) == dest_dir:
+            continue
+        if dest_dir not in taken:
+            exclude.add(dest_dir)
+        names = taken_names(taken, dest_dir)
+        name = free_name(entry.name, names)
+        if recursive or name != entry.name:
+            names.add(name)
+        yield Move(entry.path, os.path.join(dest_dir, name))
+
+
+def move_files(moves, workers=8, progress=None, every=1.0, done=None):
+    """Carry out Moves and return MoveStats.
+
+    Each destination directory is created once, the first time it comes
+    up; if that fails (say a file has its name), the moves into it fail
+    with that error and the others go ahead. Moves are a plain os.rename; the ones that cross filesystems
+    (EXDEV) are copied by a pool of `workers` threads instead, since
+    they wait on I/O. `progress(stats)` is called every `every` seconds,
+    and `done(move)` after each move that succeeded, on this thread.
+    """
+    stats = MoveStats()
+    start = last = time.perf_counter()
+    made = set()
+    unmade = {}  # dest dir: why it couldn't be created
+    cross_device = set()  # dest dirs that rename can't reach
+    pending = set()
+
+    def collect(finished):
+        for future in finished:
+            try:
+                future.result()
+            except OSError as e:
+                stats.failed.append((future.move.src, e))
+                continue
+            stats.copied += 1
+            if done:
+                done(future.move)
+
+    with ThreadPoolExecutor(workers) as pool:
+        for move in moves:
+            src, dest = move.src, move.dest
+            stats.files += 1
+            dest_dir = os.path.dirname(dest)
+            if dest_dir not in made:
+                try:
+                    os.makedirs(dest_dir, exist_ok=True)
+                except OSError as e:
+                    unmade[dest_dir] = e
+                made.add(dest_dir)
+            if dest_dir in unmade:
+                stats.failed.append((src, unmade[dest_dir]))
+                continue
+            if dest_dir not in cross_device:
+                try:
+                    os.rename(src, dest)
+                    stats.renamed += 1
+                    if done:
+                        done(move)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        stats.failed.append((src, e))
+                        continue
+                    cross_device.add(dest_dir)
+            if dest_dir in cross_device:
+                future = pool.submit(shutil.move, src, dest)
+                future.move = move
+                pending.add(future)
+                # Keep the queue short: the moves may be a generator of millions.
+                if len(pending) >= workers * 4:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+            now = time.perf_counter()
+            if progress and now - last >= every:
+                stats.seconds = now - start
+                progress(stats)
+                last = now
+        collect(wait(pending).done)
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def organize(
+    folder, destination, dest_root=None, recursive=False, workers=8, progress=None
+):
+    """Move every file in `folder` to the subfolder destination(entry)."""
+    return move_files(
+        plan_moves(folder, destination, dest_root, recursive), workers, progress
+    )
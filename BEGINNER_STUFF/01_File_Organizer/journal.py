@@ -0,0 +1,235 @@
+import json
+import os
+from array import array
+
+from engine import Move, move_files
+
+JOURNAL_NAME = ".organizer-journal.jsonl"
+
+# Plan entries are read back one at a time by offset, so a run of millions
+# of moves costs 9 bytes each in memory: an offset and a state byte.
+PENDING, DONE, UNDONE = 0, 1, 2
+
+
+def default_journal(folder):
+    return os.path.join(folder, JOURNAL_NAME)
+
+
+class Run:
+    def __init__(self, run_id, mode, folder):
+        self.id = run_id
+        self.mode = mode
+        self.folder = folder
+        self.moves = None  # set once the whole plan is on disk
+        self.offsets = None  # where each plan record is, when just planned
+        self.finished = False
+        self.undoing = False
+        self.undone = False
+
+
+class Journal:
+    """Append-only log of organize runs, one JSON record per line.
+
+    A run first writes its whole plan ("start", one "plan" per move,
+    "planned"), fsynced before any file moves. Then "done" records follow
+    the moves, and "finished" ends it. An undo appends "undo" records and
+    "undone". Records are never rewritten, and a line torn by a crash is
+    dropped.
+
+    "done" and "undo" records are buffered rather than synced one by one,
+    so a crash can lose the last of them. Resume and undo both check the
+    files of every move they have no record of: a file found at its
+    destination and not its source counts as moved.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.next_id = None
+
+    def _records(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield offset, json.loads(line)
+                offset += len(line)
+
+    def _append(self):
+        f = open(self.path, "ab")
+        # Cut a line torn by a crash, or the next record would join it.
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            with open(self.path, "rb") as r:
+                r.seek(max(end - 65536, 0))
+                tail = r.read()
+            if not tail.endswith(b"\n"):
+                f.truncate(end - len(tail) + tail.rfind(b"\n") + 1)
+                f.seek(0, os.SEEK_END)  # for tell()
+        return f
+
+    @staticmethod
+    def _write(f, **record):
+        f.write(json.dumps(record).encode() + b"\n")
+
+    def runs(self):
+        runs = {}
+        for _, record in self._records():
+            op = record["op"]
+            if op == "start":
+                run = runs[record["run"]] = Run(
+                    record["run"], record["mode"], record["folder"]
+                )
+            else:
+                run = runs[record["run"]]
+            if op == "planned":
+                run.moves = record["moves"]
+            elif op == "finished":
+                run.finished = True
+            elif op == "undo":
+                run.undoing = True
+            elif op == "undone":
+                run.undone = True
+        return list(runs.values())
+
+    def unfinished(self):
+        """The run that was interrupted after planning, if any."""
+        for run in reversed(self.runs()):
+            if run.moves is not None:
+                if run.finished or run.undoing or run.undone:
+                    return None
+                return run
+        return None
+
+    def last_run(self):
+        """The latest run that moved files and is not undone yet."""
+        for run in reversed(self.runs()):
+            if run.moves is not None and not run.undone:
+                return run
+        return None
+
+    def plan(self, mode, folder, moves):
+        """Journal a new run's plan from the Moves in `moves`; return it."""
+        if self.next_id is None:
+            runs = self.runs()
+            self.next_id = runs[-1].id + 1 if runs else 0
+        run = Run(self.next_id, mode, os.fspath(folder))
+        self.next_id += 1
+        offsets = array("q")
+        with self._append() as f:
+            self._write(f, op="start", run=run.id, mode=mode, folder=run.folder)
+            for move in moves:
+                offsets.append(f.tell())
+                i = len(offsets) - 1
+                self._write(f, op="plan", run=run.id, i=i, src=move.src, dest=move.dest)
+            self._write(f, op="planned", run=run.id, moves=len(offsets))
+            f.flush()
+            os.fsync(f.fileno())
+        run.moves = len(offsets)
+        run.offsets = offsets
+        return run
+
+    def _load(self, run):
+        offsets = array("q", bytes(8 * run.moves))
+        state = bytearray(run.moves)
+        for offset, record in self._records():
+            if record["run"] != run.id:
+                continue
+            if record["op"] == "plan":
+                offsets[record["i"]] = offset
+            elif record["op"] == "done":
+                state[record["i"]] = DONE
+            elif record["op"] == "undo":
+                state[record["i"]] = UNDONE
+        return offsets, state
+
+    def _replay(self, run, offsets, state, wanted, order=iter):
+        """Yield a Move (src, dest, i) for each plan entry in a state in
+        `wanted`."""
+        with open(self.path, "rb") as plan:
+            for i in order(range(run.moves)):
+                if state[i] in wanted:
+                    plan.seek(offsets[i])
+                    entry = json.loads(plan.readline())
+                    yield Move(entry["src"], entry["dest"], i)
+
+    def execute(self, run, resume=False, workers=8, progress=None):
+        """Carry out `run`'s plan, or with `resume` the rest of it, and
+        return MoveStats.
+
+        Files that fail to move stay where they are and are reported; the
+        next run's plan picks them up again.
+        """
+        if run.offsets is not None and not resume:  # planned by this Journal
+            offsets, state = run.offsets, bytearray(run.moves)
+        else:
+            offsets, state = self._load(run)
+        with self._append() as f:
+
+            def done(move):
+                self._write(f, op="done", run=run.id, i=move.key)
+
+            def pending(moves):
+                for move in moves:
+                    # Moved before a crash lost its record?
+                    if (
+                        resume
+                        and not os.path.lexists(move.src)
+                        and os.path.lexists(move.dest)
+                    ):
+                        done(move)
+                        continue
+                    yield move
+
+            moves = pending(self._replay(run, offsets, state, (PENDING,)))
+            stats = move_files(moves, workers, progress, done=done)
+            self._write(f, op="finished", run=run.id)
+        return stats
+
+    def undo(self, run, workers=8, progress=None):
+        """Move `run`'s files back, newest move first; returns MoveStats.
+
+        Moves with no "done" record are checked on disk, as on resume, so
+        a run that crashed before its records were written is undone too.
+        A file whose old place has been taken since is left where it is and
+        reported as failed, and the run stays undoable until that is
+        sorted out. Destination folders left empty are removed.
+        """
+        offsets, state = self._load(run)
+        dest_dirs = set()
+        taken = []
+        with self._append() as f:
+
+            def undone(move):
+                self._write(f, op="undo", run=run.id, i=move.key)
+
+            def backwards(moves):
+                for move in moves:
+                    if state[move.key] == PENDING and (
+                        os.path.lexists(move.src) or not os.path.lexists(move.dest)
+                    ):
+                        continue  # never moved
+                    dest_dirs.add(os.path.dirname(move.dest))
+                    if os.path.lexists(move.src):
+                        if os.path.lexists(move.dest):
+                            taken.append((move.dest, FileExistsError(move.src)))
+                        else:  # moved back before a crash lost its record
+                            undone(move)
+                        continue
+                    yield Move(move.dest, move.src, move.key)
+
+            replay = self._replay(run, offsets, state, (DONE, PENDING), reversed)
+            moves = backwards(replay)
+            stats = move_files(moves, workers, progress, done=undone)
+            stats.failed[:0] = taken
+            if not stats.failed:
+                self._write(f, op="undone", run=run.id)
+        for dest_dir in sorted(dest_dirs, key=len, reverse=True):
+            try:
+                os.rmdir(dest_dir)
+            except OSError:
+                pass
+        return stats
@@ -0,0 +1,151 @@
+import fnmatch
+import os
+import re
+import string
+import tomllib
+from datetime import datetime
+
+from classify import classify
+
+SIZE = re.compile(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(i?)B?\s*", re.IGNORECASE)
+DATE_FIELDS = {"year", "month", "day", "date"}
+TEMPLATE_FIELDS = {"type", "TYPE", "category", "ext", *DATE_FIELDS}
+CONDITIONS = {"type", "category", "min_size", "max_size", "name", "modified", "dest"}
+
+
+def parse_size(value):
+    """Bytes in 4096, "500KB" or "1.5 GiB" (KB = 1000 bytes, KiB = 1024)."""
+    if isinstance(value, int):
+        return value
+    match = SIZE.fullmatch(value)
+    if not match:
+        raise ValueError(f"Not a size: {value!r}")
+    number, unit, binary = match.groups()
+    base = 1024 if binary else 1000
+    return int(float(number) * base ** " KMGT".index(unit.upper() or " "))
+
+
+def modified_date(entry):
+    return datetime.fromtimestamp(entry.stat().st_mtime).strftime("%Y-%m-%d")
+
+
+def as_set(value):
+    return {value} if isinstance(value, str) else set(value)
+
+
+class Rule:
+    """One [[rule]] table: conditions on the file, and where it goes."""
+
+    def __init__(self, table, index):
+        unknown = set(table) - CONDITIONS
+        if unknown:
+            raise ValueError(f"Rule {index}: unknown keys {sorted(unknown)}")
+        if "dest" not in table:
+            raise ValueError(f"Rule {index}: no dest")
+        self.index = index
+        self.types = as_set(table["type"]) if "type" in table else None
+        self.categories = as_set(table["category"]) if "category" in table else None
+        self.min_size = parse_size(table.get("min_size", 0))
+        self.max_size = parse_size(table["max_size"]) if "max_size" in table else None
+        self.name = self._glob(table.get("name"))
+        self.modified = self._glob(table.get("modified"))
+        self.dest = table["dest"]
+        fields = {
+            field for _, field, _, _ in string.Formatter().parse(self.dest) if field
+        }
+        if fields - TEMPLATE_FIELDS:
+            raise ValueError(
+                f"Rule {index}: unknown fields {sorted(fields - TEMPLATE_FIELDS)} "
+                f"in dest; use {sorted(TEMPLATE_FIELDS)}"
+            )
+        if os.path.isabs(self.dest) or ".." in self.dest.replace("\\", "/").split("/"):
+            raise ValueError(f"Rule {index}: dest must stay inside the folder")
+        self.needs_date = bool(fields & DATE_FIELDS)
+        self.always = not (
+            self.name or self.modified or self.min_size or self.max_size is not None
+        )
+
+    @staticmethod
+    def _glob(pattern):
+        if pattern is None:
+            return None
+        return re.compile(fnmatch.translate(pattern), re.IGNORECASE).match
+
+    def wants(self, kind):
+        return (self.types is None or kind.type in self.types) and (
+            self.categories is None or kind.category in self.categories
+        )
+
+    def matches(self, entry):
+        if self.name and not self.name(entry.name):
+            return False
+        size = entry.stat().st_size
+        if size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return not self.modified or bool(self.modified(modified_date(entry)))
+
+
+class RuleSet:
+    """Rules from a TOML file, tried in order; the first match decides.
+
+        [[rule]]
+        category = "image"          # and/or type = ["jpg", "png"]
+        min_size = "1MB"            # max_size too
+        modified = "2024-*"         # glob on the YYYY-MM-DD mtime
+        name = "IMG_*"              # glob on the file name
+        dest = "Photos/{year}/{month}"
+
+        [default]
+        dest = "{TYPE}"
+
+    Types come from the file's contents (see classify.py). The rules are
+    compiled into a table from type to the rules that can apply to it, so
+    a file is only checked against those, and a type whose first rule has
+    no other conditions goes straight to its template.
+    """
+
+    def __init__(self, config):
+        self.rules = [Rule(table, i) for i, table in enumerate(config.get("rule", []))]
+        default = config.get("default", {"dest": "{TYPE}"})
+        self.rules.append(Rule(default, "default"))
+        self.table = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(tomllib.load(f))
+
+    def candidates(self, kind):
+        rules = self.table.get(kind)
+        if rules is None:
+            rules = []
+            for rule in self.rules:
+                if rule.wants(kind):
+                    rules.append(rule)
+                    if rule.always:
+                        break  # nothing after it can be reached
+            rules = self.table[kind] = tuple(rules)
+        return rules
+
+    def destination(self, entry):
+        """The folder for `entry`, relative to the destination root."""
+        kind = classify(entry)
+        for rule in self.candidates(kind):
+            if rule.always or rule.matches(entry):
+                return self._render(rule, kind, entry)
+        return "UNSORTED"  # the default rule had conditions
+
+    @staticmethod
+    def _render(rule, kind, entry):
+        fields = {
+            "type": kind.type,
+            "TYPE": kind.type.upper(),
+            "category": kind.category,
+            "ext": os.path.splitext(entry.name)[1].lstrip(".").lower(),
+        }
+        if rule.needs_date:
+            date = modified_date(entry)
+            fields.update(date=date, year=date[:4], month=date[5:7], day=date[8:])
+        return os.path.normpath(rule.dest.format_map(fields))
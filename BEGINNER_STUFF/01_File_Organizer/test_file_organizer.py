@@ -0,0 +1,406 @@
+import errno
+import os
+import threading
+import time
+
+import pytest
+
+import engine
+from classify import Classifier, sniff
+from dedupe import EDGE, HashCache, find_duplicates, hard_link
+from File_Organizer import main, organize_by_date, organize_by_type
+from journal import JOURNAL_NAME, Journal
+from rules import RuleSet, parse_size
+from watcher import Debouncer, watch
+
+
+def make_files(folder, names):
+    for name in names:
+        (folder / name).write_text(name)
+
+
+def test_organize_by_type_renames_in_place_and_numbers_clashes(tmp_path):
+    make_files(tmp_path, ["a.txt", "b.TXT", "README"])
+    (tmp_path / "photo.JPG.exe").write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00")
+    (tmp_path / "blob").write_bytes(b"\x00\x01\x02")
+    (tmp_path / "TXT").mkdir()
+    (tmp_path / "TXT" / "a.txt").write_text("already there")
+    (tmp_path / "subdir").mkdir()
+    seen = []
+
+    stats = organize_by_type(tmp_path, progress=seen.append)
+
+    assert (stats.files, stats.renamed, stats.copied, stats.failed) == (5, 5, 0, [])
+    assert sorted(os.listdir(tmp_path / "TXT")) == [
+        "README",  # text, by its contents
+        "a (1).txt",
+        "a.txt",
+        "b.TXT",
+    ]
+    assert (tmp_path / "TXT" / "a (1).txt").read_text() == "a.txt"
+    assert (tmp_path / "PNG" / "photo.JPG.exe").exists()
+    assert (tmp_path / "NO_EXTENSION" / "blob").exists()
+    assert (tmp_path / "subdir").is_dir()  # folders are left alone
+
+
+def test_organize_by_date_into_another_root(tmp_path):
+    source, dest = tmp_path / "in", tmp_path / "out"
+    source.mkdir()
+    make_files(source, ["a.txt", "b.txt"])
+    os.utime(source / "a.txt", (0, 1_700_000_000))
+
+    organize_by_date(source, dest)
+
+    assert os.listdir(source) == []
+    assert len(list(dest.glob("*/*.txt"))) == 2
+
+
+def test_cross_device_moves_go_to_the_thread_pool(tmp_path, monkeypatch):
+    make_files(tmp_path, [f"{i}.log" for i in range(20)])
+    renames = []
+
+    def rename(src, dest):
+        renames.append(threading.current_thread())
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(engine.os, "rename", rename)
+    moves = engine.plan_moves(tmp_path, lambda entry: "LOG")
+    stats = engine.move_files(moves, workers=2)
+
+    # One EXDEV marks the destination as remote; the rest are only tried
+    # by shutil.move on the workers, before it falls back to copying.
+    assert renames.count(threading.main_thread()) == 1
+    assert (stats.files, stats.renamed, stats.copied) == (20, 0, 20)
+    assert len(os.listdir(tmp_path / "LOG")) == 20
+
+
+def test_failed_moves_are_reported_not_raised(tmp_path, monkeypatch):
+    make_files(tmp_path, ["a.txt"])
+
+    def rename(src, dest):
+        raise PermissionError(errno.EACCES, "Permission denied")
+
+    monkeypatch.setattr(engine.os, "rename", rename)
+    stats = organize_by_type(tmp_path)
+
+    assert [src for src, _ in stats.failed] == [str(tmp_path / "a.txt")]
+    assert (tmp_path / "a.txt").exists()
+
+
+def test_a_file_named_like_a_destination_only_fails_the_moves_there(tmp_path):
+    make_files(tmp_path, ["a.txt", "b.txt"])
+    (tmp_path / "photo.png").write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00")
+    (tmp_path / "TXT").write_text("a user's file, not our folder")
+
+    stats = organize_by_type(tmp_path)
+
+    failed = sorted(os.path.basename(src) for src, _ in stats.failed)
+    assert failed == ["TXT", "a.txt", "b.txt"]
+    assert all(isinstance(e, FileExistsError) for _, e in stats.failed)
+    assert (tmp_path / "PNG" / "photo.png").exists()
+    assert (tmp_path / "TXT").read_text() == "a user's file, not our folder"
+
+
+def test_recursive_plan_skips_destinations_and_numbers_across_folders(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "TXT").mkdir()
+    make_files(tmp_path, ["x.txt", "TXT/done.txt", "a/x.txt", "a/b/x.txt", "a/b/y.md"])
+
+    moves = list(engine.plan_moves(tmp_path, lambda entry: "TXT", recursive=True))
+
+    assert (tmp_path / "a" / "b" / "x.txt").exists()  # planning moves nothing
+    dests = sorted(os.path.relpath(move.dest, tmp_path) for move in moves)
+    assert dests == ["TXT/x (1).txt", "TXT/x (2).txt", "TXT/x.txt", "TXT/y.md"]
+
+
+def test_dry_run_moves_nothing(tmp_path, capsys):
+    make_files(tmp_path, ["a.txt", "b.md"])
+
+    main(["type", str(tmp_path), "--dry-run"])
+
+    assert sorted(os.listdir(tmp_path)) == ["a.txt", "b.md"]
+    assert "2 files would be moved." in capsys.readouterr().out
+
+
+def test_interrupted_run_resumes_then_undo_restores_the_tree(tmp_path, monkeypatch):
+    (tmp_path / "sub").mkdir()
+    names = [f"{i}.txt" for i in range(5)] + [f"sub/{i}.md" for i in range(5)]
+    make_files(tmp_path, names)
+    journal = tmp_path / JOURNAL_NAME
+    rename = os.rename
+    calls = []
+
+    def crash_on_the_fourth(src, dest):
+        calls.append(src)
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        rename(src, dest)
+
+    monkeypatch.setattr(engine.os, "rename", crash_on_the_fourth)
+    with pytest.raises(KeyboardInterrupt):
+        organize_by_type(tmp_path, recursive=True, journal=journal)
+    monkeypatch.setattr(engine.os, "rename", rename)
+    # Lose the last "done" record too, as an unflushed buffer would.
+    lines = journal.read_bytes().splitlines(keepends=True)
+    journal.write_bytes(b"".join(lines[:-1]) + lines[-1][:5])
+
+    run = Journal(journal).unfinished()
+    assert run.moves == 10
+    stats = Journal(journal).execute(run, resume=True)
+    assert stats.files == 7 and not stats.failed  # 3 moved before the crash
+    assert len(os.listdir(tmp_path / "TXT")) == 5
+    assert len(os.listdir(tmp_path / "MD")) == 5
+    assert Journal(journal).unfinished() is None
+
+    main(["undo", str(tmp_path)])
+
+    restored = {
+        os.path.relpath(os.path.join(root, name), tmp_path)
+        for root, _, files in os.walk(tmp_path)
+        for name in files
+    }
+    assert restored == set(names) | {JOURNAL_NAME}
+    assert sorted(os.listdir(tmp_path)) == [JOURNAL_NAME, *names[:5], "sub"]
+    assert Journal(journal).last_run() is None
+
+
+def test_undo_finds_moves_whose_records_a_crash_lost(tmp_path, monkeypatch):
+    names = [f"{i}.txt" for i in range(5)]
+    make_files(tmp_path, names)
+    journal = tmp_path / JOURNAL_NAME
+    rename = os.rename
+    calls = []
+
+    def crash_after_the_last(src, dest):
+        rename(src, dest)
+        calls.append(src)
+        if len(calls) == len(names):
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(engine.os, "rename", crash_after_the_last)
+    with pytest.raises(KeyboardInterrupt):
+        organize_by_type(tmp_path, journal=journal)
+    monkeypatch.setattr(engine.os, "rename", rename)
+    # Every file moved, and not one "done" record reached the disk.
+    lines = journal.read_bytes().splitlines(keepends=True)
+    journal.write_bytes(b"".join(line for line in lines if b'"done"' not in line))
+    assert len(os.listdir(tmp_path / "TXT")) == 5
+
+    main(["undo", str(tmp_path)])
+    assert sorted(os.listdir(tmp_path)) == sorted([JOURNAL_NAME, *names])
+    assert Journal(journal).last_run() is None
+
+
+def test_find_duplicates_narrows_by_size_ends_then_contents(tmp_path):
+    (tmp_path / "sub").mkdir()
+    data = os.urandom(3 * EDGE)
+    middle = data[: EDGE + 1] + b"!" + data[EDGE + 2 :]  # same size and ends
+    for name, content in {
+        "a.bin": data,
+        "sub/b.bin": data,
+        "c.bin": middle,
+        "d.bin": data[:-1] + b"!",
+        "e.txt": b"hi",
+        "f.txt": b"hi",
+        "g.txt": b"ho",
+        "empty1": b"",
+        "empty2": b"",
+    }.items():
+        (tmp_path / name).write_bytes(content)
+    os.link(tmp_path / "a.bin", tmp_path / "a-link.bin")
+    cache = HashCache(tmp_path.parent / "hashes.sqlite")
+
+    groups, stats = find_duplicates(tmp_path, cache=cache, workers=2)
+
+    assert [
+        [os.path.relpath(path, tmp_path) for path in group] for group in groups
+    ] == [
+        ["a.bin", "sub/b.bin"],
+        ["e.txt", "f.txt"],
+    ]
+    assert (stats.files, stats.same_size, stats.edge_hashed) == (10, 7, 7)
+    assert stats.full_hashed == 3  # d.bin differs at the end: never read whole
+    assert (stats.duplicates, stats.wasted) == (2, 3 * EDGE + 2)
+
+    again, stats = find_duplicates(tmp_path, cache=cache, workers=2)
+    assert again == groups and stats.edge_hashed == stats.full_hashed == 0
+
+    (tmp_path / "f.txt").write_bytes(b"ho")
+    os.utime(tmp_path / "f.txt", ns=(0, 10**9))
+    groups, stats = find_duplicates(tmp_path, cache=cache, workers=2)
+    assert stats.edge_hashed == 1 and len(groups) == 2  # f.txt = g.txt now
+    cache.close()
+
+    assert hard_link(groups) == []
+    assert os.path.samefile(tmp_path / "a.bin", tmp_path / "sub" / "b.bin")
+    assert find_duplicates(tmp_path, workers=2)[0] == []
+
+
+def test_a_link_left_by_a_crash_is_not_a_user_file(tmp_path, monkeypatch):
+    make_files(tmp_path, ["a.txt", "b.txt"])
+    (tmp_path / "b.txt").write_text("a.txt")
+    groups, _ = find_duplicates(tmp_path, workers=1)
+
+    def crash(src, dest):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(os, "replace", crash)
+    with pytest.raises(KeyboardInterrupt):
+        hard_link(groups)
+    monkeypatch.undo()
+
+    assert len(os.listdir(tmp_path)) == 3
+    assert sorted(entry.name for entry in engine.scan_files(str(tmp_path))) == [
+        "a.txt",
+        "b.txt",
+    ]
+
+
+def test_dedupe_move_numbers_clashes_and_organizing_skips_our_files(tmp_path):
+    for folder in ("x", "y", "DUPLICATES/y"):
+        (tmp_path / folder).mkdir(parents=True)
+        (tmp_path / folder / "a.txt").write_text("same")
+    folder = f"{tmp_path}/./"  # DUPLICATES is still left out
+
+    main(["dedupe", folder, "--action", "move", "--workers", "2"])
+
+    assert sorted(os.listdir(tmp_path / "DUPLICATES" / "y")) == ["a (1).txt", "a.txt"]
+    assert os.listdir(tmp_path / "x") == ["a.txt"]
+    assert os.listdir(tmp_path / "y") == []
+
+    main(["type", str(tmp_path)])
+
+    assert {".organizer-hashes.sqlite", JOURNAL_NAME} <= set(os.listdir(tmp_path))
+    assert not (tmp_path / "SQLITE").exists()
+
+
+def test_debouncer_waits_for_files_to_stop_changing(tmp_path):
+    path = tmp_path / "download.iso"
+    path.write_bytes(b"x")
+    debouncer = Debouncer(settle=2.0)
+    debouncer.add(str(path), 0.0)
+
+    assert debouncer.settled(0.0) == []
+    path.write_bytes(b"xx")  # still being written
+    assert debouncer.settled(1.0) == [] and debouncer.settled(1.5) == []
+    assert debouncer.settled(2.0) == []  # changed at 1.0: not settled yet
+    assert debouncer.timeout(2.0) == 1.0
+    [arrival] = debouncer.settled(3.0)
+    assert (arrival.name, arrival.stat().st_size) == ("download.iso", 2)
+    assert debouncer.timeout(3.0) is None  # nothing pending: block
+
+
+def test_watch_moves_new_arrivals_only_once_settled(tmp_path):
+    (tmp_path / "old.txt").write_text("there first")
+    (tmp_path / "TXT").mkdir()
+    (tmp_path / "TXT" / "old.txt").write_text("clash")
+    stop = threading.Event()
+    batches = []
+    thread = threading.Thread(
+        target=watch,
+        args=(tmp_path, lambda entry: entry.name.rpartition(".")[2].upper()),
+        kwargs=dict(
+            settle=0.2,
+            interval=0.05,
+            poll=True,
+            stop=stop.is_set,
+            report=batches.append,
+        ),
+    )
+    thread.start()
+    try:
+        for i in range(50):
+            (tmp_path / f"{i}.log").write_text("new")
+        (tmp_path / "movie.mkv.part").write_text("half")
+        deadline = time.monotonic() + 5
+        while len(list(tmp_path.glob("LOG/*.log"))) < 50:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert sorted(os.listdir(tmp_path / "TXT")) == ["old (1).txt", "old.txt"]
+    assert (tmp_path / "movie.mkv.part").exists()
+    assert sum(stats.files for stats in batches) == 51
+
+
+@pytest.mark.parametrize(
+    "header, name, kind",
+    [
+        (b"\xff\xd8\xff\xe0\x00\x10JFIF", "IMG_0001", ("jpg", "image")),
+        (b"MZ\x90\x00\x03\x00", "photo.jpg", ("exe", "executable")),
+        (b"BMW service notes", "notes", ("txt", "text")),  # not a bitmap
+        (b"plain words", "song.mp3", ("txt", "text")),
+        (b"PK\x03\x04\x14\x00", "report.docx", ("docx", "document")),
+        (b"PK\x03\x04\x14\x00", "bundle", ("zip", "archive")),
+        (b"RIFF\x24\x00\x00\x00WAVEfmt ", "a.bin", ("wav", "audio")),
+        (b"\x00\x00\x00\x18ftypheic", "IMG_0002.HEIC", ("heic", "image")),
+        (b"name,score\n", "scores.csv", ("csv", "data")),
+        (b"\x00\x01\x02", "dump", ("no_extension", "other")),
+    ],
+)
+def test_sniff_trusts_contents_over_names(header, name, kind):
+    assert sniff(header, name) == kind
+
+
+def test_classifier_caches_by_inode_and_mtime(tmp_path):
+    path = tmp_path / "scan"
+    path.write_bytes(b"%PDF-1.7\n")
+    st = path.stat()
+    classifier = Classifier()
+    [entry] = os.scandir(tmp_path)
+    assert classifier(entry) == ("pdf", "document")
+
+    # Rewritten with the old mtime, then moved: not read again.
+    path.write_bytes(b"\x89PNG\r\n\x1a\n")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.rename(path, tmp_path / "moved")
+    [entry] = os.scandir(tmp_path)
+    assert classifier(entry) == ("pdf", "document")
+
+    os.utime(tmp_path / "moved", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    [entry] = os.scandir(tmp_path)
+    assert classifier(entry) == ("png", "image")
+
+
+def test_rules_compile_to_a_dispatch_table(tmp_path):
+    rules = RuleSet({
+        "rule": [
+            {"category": "image", "min_size": "1KiB", "dest": "Photos/{year}"},
+            {"category": "image", "dest": "Images/{TYPE}"},
+            {"type": "pdf", "name": "*invoice*", "dest": "Invoices"},
+            {"category": "text", "modified": "2001-*", "dest": "Old/{ext}"},
+        ],
+        "default": {"dest": "Other/{category}"},
+    })
+    files = {
+        "big.png": b"\x89PNG\r\n\x1a\n" + bytes(2048),
+        "small.png": b"\x89PNG\r\n\x1a\n",
+        "May invoice.pdf": b"%PDF-1.4",
+        "manual.pdf": b"%PDF-1.4",
+        "old.md": b"# notes",
+        "new.md": b"# notes",
+    }
+    for name, content in files.items():
+        (tmp_path / name).write_bytes(content)
+    os.utime(tmp_path / "big.png", (0, 1_000_000_000))  # 2001-09
+    os.utime(tmp_path / "old.md", (0, 1_000_000_000))
+
+    dests = {entry.name: rules.destination(entry) for entry in os.scandir(tmp_path)}
+
+    assert dests == {
+        "big.png": os.path.join("Photos", "2001"),
+        "small.png": os.path.join("Images", "PNG"),
+        "May invoice.pdf": "Invoices",
+        "manual.pdf": os.path.join("Other", "document"),
+        "old.md": os.path.join("Old", "md"),
+        "new.md": os.path.join("Other", "text"),
+    }
+    images = rules.candidates(("png", "image"))
+    assert [rule.index for rule in images] == [0, 1]  # 1 has no conditions
+    assert parse_size("1.5 GiB") == 3 * 2**29 and parse_size("2KB") == 2000
+    with pytest.raises(ValueError):
+        RuleSet({"rule": [{"type": "pdf", "dest": "../escape"}]})
+    with pytest.raises(ValueError):
+        RuleSet({"rule": [{"type": "pdf", "dest": "{colour}"}]})
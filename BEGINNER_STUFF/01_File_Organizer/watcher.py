@@ -0,0 +1,239 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import time
+
+from engine import OWN_PREFIX, Move, free_name, move_files, print_progress
+
+# Names browsers and download tools write to before renaming the finished
+# file; a stalled download can sit still for longer than any debounce.
+PARTIAL_SUFFIXES = (".part", ".partial", ".crdownload", ".download", ".tmp", "~")
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; then the name
+
+
+class InotifyWatcher:
+    """Events from Linux inotify. wait() sleeps in select() until the
+    kernel has something, so an idle daemon uses no CPU."""
+
+    def __init__(self, folder):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"Can't watch {folder}")
+
+    def wait(self, timeout):
+        """Names of the entries that changed within `timeout` seconds, or
+        None if events were lost and the folder needs a full look."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    names = None
+                elif names is not None:
+                    name = data[offset : offset + length].rstrip(b"\0")
+                    names.add(os.fsdecode(name))
+                offset += length
+            if names is None:
+                # Drain what's left; the caller rescans anyway.
+                while select.select([self.fd], [], [], 0)[0]:
+                    try:
+                        os.read(self.fd, 1 << 16)
+                    except BlockingIOError:
+                        break
+                return None
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: one stat() of the folder every `interval`
+    seconds, and a listing only when its mtime says something changed."""
+
+    def __init__(self, folder, interval=1.0):
+        self.folder = folder
+        self.interval = interval
+        self.mtime = None
+
+    def wait(self, timeout):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        mtime = os.stat(self.folder).st_mtime_ns
+        # Coarse timestamps can hide a second change within the same tick,
+        # so a folder changed in the last two seconds is always listed.
+        if mtime == self.mtime and time.time_ns() - mtime > 2 * 10**9:
+            return set()
+        self.mtime = mtime
+        return None
+
+    def close(self):
+        pass
+
+
+def make_watcher(folder, interval=1.0, poll=False):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError):  # AttributeError: no inotify in libc
+            pass
+    return PollingWatcher(folder, interval)
+
+
+class Arrival:
+    """A settled file, with the name/path/stat() a destination function
+    reads from a DirEntry."""
+
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, path, st):
+        self.name = os.path.basename(path)
+        self.path = path
+        self._stat = st
+
+    def stat(self):
+        return self._stat
+
+
+class Debouncer:
+    """Files that were seen to change, released once their size and
+    mtime have stayed the same for `settle` seconds.
+
+    They are stat()ed at most every settle / 2 seconds, however fast
+    events come in, so a burst of thousands of files costs one stat per
+    file per check rather than per event.
+    """
+
+    def __init__(self, settle=2.0):
+        self.settle = settle
+        self.pending = {}  # path -> ((size, mtime_ns), time it last changed)
+        self.next_check = 0.0
+
+    def add(self, path, now):
+        if path not in self.pending:
+            self.pending[path] = (None, now)
+
+    def timeout(self, now):
+        """How long the watcher may block: forever with nothing pending."""
+        if not self.pending:
+            return None
+        return max(self.next_check - now, 0.0)
+
+    def settled(self, now):
+        """Pop and return the Arrivals that have settled."""
+        if now < self.next_check:
+            return []
+        self.next_check = now + self.settle / 2
+        ready = []
+        for path, (seen, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                del self.pending[path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != seen:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(Arrival(path, st))
+        return ready
+
+
+class TakenNames:
+    """`name in TakenNames(folder)` asks the filesystem, after the names
+    planned in this batch. A daemon can't remember every name it has
+    moved, and arrivals are few at a time."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.planned = set()
+
+    def __contains__(self, name):
+        return name in self.planned or os.path.lexists(os.path.join(self.folder, name))
+
+
+def plan_arrivals(arrivals, destination, dest_root):
+    taken = {}
+    for arrival in arrivals:
+        dest_dir = os.path.join(dest_root, destination(arrival))
+        names = taken.get(dest_dir) or taken.setdefault(dest_dir, TakenNames(dest_dir))
+        name = free_name(arrival.name, names)
+        names.planned.add(name)
+        yield Move(arrival.path, os.path.join(dest_dir, name))
+
+
+def watch(
+    folder,
+    destination,
+    dest_root=None,
+    settle=2.0,
+    interval=1.0,
+    poll=False,
+    run=None,
+    stop=None,
+    report=None,
+):
+    """Organize files as they arrive in `folder`, until Ctrl+C or until
+    `stop()` is true, which is checked every `interval` seconds.
+
+    Files already there are picked up first. After that, nothing is
+    listed again unless the watcher loses track (inotify overflow, or a
+    change seen by polling). Each batch of settled files is passed to
+    `run(moves)`, which returns MoveStats (default: move_files), and the
+    stats to `report`.
+    """
+    folder = os.path.normpath(folder)
+    dest_root = folder if dest_root is None else os.path.normpath(dest_root)
+    run = run or move_files
+    report = report or print_progress
+    watcher = make_watcher(folder, interval, poll)
+    debouncer = Debouncer(settle)
+    names = None  # None: look at everything in the folder
+    try:
+        while stop is None or not stop():
+            now = time.monotonic()
+            if names is None:
+                with os.scandir(folder) as entries:
+                    names = [entry.name for entry in entries if entry.is_file()]
+            for name in names:
+                # Our own journal and hash cache live here too.
+                if name.endswith(PARTIAL_SUFFIXES) or name.startswith(OWN_PREFIX):
+                    continue
+                debouncer.add(os.path.join(folder, name), now)
+            arrivals = debouncer.settled(now)
+            if arrivals:
+                report(run(plan_arrivals(arrivals, destination, dest_root)))
+            timeout = debouncer.timeout(time.monotonic())
+            if stop is not None:
+                timeout = interval if timeout is None else min(timeout, interval)
+            names = watcher.wait(timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
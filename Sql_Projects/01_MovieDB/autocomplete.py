@@ -0,0 +1,146 @@
+import heapq
+from bisect import bisect_left
+from dataclasses import dataclass
+
+import numpy as np
+
+# Sorts after any character a name can continue a prefix with.
+LAST_CHAR = "\U0010ffff"
+
+
+@dataclass(frozen=True)
+class Completion:
+    name: str
+    row_id: int
+    score: float  # what completions are ranked by, higher first
+
+
+class PrefixIndex:
+    """Names sorted case-insensitively, with the top-k of any prefix.
+
+    The names starting with a prefix are one contiguous run of the sorted
+    array, found by binary search. A sparse table (the best-scoring entry
+    of every power-of-two run) gives the best entry of any run in O(1), so
+    the top k come out of a heap of split runs in O(k log k), however many
+    names share the prefix. IDs, scores and the table are NumPy arrays;
+    the table takes 4 bytes per name and level, 80 MB for a million names.
+
+    Names added after the last build go to a sorted side list that is
+    searched too, and merged in once it holds `compact_after` names or
+    1/`growth` of the index, whichever is more: a merge is O(n), so this
+    keeps adding a name O(log n) amortized however large the index is.
+    """
+
+    def __init__(self, compact_after=1_000, growth=16):
+        self.compact_after = compact_after
+        self.growth = growth
+        self.keys = []
+        self.names = []
+        self.row_ids = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0, dtype=np.float64)
+        self._levels = []
+        self._extra = []  # sorted (key, name, row_id, score)
+
+    def __len__(self):
+        return len(self.keys) + len(self._extra)
+
+    def load(self, rows):
+        """Rebuild from (name, row_id, score) rows; NULL names are skipped."""
+        rows = [row for row in rows if row[0] is not None]
+        names = [row[0] for row in rows]
+        self._extra = []
+        self._build(
+            [name.casefold() for name in names],
+            names,
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+        )
+        return self
+
+    def add(self, name, row_id, score=0.0):
+        """Index one more name; adding a (name, row_id) again does nothing."""
+        key = name.casefold()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.names[i] == name and self.row_ids[i] == row_id:
+                return
+            i += 1
+        i = bisect_left(self._extra, (key, name, row_id))
+        if i < len(self._extra) and self._extra[i][1:3] == (name, row_id):
+            return
+        self._extra.insert(i, (key, name, row_id, score))
+        if len(self._extra) >= max(self.compact_after, len(self.keys) // self.growth):
+            self.compact()
+
+    def compact(self):
+        """Merge the side list into the sorted arrays."""
+        extra, self._extra = self._extra, []
+        # Both parts are sorted already, which sorted() merges in O(n).
+        self._build(
+            self.keys + [entry[0] for entry in extra],
+            self.names + [entry[1] for entry in extra],
+            np.concatenate([self.row_ids, [entry[2] for entry in extra]]),
+            np.concatenate([self.scores, [entry[3] for entry in extra]]),
+        )
+
+    def _build(self, keys, names, row_ids, scores):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.names = [names[i] for i in order]
+        order = np.array(order, dtype=np.intp)
+        self.row_ids = np.asarray(row_ids, dtype=np.int64)[order]
+        self.scores = scores = np.asarray(scores, dtype=np.float64)[order]
+
+        # _levels[j][i]: position of the best entry in [i, i + 2**j), the
+        # earliest one on ties so equal scores stay in alphabetical order.
+        level = np.arange(len(keys), dtype=np.int32)
+        self._levels = [level]
+        width = 1
+        while 2 * width <= len(keys):
+            left, right = level[:-width], level[width:]
+            level = np.where(scores[right] > scores[left], right, left)
+            self._levels.append(level)
+            width *= 2
+
+    def _best(self, lo, hi):
+        j = (hi - lo).bit_length() - 1
+        # item() reads a plain int/float, skipping a NumPy scalar per read.
+        left = self._levels[j].item(lo)
+        right = self._levels[j].item(hi - (1 << j))
+        return right if self.scores.item(right) > self.scores.item(left) else left
+
+    def complete(self, prefix, k=10):
+        """Top-k Completions of `prefix` (case-insensitive), best first."""
+        key = prefix.casefold()
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + LAST_CHAR, lo)
+
+        found = []
+        heap = []
+        if lo < hi:
+            best = self._best(lo, hi)
+            heap.append((-self.scores.item(best), best, lo, hi))
+        while heap and len(found) < k:
+            _, best, lo, hi = heapq.heappop(heap)
+            found.append(best)
+            for run_lo, run_hi in ((lo, best), (best + 1, hi)):
+                if run_lo < run_hi:
+                    pos = self._best(run_lo, run_hi)
+                    heapq.heappush(heap, (-self.scores.item(pos), pos, run_lo, run_hi))
+
+        completions = [
+            Completion(self.names[pos], self.row_ids.item(pos), self.scores.item(pos))
+            for pos in found
+        ]
+        lo = bisect_left(self._extra, (key,))
+        hi = bisect_left(self._extra, (key + LAST_CHAR,), lo)
+        if lo < hi:
+            extra = heapq.nsmallest(
+                k, self._extra[lo:hi], key=lambda entry: (-entry[3], entry[0])
+            )
+            completions += [
+                Completion(name, row_id, score) for _, name, row_id, score in extra
+            ]
+            completions.sort(key=lambda c: (-c.score, c.name.casefold()))
+            del completions[k:]
+        return completions
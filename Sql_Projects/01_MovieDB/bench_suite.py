@@ -0,0 +1,330 @@
+import argparse
+import csv
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from benchmarks import quiet
+from moviedb import MovieDB, UserInfo
+from synthetic import GENRES, NOUNS, populate
+
+OPERATIONS = {}
+
+
+def operation(name):
+    """Register `func(db, data, rng, i)`, one call of the operation; `i`
+    counts calls so writes can make unique names."""
+
+    def register(func):
+        OPERATIONS[name] = func
+        return func
+
+    return register
+
+
+def any_user(data, rng):
+    return rng.randrange(data.scale.users) + 1
+
+
+def any_movie(data, rng):
+    return data.movie_name(rng.randrange(data.scale.movies))
+
+
+def any_actor(data, rng):
+    return data.actor_name(rng.randrange(data.scale.actors))
+
+
+@operation("signup")
+def op_signup(db, data, rng, i):
+    db.signup(UserInfo("Bench", "User", f"bench{i}@example.com", "pw", ""))
+
+
+@operation("login")
+def op_login(db, data, rng, i):
+    db.login(data.email(rng.randrange(data.scale.users)), "password")
+
+
+@operation("add_movie")
+def op_add_movie(db, data, rng, i):
+    db.add_movie(f"Bench Movie {i}", "A benchmark.", "2024-01-01", "Nobody")
+
+
+@operation("rename_movie")
+def op_rename_movie(db, data, rng, i):
+    db.rename_movie(f"Bench Movie {i}", f"Bench Movie {i} (Director's Cut)")
+
+
+@operation("add_genre")
+def op_add_genre(db, data, rng, i):
+    db.add_genre(any_movie(data, rng), rng.choice(GENRES))
+
+
+@operation("add_actor")
+def op_add_actor(db, data, rng, i):
+    db.add_actor(f"Bench Actor {i}", "1980-01-01", 1)
+
+
+@operation("rename_actor")
+def op_rename_actor(db, data, rng, i):
+    db.rename_actor(f"Bench Actor {i}", f"Bench Actor {i} Jr.")
+
+
+@operation("link_actor_to_movie")
+def op_link_actor(db, data, rng, i):
+    db.link_actor_to_movie(any_movie(data, rng), any_actor(data, rng))
+
+
+@operation("review_movie")
+def op_review_movie(db, data, rng, i):
+    db.review_movie(any_user(data, rng), any_movie(data, rng), rng.randint(0, 10))
+
+
+@operation("toggle_watchlist")
+def op_toggle_watchlist(db, data, rng, i):
+    db.toggle_watchlist(any_user(data, rng), any_movie(data, rng))
+
+
+@operation("add_friend")
+def op_add_friend(db, data, rng, i):
+    db.add_friend(any_user(data, rng), data.email(rng.randrange(data.scale.users)))
+
+
+@operation("find_movie_id")
+def op_find_movie_id(db, data, rng, i):
+    db.find_movie_id(any_movie(data, rng))
+
+
+@operation("find_actor_id")
+def op_find_actor_id(db, data, rng, i):
+    db.find_actor_id(any_actor(data, rng))
+
+
+@operation("iter_top_movies")
+def op_iter_top_movies(db, data, rng, i):
+    list(islice(db.iter_top_movies(chunk_size=50), 50))
+
+
+@operation("leaderboard")
+def op_leaderboard(db, data, rng, i):
+    db.leaderboard(10)
+
+
+@operation("leaderboard_genre")
+def op_leaderboard_genre(db, data, rng, i):
+    db.leaderboard(10, genre=rng.choice(GENRES))
+
+
+@operation("search_movies")
+def op_search_movies(db, data, rng, i):
+    db.search_movies(rng.choice(NOUNS).lower())
+
+
+@operation("search_movies_genre")
+def op_search_movies_genre(db, data, rng, i):
+    db.search_movies(rng.choice(NOUNS).lower(), genre=rng.choice(GENRES))
+
+
+@operation("genre_facets")
+def op_genre_facets(db, data, rng, i):
+    db.genre_facets(rng.choice(NOUNS).lower())
+
+
+@operation("genre_facets_all")
+def op_genre_facets_all(db, data, rng, i):
+    db.genre_facets()
+
+
+@operation("autocomplete")
+def op_autocomplete(db, data, rng, i):
+    db.autocomplete(any_movie(data, rng)[: rng.randint(1, 6)])
+
+
+@operation("autocomplete_actor")
+def op_autocomplete_actor(db, data, rng, i):
+    db.autocomplete(any_actor(data, rng)[: rng.randint(1, 6)], kind="actor")
+
+
+@operation("friends_within")
+def op_friends_within(db, data, rng, i):
+    db.friends_within(any_user(data, rng), hops=2)
+
+
+@operation("friends_within_sql")
+def op_friends_within_sql(db, data, rng, i):
+    db.friends_within(any_user(data, rng), hops=2, cached=False)
+
+
+@operation("friend_suggestions")
+def op_friend_suggestions(db, data, rng, i):
+    db.friend_suggestions(any_user(data, rng))
+
+
+@operation("friends_rated_highly")
+def op_friends_rated_highly(db, data, rng, i):
+    db.friends_rated_highly(any_user(data, rng))
+
+
+@operation("recommend")
+def op_recommend(db, data, rng, i):
+    db.recommend(any_user(data, rng))
+
+
+# Maintenance operations, timed once per scale.
+ONE_OFFS = {
+    "rebuild_recommendations": lambda db: db.rebuild_recommendations(full=True),
+    "repair_rating_aggregates": lambda db: db.repair_rating_aggregates(),
+    "rebuild_search_index": lambda db: db.rebuild_search_index(),
+    "set_leaderboard_prior": lambda db: db.set_leaderboard_prior(),
+}
+
+
+def parse_scale(text):
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def result(scale, name, samples):
+    p50, p99 = (
+        (statistics.median(samples), statistics.quantiles(samples, n=100)[98])
+        if len(samples) > 1
+        else (samples[0], samples[0])
+    )
+    mean = statistics.fmean(samples)
+    return {
+        "scale": scale,
+        "operation": name,
+        "calls": len(samples),
+        "mean_ms": round(mean * 1e3, 4),
+        "p50_ms": round(p50 * 1e3, 4),
+        "p99_ms": round(p99 * 1e3, 4),
+        "ops_per_sec": round(1 / mean, 1) if mean else None,
+    }
+
+
+def run_scale(workdir, rows, args):
+    db = MovieDB(workdir)
+    try:
+        start = time.perf_counter()
+        data, _ = populate(db, rows, seed=args.seed)
+        loaded = time.perf_counter() - start
+        results = [result(rows, "populate", [loaded])]
+        print(f"{rows:,} rows loaded in {loaded:.1f}s")
+
+        for name, run in ONE_OFFS.items():
+            start = time.perf_counter()
+            run(db)
+            results.append(result(rows, name, [time.perf_counter() - start]))
+
+        rng = random.Random(args.seed)
+        for name, func in OPERATIONS.items():
+            if args.only and name not in args.only:
+                continue
+            samples = []
+            deadline = time.perf_counter() + args.max_seconds
+            with quiet():
+                for i in range(args.repeat):
+                    start = time.perf_counter()
+                    func(db, data, rng, i)
+                    samples.append(time.perf_counter() - start)
+                    if time.perf_counter() > deadline:
+                        break
+            results.append(result(rows, name, samples))
+            row = results[-1]
+            print(
+                f"  {name:<24} {row['p50_ms']:>10.3f} ms p50 "
+                f"{row['p99_ms']:>10.3f} ms p99 ({row['calls']} calls)"
+            )
+        return results
+    finally:
+        db.close()
+
+
+def write_report(path, results, meta):
+    if path.suffix.lower() == ".csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        path.write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+
+
+def read_report(path):
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            return [
+                {**row, "scale": int(row["scale"]), "p50_ms": float(row["p50_ms"])}
+                for row in csv.DictReader(f)
+            ]
+    return json.loads(path.read_text())["results"]
+
+
+def regressions(results, baseline, tolerance, noise_ms=0.05):
+    """(scale, operation, old p50, new p50) for every operation whose p50
+    grew by more than `tolerance` (0.2 = 20%) and by more than `noise_ms`,
+    so microsecond jitter on cache hits is not reported."""
+    old = {(row["scale"], row["operation"]): row["p50_ms"] for row in baseline}
+    slower = []
+    for row in results:
+        before = old.get((row["scale"], row["operation"]))
+        after = row["p50_ms"]
+        if before and after > before * (1 + tolerance) and after - before > noise_ms:
+            slower.append((row["scale"], row["operation"], before, after))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MovieDB benchmark suite")
+    parser.add_argument("--scales", default="10k,100k,1M", help="e.g. 10k,1M,10M")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=200, help="calls per operation")
+    parser.add_argument(
+        "--max-seconds", type=float, default=5.0, help="time limit per operation"
+    )
+    parser.add_argument("--only", nargs="*", choices=sorted(OPERATIONS))
+    parser.add_argument("--report", type=Path, default=Path("bench_report.json"))
+    parser.add_argument("--baseline", type=Path, help="earlier report to compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--db-dir", type=Path, help="Where to create the databases (default: temp)"
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.db_dir or Path(tmp)
+        for rows in map(parse_scale, args.scales.split(",")):
+            workdir = root / f"scale-{rows}"
+            workdir.mkdir(parents=True, exist_ok=True)
+            results.extend(run_scale(workdir, rows, args))
+
+    meta = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+    }
+    write_report(args.report, results, meta)
+    print(f"Report written to {args.report}")
+
+    if args.baseline:
+        slower = regressions(results, read_report(args.baseline), args.tolerance)
+        for scale, name, before, after in slower:
+            print(f"⚠️  {name} at {scale:,} rows: {before:.3f} -> {after:.3f} ms p50")
+        if not slower:
+            print("No regressions.")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
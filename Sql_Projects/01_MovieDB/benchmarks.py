@@ -0,0 +1,574 @@
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from coredb import CoreMovieDB
+from group_commit import GroupCommit
+from moviedb import MovieDB
+from recommend import positions
+from sharded import ShardedMovieDB
+from snapshot import Snapshot, rating_histogram, reviews_per_genre_year
+from sqltrace import SQLTracer
+from synthetic import populate
+
+BENCHMARKS = {}
+
+
+def benchmark(name, **db_options):
+    def register(func):
+        BENCHMARKS[name] = (func, db_options)
+        return func
+
+    return register
+
+
+@contextlib.contextmanager
+def timer():
+    result = {}
+    start = time.perf_counter()
+    yield result
+    result["seconds"] = time.perf_counter() - start
+
+
+def quiet():
+    # The MovieDB methods print a line per call.
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100)
+    return cuts[49] * 1e3, cuts[98] * 1e3
+
+
+@benchmark("ratings")
+def bench_ratings(db, args):
+    """Per-review cost while one movie collects `size` reviews."""
+    size = args.size
+    with quiet():
+        db.add_movie("Benchmark", "", "2000-01-01", "Nobody")
+    # Measure the SQL work, not the disk's fsync rate.
+    db.cur.execute("PRAGMA synchronous = OFF")
+    window = max(size // 10, 1)
+
+    print(f"{'reviews':>10} {'µs/review':>10} {'AVG() µs':>10}")
+    for start in range(0, size, window):
+        users = range(start, min(start + window, size))
+        with timer() as t, quiet():
+            for user_id in users:
+                db.review_movie(user_id, "Benchmark", user_id % 11)
+        # What the old review_movie paid on every call at this size.
+        with timer() as avg:
+            db.cur.execute("SELECT AVG(rating) FROM collection WHERE movie_id=1")
+            db.cur.fetchone()
+        per_review = t["seconds"] / len(users) * 1e6
+        print(f"{users[-1] + 1:>10,} {per_review:>10.1f} {avg['seconds'] * 1e6:>10.0f}")
+
+
+@benchmark("lookups")
+def bench_lookups(db, args):
+    """review_movie() with the name -> ID cache on and off."""
+    names = [f"Movie {i}" for i in range(1000)]
+    db.bulk_import(movies=({"name": name} for name in names))
+    db.cur.execute("PRAGMA synchronous = OFF")
+
+    for run, enabled in enumerate((False, True)):
+        for cache in db.name_cache.values():
+            cache.enabled = enabled
+        first_user = run * args.size  # both runs insert new reviews
+        with timer() as t, quiet():
+            for i in range(first_user, first_user + args.size):
+                db.review_movie(i, names[i % len(names)], i % 11)
+        per_call = t["seconds"] / args.size * 1e6
+        print(f"cache {'on ' if enabled else 'off'}: {per_call:.1f} µs/review")
+    print(db.cache_stats()["movie"])
+
+
+@benchmark("group-commit")
+def bench_group_commit(db, args):
+    """add_actor() throughput per commit policy, on the disk under --db-dir."""
+    policies = {
+        "autocommit, synchronous=FULL": None,
+        "autocommit, synchronous=NORMAL": GroupCommit(1, synchronous="NORMAL"),
+        "group of 100, NORMAL": GroupCommit(100, synchronous="NORMAL"),
+        "group of 1000, NORMAL": GroupCommit(1000, synchronous="NORMAL"),
+        "group of 1000, OFF": GroupCommit(1000, synchronous="OFF"),
+    }
+    for run, (label, policy) in enumerate(policies.items()):
+        workdir = args.workdir / f"group-commit-{run}"
+        workdir.mkdir()
+        run_db = MovieDB(workdir, group_commit=policy)
+        with timer() as t:
+            for i in range(args.size):
+                run_db.add_actor(f"Actor {i}", "1970-01-01", i)
+            run_db.flush()
+        run_db.close()
+        print(f"{label:<32} {args.size / t['seconds']:>10,.0f} writes/s")
+
+    with timer() as t:
+        with db.batch():
+            for i in range(args.size):
+                db.add_actor(f"Actor {i}", "1970-01-01", i)
+    print(f"{'one batch()':<32} {args.size / t['seconds']:>10,.0f} writes/s")
+
+
+@benchmark("concurrency", concurrent=True)
+def bench_concurrency(db, args):
+    """N reader threads searching while one writer keeps adding reviews."""
+    movies = ({"name": f"Movie {i}", "description": f"plot {i}"} for i in range(1000))
+    db.bulk_import(movies=movies)
+    stop = threading.Event()
+    reads, writes = [], []
+
+    def reader(n):
+        latencies = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            db.search_movies(f"movie {n % 1000}")
+            latencies.append(time.perf_counter() - start)
+            n += 1
+        reads.extend(latencies)
+
+    def writer():
+        user_id = 0
+        while not stop.is_set():
+            user_id += 1
+            start = time.perf_counter()
+            db.review_movie(user_id, f"Movie {user_id % 1000}", user_id % 11)
+            writes.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.threads)]
+    threads.append(threading.Thread(target=writer))
+    with quiet():
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    print(f"{'op':>8} {'count':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for op, samples in (("read", reads), ("write", writes)):
+        p50, p99 = percentiles(samples)
+        print(f"{op:>8} {len(samples):>8,} {p50:>8.2f} {p99:>8.2f}")
+
+
+def backend_workload(db, args):
+    """{step: (calls, seconds)} for one run of the backends workload."""
+    movies = min(args.size, 100_000)
+    calls = min(args.size, 2_000)
+    rng = random.Random(0)
+    names = [f"Movie {rng.randrange(movies)}" for _ in range(calls)]
+    steps = {}
+
+    def step(name, count, work):
+        with timer() as t, quiet():
+            work()
+        steps[name] = (count, t["seconds"])
+
+    step(
+        "bulk_import",
+        movies,
+        lambda: db.bulk_import(
+            movies=({"name": f"Movie {i}", "director": "Nobody"} for i in range(movies))
+        ),
+    )
+    step(
+        "add_movie",
+        calls,
+        lambda: [db.add_movie(f"New {i}", "", "", "") for i in range(calls)],
+    )
+    step(
+        "review_movie",
+        calls,
+        lambda: [db.review_movie(i, name, i % 11) for i, name in enumerate(names)],
+    )
+
+    def batched_reviews():
+        with db.batch():
+            for i, name in enumerate(names):
+                db.review_movie(calls + i, name, i % 11)
+
+    step("review_movie in batch()", calls, batched_reviews)
+    step("find_movie_id", calls, lambda: [db.find_movie_id(name) for name in names])
+    step("leaderboard", calls, lambda: [db.leaderboard(10) for _ in range(calls)])
+
+    def parallel_reads():
+        def reader(n):
+            for i in range(n, calls, args.threads):
+                db.leaderboard(10)
+                db.search_movies(names[i])
+
+        threads = [
+            threading.Thread(target=reader, args=(n,)) for n in range(args.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    step(f"reads from {args.threads} threads", calls, parallel_reads)
+    return steps
+
+
+@benchmark("backends")
+def bench_backends(db, args):
+    """The same workload on the raw sqlite3 MovieDB and on the SQLAlchemy
+    Core backend, both in WAL mode with synchronous=NORMAL."""
+    db.cur.execute("PRAGMA journal_mode = WAL")
+    db.cur.execute("PRAGMA synchronous = NORMAL")
+    core_dir = args.workdir / "core"
+    core_dir.mkdir(exist_ok=True)
+    core = CoreMovieDB(core_dir, pool_size=args.threads)
+    try:
+        results = {"sqlite3": backend_workload(db, args)}
+        results["sqlalchemy"] = backend_workload(core, args)
+    finally:
+        core.close()
+
+    print(f"{'step':<26} {'sqlite3 µs/op':>14} {'sqlalchemy µs/op':>17} {'ratio':>6}")
+    for name, (calls, raw) in results["sqlite3"].items():
+        _, core = results["sqlalchemy"][name]
+        print(
+            f"{name:<26} {raw / calls * 1e6:>14.1f} {core / calls * 1e6:>17.1f} "
+            f"{core / raw:>6.2f}"
+        )
+
+
+@benchmark("shards")
+def bench_shards(db, args):
+    """Reviews/s from --threads writers, one file vs users over N shards,
+    with commits synced to disk (FULL) or not (NORMAL, the default)."""
+    movies = [{"name": f"Movie {i}"} for i in range(1000)]
+    print(
+        f"{'sync':>6} {'shards':>6} {'reviews/s':>10} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'sync_ratings s':>14}"
+    )
+    for synchronous in ("NORMAL", "FULL"):
+        for shards in (1, 2, 4, 8):
+            workdir = args.workdir / f"shards-{synchronous}-{shards}"
+            workdir.mkdir(exist_ok=True)
+            sharded = ShardedMovieDB(workdir, shards=shards, sync_every=None)
+            sharded.bulk_import(movies=movies)
+            for shard in sharded.shards:
+                shard.conn.execute(f"PRAGMA synchronous = {synchronous}")
+            stop = threading.Event()
+            latencies = []
+
+            def writer(n):
+                rng = random.Random(n)
+                samples = []
+                while not stop.is_set():
+                    user_id = rng.randrange(1, 100_000)
+                    movie = f"Movie {rng.randrange(1000)}"
+                    start = time.perf_counter()
+                    sharded.review_movie(user_id, movie, rng.randint(0, 10))
+                    samples.append(time.perf_counter() - start)
+                latencies.extend(samples)
+
+            threads = [
+                threading.Thread(target=writer, args=(i,)) for i in range(args.threads)
+            ]
+            with quiet():
+                for thread in threads:
+                    thread.start()
+                time.sleep(args.seconds)
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            with timer() as sync:
+                sharded.sync_ratings()
+            sharded.close()
+            p50, p99 = percentiles(latencies)
+            print(
+                f"{synchronous:>6} {shards:>6} {len(latencies) / args.seconds:>10,.0f} "
+                f"{p50:>8.3f} {p99:>8.3f} {sync['seconds']:>14.2f}"
+            )
+
+
+@benchmark("snapshot")
+def bench_snapshot(db, args):
+    """Export a snapshot of `size` synthetic rows, then run the reports on
+    it and as SQL on the live file."""
+    populate(db, args.size)
+    with timer() as export:
+        path = db.export_snapshot()
+    live = db.db_file.stat().st_size / 2**20
+    print(
+        f"export {export['seconds']:.2f}s, {path.stat().st_size / 2**20:.1f} MiB "
+        f"(MovieDB.db {live:.1f} MiB)"
+    )
+    with timer() as load:
+        snapshot = Snapshot(path)
+    print(f"load {load['seconds']:.2f}s")
+
+    reports = {
+        "rating histogram": (
+            "SELECT CAST(round(rating) AS INTEGER), COUNT(*) FROM collection "
+            "WHERE rating IS NOT NULL GROUP BY 1",
+            rating_histogram,
+        ),
+        "reviews per genre and year": (
+            """
+            SELECT genre.name, CAST(substr(movie.release_date, 1, 4) AS INTEGER),
+                   COUNT(*), AVG(c.rating)
+            FROM collection AS c
+            JOIN movie_genre USING (movie_id)
+            JOIN movie USING (movie_id)
+            JOIN genre USING (genre_id)
+            WHERE c.rating IS NOT NULL
+            GROUP BY 1, 2
+            """,
+            reviews_per_genre_year,
+        ),
+    }
+    print(f"{'report':<28} {'SQL ms':>8} {'snapshot ms':>12}")
+    for name, (sql, report) in reports.items():
+        with timer() as on_sql:
+            db.cur.execute(sql)
+            db.cur.fetchall()
+        with timer() as on_snapshot:
+            report(snapshot)
+        print(
+            f"{name:<28} {on_sql['seconds'] * 1e3:>8.1f} "
+            f"{on_snapshot['seconds'] * 1e3:>12.1f}"
+        )
+
+
+@benchmark("recommend")
+def bench_recommend(db, args):
+    """Item-item recommendations over `size` ratings: index build, an
+    incremental rebuild, and per-user latency against a plain SQL join."""
+    rng = random.Random(42)
+    n_movies, n_users = 10_000, max(args.size // 20, 1)
+    db.bulk_import(movies=({"name": f"Movie {i}"} for i in range(n_movies)))
+    db.cur.execute("PRAGMA synchronous = OFF")
+
+    def add_ratings(count):
+        # A few blockbusters get most of the ratings.
+        rows = (
+            (
+                rng.randrange(n_users),
+                min(int(rng.paretovariate(0.8)), n_movies),
+                rng.randint(1, 10),
+            )
+            for _ in range(count)
+        )
+        with db.batch():
+            db.cur.executemany(
+                "INSERT OR REPLACE INTO collection (user_id, movie_id, rating) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+
+    add_ratings(args.size)
+    with timer() as t:
+        index = db.rebuild_recommendations(full=True)
+    print(f"full build ({len(index.movie_ids):,} movies): {t['seconds']:.1f}s")
+
+    before = index
+    add_ratings(args.size // 100)
+    with timer() as t:
+        index = db.rebuild_recommendations()
+    pos, known = positions(before.movie_ids, index.movie_ids)
+    unchanged = known & (before.fingerprints[pos] == index.fingerprints).all(axis=1)
+    print(
+        f"rebuild after +1% ratings ({(~unchanged).sum():,} movies changed): "
+        f"{t['seconds']:.1f}s"
+    )
+
+    brute_force = """
+        SELECT other.movie_id, SUM(mine.rating * other.rating) AS score
+        FROM collection AS mine
+        JOIN collection AS peer ON peer.movie_id = mine.movie_id
+        JOIN collection AS other ON other.user_id = peer.user_id
+        WHERE mine.user_id = ? AND other.movie_id NOT IN (
+            SELECT movie_id FROM collection WHERE user_id = ?
+        )
+        GROUP BY other.movie_id
+        ORDER BY score DESC
+        LIMIT 10
+    """
+    users = rng.sample(range(n_users), 20)
+    for label, run in (
+        ("index", lambda user_id: db.recommend(user_id)),
+        (
+            "SQL join",
+            lambda user_id: db.cur.execute(brute_force, (user_id, user_id)).fetchall(),
+        ),
+    ):
+        samples = []
+        for user_id in users:
+            with timer() as t:
+                run(user_id)
+            samples.append(t["seconds"])
+        p50, p99 = percentiles(samples)
+        print(f"{label:>8}: p50 {p50:,.1f} ms, p99 {p99:,.1f} ms")
+
+
+def toggle_three_steps(conn, user_id, movie_id):
+    """toggle_watchlist() as it used to be: SELECT, then UPDATE or INSERT.
+    Returns False when the write did not change anything, i.e. another
+    caller toggled in between and this toggle was lost."""
+    row = conn.execute(
+        "SELECT watchlist FROM collection WHERE user_id=? AND movie_id=?",
+        (user_id, movie_id),
+    ).fetchone()
+    if row:
+        changed = conn.execute(
+            "UPDATE collection SET watchlist=? "
+            "WHERE user_id=? AND movie_id=? AND watchlist IS NOT ?",
+            (not row[0], user_id, movie_id, not row[0]),
+        ).rowcount
+    else:
+        changed = conn.execute(
+            "INSERT OR IGNORE INTO collection (user_id, movie_id, watchlist) "
+            "VALUES (?, ?, TRUE)",
+            (user_id, movie_id),
+        ).rowcount
+    conn.commit()
+    return bool(changed)
+
+
+def toggle_upsert(conn, user_id, movie_id):
+    """The statement toggle_watchlist() runs now, without the method around
+    it, for a like-for-like comparison with toggle_three_steps()."""
+    rows = conn.execute(
+        "INSERT INTO collection (user_id, movie_id, watchlist) VALUES (?, ?, TRUE) "
+        "ON CONFLICT (user_id, movie_id) "
+        "DO UPDATE SET watchlist = NOT ifnull(watchlist, FALSE) RETURNING watchlist",
+        (user_id, movie_id),
+    ).fetchall()
+    conn.commit()
+    return bool(rows[0][0])
+
+
+@benchmark("contention", concurrent=True)
+def bench_contention(db, args):
+    """--threads callers, each with its own connection, toggling the same
+    watchlist entry `size` times in total: old three-step flow vs UPSERT."""
+    with quiet():
+        db.add_movie("Contended", "", "", "")
+    per_thread = max(args.size // args.threads, 1)
+
+    def run(toggle):
+        dbs = [MovieDB(args.workdir, concurrent=True) for _ in range(args.threads)]
+        dbs[0].cur.execute("DELETE FROM collection")
+        dbs[0].conn.commit()
+        latencies, results = [], []
+
+        def caller(caller_db):
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                results.append(toggle(caller_db))
+                latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=caller, args=(d,)) for d in dbs]
+        with quiet():
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        (final,) = dbs[0].cur.execute("SELECT watchlist FROM collection").fetchone()
+        for caller_db in dbs:
+            caller_db.close()
+        return latencies, results, bool(final)
+
+    total = per_thread * args.threads
+    expected = total % 2 == 1
+    print(f"{'flow':>12} {'p50 ms':>8} {'p99 ms':>8} {'lost':>6} {'final ok':>9}")
+    for label, toggle in (
+        ("three-step", lambda d: toggle_three_steps(d.conn, 1, 1)),
+        ("upsert", lambda d: toggle_upsert(d.conn, 1, 1)),
+        ("method", lambda d: d.toggle_watchlist(1, "Contended")),
+    ):
+        latencies, results, final = run(toggle)
+        if label == "three-step":
+            lost = results.count(False)
+        else:
+            # Atomic toggles alternate: as many "in" as "out", +1 if odd.
+            lost = abs(sum(results) - (total - sum(results)) - (total % 2))
+        p50, p99 = percentiles(latencies)
+        ok = "yes" if final == expected else "no"
+        print(f"{label:>12} {p50:>8.3f} {p99:>8.3f} {lost:>6} {ok:>9}")
+
+
+@benchmark("login-history")
+def bench_login_history(db, args):
+    """`size` logins over a year: logins per day from the rollup vs raw
+    history, then purging all but 30 days and vacuuming."""
+    start = datetime.now() - timedelta(days=365)
+    rng = random.Random(42)
+    rows = (
+        (
+            rng.randrange(1, 10_000),
+            start + timedelta(seconds=rng.randrange(365 * 86400)),
+        )
+        for _ in range(args.size)
+    )
+    with timer() as t:
+        with db.batch():
+            db.cur.executemany(
+                "INSERT INTO login_history (user_id, login_time) VALUES (?, ?)",
+                ((user, when.isoformat(" ")) for user, when in rows),
+            )
+    print(f"insert with rollup trigger: {args.size / t['seconds']:,.0f} logins/s")
+
+    raw = (
+        "SELECT date(login_time) AS day, COUNT(*) FROM login_history "
+        "GROUP BY day ORDER BY day"
+    )
+    for label, query in (
+        ("rollup", lambda: db.logins_per_day()),
+        ("raw history", lambda: db.cur.execute(raw).fetchall()),
+        ("rollup, one user", lambda: db.logins_per_day(user_id=42)),
+    ):
+        with timer() as t:
+            days = query()
+        print(f"{label:>18}: {len(days)} days in {t['seconds'] * 1e3:,.1f} ms")
+
+    size = db.db_file.stat().st_size
+    with timer() as t:
+        deleted, freed = db.apply_login_retention(raw_days=30)
+    print(
+        f"purged {deleted:,} rows and freed {freed:,} pages in {t['seconds']:.1f}s; "
+        f"file {size / 2**20:,.0f} -> {db.db_file.stat().st_size / 2**20:,.0f} MiB"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MovieDB benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=4, help="reader threads")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument(
+        "--db-dir", type=Path, help="Where to create MovieDB.db (default: temp dir)"
+    )
+    parser.add_argument(
+        "--trace", action="store_true", help="Print SQL timings at the end"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        func, db_options = BENCHMARKS[args.name]
+        if db_options.get("concurrent"):
+            db_options["readers"] = args.threads
+        args.workdir = args.db_dir or Path(tmp)
+        if args.trace:
+            db_options["trace"] = SQLTracer(slow_ms=float("inf"))
+        db = MovieDB(args.workdir, **db_options)
+        try:
+            func(db, args)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
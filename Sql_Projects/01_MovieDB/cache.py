@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU map with hit/miss counters.
+
+    maxsize=0 (or enabled=False) turns it into a pass-through, which is
+    handy for benchmarking the uncached path.
+
+    `version` goes up on every invalidate() and clear(). A value looked up
+    without holding off writers is put() with the version read before the
+    lookup, and dropped if a write invalidated anything in between.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.enabled = maxsize > 0
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or MISSING."""
+        if not self.enabled:
+            return MISSING
+        with self._lock:
+            value = self._data.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, version=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self.version += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,749 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    ForeignKey,
+    Integer,
+    MetaData,
+    PrimaryKeyConstraint,
+    Table,
+    Text,
+    bindparam,
+    create_engine,
+    desc,
+    event,
+    func,
+    insert,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL
+
+from autocomplete import PrefixIndex
+from cache import MISSING, LRUCache
+from importer import FIELDS, IMPORT_ORDER, ImportStats, batched, read_records
+from migrations import genre_name, migrate
+from moviedb import LeaderboardEntry, MovieDB, MovieRow, SearchHit, UserInfo
+
+# The tables the Core backend reads and writes, as migrations.py leaves
+# them. On SQLite the schema (with its triggers and FTS index) still comes
+# from the migrations; these definitions only describe it to SQLAlchemy.
+metadata = MetaData()
+
+t_user = Table(
+    "user",
+    metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("first_name", Text),
+    Column("last_name", Text),
+    Column("email", Text, unique=True),
+    Column("password", Text),
+    Column("bio", Text),
+    Column("creation_date", Text),
+    Column("last_login", Text),
+)
+
+t_login_history = Table(
+    "login_history",
+    metadata,
+    Column("history_id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.user_id")),
+    Column("login_time", Text),
+)
+
+t_movie = Table(
+    "movie",
+    metadata,
+    Column("movie_id", Integer, primary_key=True),
+    Column("name", Text),
+    Column("description", Text),
+    Column("release_date", Text),
+    Column("director", Text),
+    Column("rating", Float, default=0.0),
+    Column("rating_sum", Float, nullable=False, default=0.0),
+    Column("rating_count", Integer, nullable=False, default=0),
+)
+
+t_actor = Table(
+    "actor",
+    metadata,
+    Column("actor_id", Integer, primary_key=True),
+    Column("name", Text),
+    Column("dob", Text),
+    Column("movies_count", Integer),
+)
+
+t_movie_actor = Table(
+    "movie_actor",
+    metadata,
+    Column("movie_id", Integer, ForeignKey("movie.movie_id")),
+    Column("actor_id", Integer, ForeignKey("actor.actor_id")),
+    PrimaryKeyConstraint("movie_id", "actor_id"),
+)
+
+t_genre = Table(
+    "genre",
+    metadata,
+    Column("genre_id", Integer, primary_key=True),
+    Column("name", Text, nullable=False, unique=True),
+)
+
+t_movie_genre = Table(
+    "movie_genre",
+    metadata,
+    Column("movie_id", Integer, ForeignKey("movie.movie_id")),
+    Column("genre_id", Integer, ForeignKey("genre.genre_id")),
+    PrimaryKeyConstraint("movie_id", "genre_id"),
+)
+
+t_collection = Table(
+    "collection",
+    metadata,
+    Column("user_id", Integer, ForeignKey("user.user_id")),
+    Column("movie_id", Integer, ForeignKey("movie.movie_id")),
+    Column("rating", Float),
+    Column("watchlist", Boolean, default=False),
+    Column("review", Text),
+    PrimaryKeyConstraint("user_id", "movie_id"),
+)
+
+t_friendlist = Table(
+    "friendlist",
+    metadata,
+    Column("user_id", Integer, ForeignKey("user.user_id")),
+    Column("friend_id", Integer, ForeignKey("user.user_id")),
+    PrimaryKeyConstraint("user_id", "friend_id"),
+)
+
+t_leaderboard = Table(
+    "leaderboard",
+    metadata,
+    Column("movie_id", Integer, primary_key=True),
+    Column("score", Float, nullable=False),
+)
+
+t_genre_leaderboard = Table(
+    "genre_leaderboard",
+    metadata,
+    Column("genre_id", Integer),
+    Column("movie_id", Integer),
+    Column("score", Float, nullable=False),
+    PrimaryKeyConstraint("genre_id", "movie_id"),
+)
+
+# INSERT ... ON CONFLICT is dialect-specific in SQLAlchemy.
+UPSERT = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def statements(upsert):
+    """Every statement CoreMovieDB runs more than once, built up front with
+    bind parameters: building a Core construct costs more per call than
+    running the SQL, and a prebuilt one also skips the compiled cache's
+    key computation."""
+    review = upsert(t_collection)
+    toggle = upsert(t_collection).values(watchlist=True)
+    genre_id = (
+        select(t_genre.c.genre_id).where(t_genre.c.name == bindparam("genre"))
+    ).scalar_subquery()
+    board = (t_leaderboard.c.movie_id, t_movie.c.name, t_leaderboard.c.score)
+    genre_board = (
+        t_genre_leaderboard.c.movie_id,
+        t_movie.c.name,
+        t_genre_leaderboard.c.score,
+    )
+    top = select(
+        t_movie.c.movie_id,
+        t_movie.c.name,
+        t_movie.c.rating,
+        t_movie.c.rating_count,
+        t_movie.c.release_date,
+        t_movie.c.director,
+    )
+    return {
+        "movie_id": select(t_movie.c.movie_id)
+        .where(t_movie.c.name == bindparam("name"))
+        .limit(1),
+        "actor_id": select(t_actor.c.actor_id)
+        .where(t_actor.c.name == bindparam("name"))
+        .limit(1),
+        "user_id": select(t_user.c.user_id).where(t_user.c.email == bindparam("email")),
+        "signup": insert(t_user),
+        "login": update(t_user)
+        .where(t_user.c.email == bindparam("b_email"))
+        .where(t_user.c.password == bindparam("b_password"))
+        .values(last_login=bindparam("when"))
+        .returning(t_user.c.user_id),
+        "login_history": insert(t_login_history),
+        "movie_ids": select(t_movie.c.name, t_movie.c.movie_id).order_by(
+            t_movie.c.movie_id
+        ),
+        "actor_ids": select(t_actor.c.name, t_actor.c.actor_id).order_by(
+            t_actor.c.actor_id
+        ),
+        "import_movie": insert(t_movie).returning(t_movie.c.movie_id, t_movie.c.name),
+        "import_actor": insert(t_actor).returning(t_actor.c.actor_id, t_actor.c.name),
+        "add_movie": insert(t_movie),
+        "add_actor": insert(t_actor),
+        "add_genre": upsert(t_genre).on_conflict_do_nothing(index_elements=["name"]),
+        "link_genre": upsert(t_movie_genre)
+        .from_select(
+            ["movie_id", "genre_id"],
+            select(bindparam("movie", type_=Integer), genre_id),
+        )
+        .on_conflict_do_nothing(),
+        "link_genres": upsert(t_movie_genre).on_conflict_do_nothing(),
+        "genre_ids": select(t_genre.c.name, t_genre.c.genre_id).where(
+            t_genre.c.name.in_(bindparam("names", expanding=True))
+        ),
+        "link_actor": upsert(t_movie_actor).on_conflict_do_nothing(),
+        "review": review.on_conflict_do_update(
+            index_elements=["user_id", "movie_id"],
+            set_={"rating": review.excluded.rating, "review": review.excluded.review},
+        ),
+        "toggle": toggle.on_conflict_do_update(
+            index_elements=["user_id", "movie_id"],
+            set_={"watchlist": ~func.coalesce(t_collection.c.watchlist, False)},
+        ).returning(t_collection.c.watchlist),
+        "rename_movie": update(t_movie)
+        .where(t_movie.c.name == bindparam("old"))
+        .values(name=bindparam("new")),
+        "rename_actor": update(t_actor)
+        .where(t_actor.c.name == bindparam("old"))
+        .values(name=bindparam("new")),
+        "befriend": upsert(t_friendlist).on_conflict_do_nothing(),
+        # As in MovieDB.iter_top_movies: a row-value comparison would only
+        # seek on rating and scan the earlier rows of a tie on every page.
+        "top_movies": union_all(
+            top.where(
+                t_movie.c.rating == bindparam("rating"),
+                t_movie.c.movie_id < bindparam("movie_id"),
+            ),
+            top.where(t_movie.c.rating < bindparam("rating")),
+        )
+        .order_by(desc("rating"), desc("movie_id"))
+        .limit(bindparam("limit")),
+        "leaderboard": select(*board, t_movie.c.rating, t_movie.c.rating_count)
+        .join(t_movie, t_movie.c.movie_id == t_leaderboard.c.movie_id)
+        .order_by(t_leaderboard.c.score.desc(), t_leaderboard.c.movie_id)
+        .limit(bindparam("limit")),
+        "genre_leaderboard": select(
+            *genre_board, t_movie.c.rating, t_movie.c.rating_count
+        )
+        .join(t_movie, t_movie.c.movie_id == t_genre_leaderboard.c.movie_id)
+        .where(t_genre_leaderboard.c.genre_id == genre_id)
+        .order_by(t_genre_leaderboard.c.score.desc(), t_genre_leaderboard.c.movie_id)
+        .limit(bindparam("limit")),
+    }
+
+
+def now():
+    # The text sqlite3's default datetime adapter writes for MovieDB.
+    return datetime.now().isoformat(" ")
+
+
+class CoreMovieDB:
+    """MovieDB on a SQLAlchemy Core engine instead of a raw sqlite3
+    connection, with the same methods and return types for the part of
+    the API main.py and bulk loads use: users, movies, actors, genres,
+    reviews, the watchlist, add_friend, iter_top_movies, the leaderboard,
+    search_movies (without genre=), autocomplete, bulk_import, batch()
+    and transaction(). The rest (iter_search, genre_facets, the other
+    friends_* methods, recommendations, login rollups and retention,
+    maintenance, snapshots) is MovieDB only; open the same file with
+    MovieDB for those.
+
+    Every call checks a connection out of the engine's pool (sized by
+    `pool_size`/`max_overflow`), so one instance can be shared between
+    threads. Multi-row inserts go through SQLAlchemy's "insertmanyvalues":
+    rows are sent `insertmanyvalues_page_size` at a time as one
+    INSERT ... VALUES (...), (...) RETURNING statement, which also hands
+    back the new IDs.
+
+    Give a directory (like MovieDB) for a file-based SQLite database, whose
+    schema the migrations create and upgrade, or `url=` for any engine
+    whose schema is already in place. Rating aggregates, the leaderboard
+    and search are trigger- and FTS5-maintained in the SQLite schema; a
+    server database needs its own DDL for them.
+    """
+
+    def __init__(
+        self,
+        db_path=None,
+        url=None,
+        pool_size=5,
+        max_overflow=10,
+        pool_timeout=30.0,
+        insertmanyvalues_page_size=1000,
+        name_cache=4096,
+        echo=False,
+    ):
+        if url is None:
+            self.db_file = Path(db_path) / "MovieDB.db"
+            # Not an f-string: make_url would read "?", "#" and "%" in the
+            # path as URL syntax and open some other file.
+            url = URL.create("sqlite", database=str(self.db_file))
+        self.engine = create_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            insertmanyvalues_page_size=insertmanyvalues_page_size,
+            echo=echo,
+        )
+        dialect = self.engine.dialect.name
+        if dialect not in UPSERT:
+            raise ValueError(f"Unsupported database: {dialect}")
+        self._sql = statements(UPSERT[dialect])
+        if dialect == "sqlite":
+            event.listen(self.engine, "connect", self._configure_sqlite)
+            self.create_tables()
+        self.name_cache = {"movie": LRUCache(name_cache), "actor": LRUCache(name_cache)}
+        self._local = threading.local()
+        self._completions = {}
+        self._completions_lock = threading.Lock()
+
+    @staticmethod
+    def _configure_sqlite(dbapi_conn, _):
+        # The same settings MovieDB uses on its connections. auto_vacuum
+        # only takes effect on a new file, and setting it waits on the write
+        # lock, so it is left alone once the file has pages.
+        if dbapi_conn.execute("PRAGMA page_count").fetchone() == (0,):
+            dbapi_conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        dbapi_conn.execute("PRAGMA recursive_triggers = ON")
+        dbapi_conn.execute("PRAGMA journal_mode = WAL")
+        dbapi_conn.execute("PRAGMA synchronous = NORMAL")
+        dbapi_conn.execute("PRAGMA busy_timeout = 30000")
+
+    @staticmethod
+    def _begin(conn):
+        # sqlite3 only starts a transaction before the first write, so the
+        # first call's SAVEPOINT would start it and its RELEASE commit it.
+        dbapi_conn = conn.connection.dbapi_connection
+        if conn.dialect.name == "sqlite" and not dbapi_conn.in_transaction:
+            dbapi_conn.execute("BEGIN")
+
+    def create_tables(self):
+        raw = self.engine.raw_connection()
+        try:
+            return migrate(raw.driver_connection)
+        finally:
+            raw.close()
+
+    @contextmanager
+    def _connect(self):
+        """A pooled connection in a transaction, or inside batch() or
+        transaction() their connection, in a savepoint of its own."""
+        conn = getattr(self._local, "conn", None)
+        try:
+            if conn is None:
+                with self.engine.begin() as conn:
+                    yield conn
+                return
+            # Plain SQL: begin_nested() tripled the cost of a call in a batch.
+            conn.exec_driver_sql("SAVEPOINT call")
+            try:
+                yield conn
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK TO call")
+                raise
+            finally:
+                conn.exec_driver_sql("RELEASE call")
+        except BaseException:
+            # Cached IDs may belong to rows that were just rolled back.
+            self._clear_name_cache()
+            raise
+
+    @contextmanager
+    def batch(self):
+        """Commit every call made inside the `with` block once, at the end,
+        as MovieDB.batch(): a call that fails rolls back alone, and what
+        the others wrote is committed even if the block raises."""
+        if getattr(self._local, "conn", None) is not None:
+            yield
+            return
+        with self.engine.connect() as conn:
+            txn = conn.begin()
+            self._begin(conn)
+            self._local.conn, self._local.written = conn, []
+            try:
+                yield
+            finally:
+                self._local.conn = None
+                try:
+                    txn.commit()
+                finally:
+                    self._invalidate_written()
+
+    @contextmanager
+    def transaction(self):
+        """Make the calls inside the `with` block atomic, as
+        MovieDB.transaction(): they are all committed together, or all
+        rolled back if the block raises. Nested, it is a savepoint."""
+        if getattr(self._local, "conn", None) is not None:
+            with self._connect():
+                yield self
+            return
+        try:
+            with self._connect() as conn:
+                self._begin(conn)
+                self._local.conn, self._local.written = conn, []
+                try:
+                    yield self
+                finally:
+                    self._local.conn = None
+        finally:
+            self._invalidate_written()
+
+    def _invalidate(self, table, *names):
+        # Inside batch() or transaction() other threads see the old names
+        # until the block commits, and may cache them again before that;
+        # so the names are dropped once more when it ends.
+        self.name_cache[table].invalidate(*names)
+        self._drop_completions()
+        if getattr(self._local, "conn", None) is not None:
+            self._local.written.append((table, names))
+
+    def _invalidate_written(self):
+        written = getattr(self._local, "written", None) or []
+        self._local.written = None
+        for table, names in written:
+            self.name_cache[table].invalidate(*names)
+        if written:
+            self._drop_completions()
+
+    def _lookup_id(self, conn, table, name):
+        cache = self.name_cache[table]
+        row_id = cache.get(name)
+        if row_id is MISSING:
+            # Another thread may add or rename `name` while this looks, so
+            # the answer is put() with the version from before (see
+            # LRUCache). Inside batch() or transaction() it may be a write
+            # of this thread's that is not committed yet, so it isn't cached.
+            version = cache.version
+            row_id = conn.scalar(self._sql[f"{table}_id"], {"name": name})
+            if getattr(self._local, "conn", None) is None:
+                cache.put(name, row_id, version)  # "not found" is cached too
+        return row_id
+
+    def _clear_name_cache(self):
+        for cache in self.name_cache.values():
+            cache.clear()
+        self._drop_completions()
+
+    def _drop_completions(self):
+        with self._completions_lock:
+            self._completions.clear()
+
+    def autocomplete(self, prefix, kind="movie", limit=10, by="popularity"):
+        """Top `limit` names starting with `prefix`; see MovieDB.autocomplete.
+        Any added or renamed name drops the index, which reloads on next use."""
+        if (kind, by) not in MovieDB.COMPLETION_SOURCES:
+            raise ValueError(f"Can't autocomplete {kind} names by {by}")
+        with self._completions_lock:
+            index = self._completions.get((kind, by))
+            if index is None:
+                with self._connect() as conn:
+                    sql = MovieDB.COMPLETION_SOURCES[kind, by]
+                    rows = conn.exec_driver_sql(sql).all()
+                index = self._completions[kind, by] = PrefixIndex().load(rows)
+            return index.complete(prefix, limit)
+
+    def _find_id(self, table, name):
+        # A cache hit needs no pooled connection at all.
+        row_id = self.name_cache[table].get(name)
+        if row_id is MISSING:
+            with self._connect() as conn:
+                row_id = self._lookup_id(conn, table, name)
+        return row_id
+
+    def find_movie_id(self, name):
+        return self._find_id("movie", name)
+
+    def find_actor_id(self, name):
+        return self._find_id("actor", name)
+
+    def cache_stats(self):
+        return {table: cache.stats() for table, cache in self.name_cache.items()}
+
+    def signup(self, info: UserInfo):
+        with self._connect() as conn:
+            conn.execute(
+                self._sql["signup"],
+                {
+                    "first_name": info.fname,
+                    "last_name": info.lname,
+                    "email": info.email,
+                    "password": info.password,
+                    "bio": info.bio,
+                    "creation_date": now(),
+                    "last_login": now(),
+                },
+            )
+
+    def login(self, email, password):
+        when = now()
+        with self._connect() as conn:
+            user_id = conn.scalar(
+                self._sql["login"],
+                {"b_email": email, "b_password": password, "when": when},
+            )
+            if user_id is not None:
+                conn.execute(
+                    self._sql["login_history"],
+                    {"user_id": user_id, "login_time": when},
+                )
+        return user_id
+
+    def add_movie(self, name, desc, date, director):
+        with self._connect() as conn:
+            conn.execute(
+                self._sql["add_movie"],
+                {
+                    "name": name,
+                    "description": desc,
+                    "release_date": date,
+                    "director": director,
+                },
+            )
+        self._invalidate("movie", name)
+        print("Movie added successfully.\n")
+
+    def add_genre(self, movie_name, genre):
+        genre = genre_name(genre)
+        with self._connect() as conn:
+            movie_id = self._lookup_id(conn, "movie", movie_name)
+            if movie_id and genre:
+                conn.execute(self._sql["add_genre"], {"name": genre})
+                conn.execute(
+                    self._sql["link_genre"], {"movie": movie_id, "genre": genre}
+                )
+
+    def add_actor(self, name, dob, movies_count):
+        with self._connect() as conn:
+            conn.execute(
+                self._sql["add_actor"],
+                {"name": name, "dob": dob, "movies_count": movies_count},
+            )
+        self._invalidate("actor", name)
+
+    def link_actor_to_movie(self, movie_name, actor_name):
+        with self._connect() as conn:
+            movie_id = self._lookup_id(conn, "movie", movie_name)
+            actor_id = self._lookup_id(conn, "actor", actor_name)
+            if movie_id and actor_id:
+                conn.execute(
+                    self._sql["link_actor"],
+                    {"movie_id": movie_id, "actor_id": actor_id},
+                )
+
+    def review_movie(self, user_id, movie_name, rating, review_text=""):
+        with self._connect() as conn:
+            movie_id = self._lookup_id(conn, "movie", movie_name)
+            if not movie_id:
+                print("Movie not found.")
+                return
+            conn.execute(
+                self._sql["review"],
+                {
+                    "user_id": user_id,
+                    "movie_id": movie_id,
+                    "rating": rating,
+                    "review": review_text,
+                },
+            )
+        print("Review added.\n")
+
+    def toggle_watchlist(self, user_id, movie_name):
+        """Flip the movie in or out of the user's watchlist and return the
+        new state (None if there is no such movie)."""
+        with self._connect() as conn:
+            movie_id = self._lookup_id(conn, "movie", movie_name)
+            if not movie_id:
+                return None
+            watchlist = conn.scalar(
+                self._sql["toggle"], {"user_id": user_id, "movie_id": movie_id}
+            )
+        print("Watchlist updated.\n")
+        return bool(watchlist)
+
+    def rename_movie(self, old_name, new_name):
+        with self._connect() as conn:
+            conn.execute(self._sql["rename_movie"], {"old": old_name, "new": new_name})
+        self._invalidate("movie", old_name, new_name)
+
+    def rename_actor(self, old_name, new_name):
+        with self._connect() as conn:
+            conn.execute(self._sql["rename_actor"], {"old": old_name, "new": new_name})
+        self._invalidate("actor", old_name, new_name)
+
+    def add_friend(self, user_id, friend_email):
+        with self._connect() as conn:
+            friend_id = conn.scalar(self._sql["user_id"], {"email": friend_email})
+            if friend_id:
+                conn.execute(
+                    self._sql["befriend"], {"user_id": user_id, "friend_id": friend_id}
+                )
+        print("Friend added.\n" if friend_id else "User not found.\n")
+
+    def iter_top_movies(self, after=None, chunk_size=500):
+        """Yield MovieRows by rating, best first, after the (rating, movie_id)
+        keyset `after` if given."""
+        after = after or (float("inf"), 0)
+        while True:
+            params = {"rating": after[0], "movie_id": after[1], "limit": chunk_size}
+            with self._connect() as conn:
+                result = conn.execute(self._sql["top_movies"], params)
+                rows = [MovieRow(*row) for row in result]
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1].cursor
+
+    def leaderboard(self, limit=10, genre=None):
+        """Top movies by Bayesian average, overall or for one genre."""
+        with self._connect() as conn:
+            if genre is None:
+                rows = conn.execute(self._sql["leaderboard"], {"limit": limit})
+            else:
+                rows = conn.execute(
+                    self._sql["genre_leaderboard"], {"genre": genre, "limit": limit}
+                )
+            return [LeaderboardEntry(*row) for row in rows]
+
+    def show_top_movies(self, limit=5):
+        for entry in self.leaderboard(limit):
+            print(f"{entry.name} - {entry.rating:.1f}/10 ({entry.votes} votes)")
+
+    def bulk_import(
+        self,
+        movies=None,
+        genres=None,
+        actors=None,
+        links=None,
+        batch_size=50_000,
+        progress=None,
+    ):
+        """Import {kind: path-or-iterable} of records like MovieDB.bulk_import,
+        one transaction per batch (without its resume-after-failure).
+
+        Names are resolved through in-memory dicts as in BulkImporter, and
+        new movies and actors are inserted with insertmanyvalues and
+        RETURNING, so their IDs come back with the insert.
+        """
+        sources = {"movie": movies, "genre": genres, "actor": actors, "link": links}
+        ids = {}
+        results = []
+        try:
+            for kind in IMPORT_ORDER:
+                source = sources[kind]
+                if source is None:
+                    continue
+                if isinstance(source, (str, Path)):
+                    source = read_records(source)
+                stats = ImportStats(kind)
+                start = time.perf_counter()
+                for records in batched(source, batch_size):
+                    with self._connect() as conn:
+                        self._import_batch(conn, kind, records, ids, stats)
+                    stats.rows += len(records)
+                    stats.seconds = time.perf_counter() - start
+                    if progress:
+                        progress(stats)
+                results.append(stats)
+        finally:
+            # Names cached as "not found" may exist now.
+            self._clear_name_cache()
+        return results
+
+    def _name_index(self, conn, ids, table):
+        # First row wins, matching "SELECT ... WHERE name=?" + fetchone().
+        if table not in ids:
+            ids[table] = {}
+            for name, row_id in conn.execute(self._sql[f"{table}_ids"]):
+                ids[table].setdefault(name, row_id)
+        return ids[table]
+
+    def _import_batch(self, conn, kind, records, ids, stats):
+        if kind in ("movie", "actor"):
+            names = self._name_index(conn, ids, kind)
+            # RETURNING carries the name along with each new ID, so the rows
+            # may come back in any order: asking SQLAlchemy to sort them by
+            # parameter order makes it fall back to one INSERT per row on
+            # SQLite's AUTOINCREMENT keys.
+            rows = conn.execute(
+                self._sql[f"import_{kind}"],
+                [
+                    {field: record.get(field) for field in FIELDS[kind]}
+                    for record in records
+                ],
+            )
+            for row_id, name in sorted(rows):
+                names.setdefault(name, row_id)
+            return
+
+        movies = self._name_index(conn, ids, "movie")
+        if kind == "genre":
+            # As in BulkImporter: no genre row for a movie that isn't there.
+            wanted = [(movies.get(r["movie"]), genre_name(r["genre"])) for r in records]
+            wanted = [
+                (movie_id, name) for movie_id, name in wanted if movie_id and name
+            ]
+            names = list({name for _, name in wanted})
+            if names:
+                conn.execute(self._sql["add_genre"], [{"name": n} for n in names])
+            genres = dict(conn.execute(self._sql["genre_ids"], {"names": names}).all())
+            sql, columns = self._sql["link_genres"], ("movie_id", "genre_id")
+            pairs = [(movie_id, genres[name]) for movie_id, name in wanted]
+        else:
+            actors = self._name_index(conn, ids, "actor")
+            sql, columns = self._sql["link_actor"], ("movie_id", "actor_id")
+            pairs = [(movies.get(r["movie"]), actors.get(r["actor"])) for r in records]
+        rows = [dict(zip(columns, pair)) for pair in pairs if all(pair)]
+        stats.skipped += len(records) - len(rows)
+        if rows:
+            conn.execute(sql, rows)
+
+    def search_movies(self, keyword, limit=20):
+        """SearchHits from the SQLite FTS5 index, best match first."""
+        query = MovieDB._fts_query(keyword)
+        if not query:
+            return []
+        sql = """
+            SELECT movie_id, highlight(movie_fts, 0, '[', ']'),
+                   snippet(movie_fts, 1, '[', ']', '…', 12),
+                   movie.rating, bm25(movie_fts, 10.0, 1.0) AS score
+            FROM movie_fts JOIN movie ON movie.movie_id = movie_fts.rowid
+            WHERE movie_fts MATCH ?
+            ORDER BY score, movie_id
+            LIMIT ?
+        """
+        with self._connect() as conn:
+            rows = conn.exec_driver_sql(sql, (query, limit)).all()
+        return [SearchHit(*row) for row in rows]
+
+    def search_movie(self, keyword):
+        results = self.search_movies(keyword)
+        if results:
+            for hit in results:
+                print(f"{hit.name} ({hit.rating}/10)\n  {hit.snippet}\n")
+        else:
+            print("No movies found.")
+
+    def flush(self):
+        """Nothing to do: there is no group commit here, and batch() commits
+        when its block ends."""
+
+    def reset_autocomplete(self):
+        """Drop the autocomplete indexes; the next call reloads them."""
+        self._drop_completions()
+
+    def close(self):
+        self.engine.dispose()
@@ -0,0 +1,71 @@
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+# "SCAN movie" (or "SCAN TABLE movie" on older SQLite) is a full table scan.
+# "SCAN movie USING INDEX ..." walks an index in order and is fine.
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+# "FROM collection AS c" / "JOIN movie m": plans name tables by their alias.
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+
+DML = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+class QueryPlanAuditor:
+    """Trace callback that runs EXPLAIN QUERY PLAN on every statement.
+
+    It explains through its own read-only connection, because a trace
+    callback must not use the connection that is being traced. The same
+    auditor may be installed on several connections used from many threads.
+    """
+
+    def __init__(self, db_file):
+        uri = Path(db_file).resolve().as_uri() + "?mode=ro"  # escapes ?, # and %
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.plans = {}
+        self.full_scans = []
+        self._lock = threading.Lock()
+        self._table_names = None
+
+    def __call__(self, statement):
+        if statement in self.plans or not statement.lstrip().upper().startswith(DML):
+            return
+        try:
+            with self._lock:
+                rows = self.conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        except sqlite3.Error:
+            return  # exceptions raised in a trace callback are swallowed anyway
+        details = [row[3] for row in rows]
+        self.plans[statement] = details
+        scans = [detail for detail in details if self._is_table_scan(detail, statement)]
+        if scans:
+            self.full_scans.append((statement, scans))
+
+    def _is_table_scan(self, detail, statement):
+        # Scanning a CTE or a subquery ("SCAN reach") is not a table scan.
+        match = FULL_SCAN.match(detail)
+        if not match:
+            return False
+        name = match.group(1)
+        aliases = {
+            alias: table for table, alias in TABLE_ALIAS.findall(statement) if alias
+        }
+        return self._tables().intersection({name, aliases.get(name)}) != set()
+
+    def _tables(self):
+        if self._table_names is None:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT name FROM sqlite_schema WHERE type = 'table'"
+                ).fetchall()
+            self._table_names = {row[0] for row in rows}
+        return self._table_names
+
+    def report(self):
+        for statement, scans in self.full_scans:
+            print(f"⚠️  {', '.join(scans)}\n    {' '.join(statement.split())}")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass
+class GroupCommit:
+    """When buffered writes get committed, and how durable a commit is.
+
+    Up to `max_writes` writes, or `max_delay` seconds of them, can be lost
+    if the process dies before they are committed. `synchronous` is the
+    SQLite PRAGMA: FULL fsyncs every commit, NORMAL (safe with WAL) may
+    lose the last commits on power loss, OFF leaves flushing to the OS.
+    """
+
+    max_writes: int = 1000
+    max_delay: float = 0.05
+    synchronous: str = "NORMAL"
+
+
+class GroupCommitter:
+    """Turns many small write transactions into a few large commits.
+
+    MovieDB calls written() after every write while holding its write lock;
+    the commit happens right away unless a GroupCommit policy is set or a
+    batch() is open.
+    """
+
+    def __init__(self, conn, lock, policy=None):
+        self.conn = conn
+        self.lock = lock
+        self.policy = policy
+        self.pending = 0
+        self._depth = 0
+        self._timer = None
+        if policy:
+            conn.execute(f"PRAGMA synchronous = {policy.synchronous}")
+
+    @property
+    def buffering(self):
+        return self.policy is not None or self._depth > 0
+
+    def written(self):
+        if not self.buffering:
+            self.conn.commit()
+            return
+        self.pending += 1
+        if self._depth or not self.policy:
+            return  # an open batch() commits when it ends
+        if self.pending >= self.policy.max_writes:
+            self._commit()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.policy.max_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _commit(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.conn.commit()
+        self.pending = 0
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self._commit()
+
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._depth -= 1
+                if not self._depth:
+                    self._commit()
@@ -0,0 +1,216 @@
+import csv
+import json
+import time
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+
+from migrations import genre_name
+
+# Column order used for every executemany() call, per record kind.
+FIELDS = {
+    "movie": ("name", "description", "release_date", "director"),
+    "actor": ("name", "dob", "movies_count"),
+    "genre": ("movie", "genre"),
+    "link": ("movie", "actor"),
+}
+
+# Kinds are imported in this order so names can be resolved to IDs.
+IMPORT_ORDER = ("movie", "actor", "genre", "link")
+
+
+@dataclass
+class ImportStats:
+    kind: str
+    rows: int = 0
+    skipped: int = 0
+    resumed_from: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def read_records(path):
+    """Stream dict records from a .csv or .jsonl file, one row at a time."""
+    path = Path(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(f)
+        elif path.suffix.lower() in (".jsonl", ".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unsupported import format: {path.suffix}")
+
+
+def batched(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkImporter:
+    """Loads large catalogs with executemany() inside big transactions.
+
+    Movie and actor names are resolved to IDs through in-memory dicts, and
+    new rows get their IDs assigned here so no per-row SELECT is needed.
+    Progress for file sources is checkpointed in the same transaction as
+    each batch, so re-running after a failure resumes where it stopped.
+    It is cleared once the file is done, so importing the same path again
+    later starts from the top.
+    """
+
+    def __init__(self, conn, batch_size=50_000, progress=None):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.progress = progress
+        self._ids = {}
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS import_progress (
+                source TEXT PRIMARY KEY,
+                rows_done INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def _name_index(self, table):
+        # First row wins, matching "SELECT ... WHERE name=?" + fetchone().
+        if table not in self._ids:
+            ids = {}
+            for name, row_id in self.conn.execute(
+                f"SELECT name, {table}_id FROM {table} ORDER BY {table}_id"
+            ):
+                ids.setdefault(name, row_id)
+            self._ids[table] = ids
+        return self._ids[table]
+
+    def _next_id(self, table):
+        (max_id,) = self.conn.execute(f"SELECT MAX({table}_id) FROM {table}").fetchone()
+        return (max_id or 0) + 1
+
+    def _rows(self, kind, batch, stats):
+        if kind in ("movie", "actor"):
+            ids = self._name_index(kind)
+            next_id = self._next_id(kind)
+            rows = []
+            for record in batch:
+                values = tuple(record.get(field) for field in FIELDS[kind])
+                ids.setdefault(values[0], next_id)
+                rows.append((next_id, *values))
+                next_id += 1
+            return rows
+
+        movies = self._name_index("movie")
+        if kind == "genre":
+            pairs = [(movies.get(r["movie"]), genre_name(r["genre"])) for r in batch]
+            pairs = [(movie_id, name) for movie_id, name in pairs if movie_id and name]
+            genres = self._genre_ids(name for _, name in pairs)
+            rows = [(movie_id, genres[name]) for movie_id, name in pairs]
+        else:
+            actors = self._name_index("actor")
+            rows = [
+                (movies[r["movie"]], actors[r["actor"]])
+                for r in batch
+                if r["movie"] in movies and r["actor"] in actors
+            ]
+        stats.skipped += len(batch) - len(rows)
+        return rows
+
+    def _genre_ids(self, names):
+        # Genre names not seen yet become rows of the genre dimension, in
+        # the batch's transaction so a rollback takes them back out too.
+        ids = self._name_index("genre")
+        new = []
+        next_id = None
+        for name in names:
+            if name not in ids:
+                next_id = next_id or self._next_id("genre")
+                ids[name] = next_id
+                new.append((next_id, name))
+                next_id += 1
+        self.conn.executemany("INSERT INTO genre (genre_id, name) VALUES (?, ?)", new)
+        return ids
+
+    def _insert(self, kind, rows):
+        sql = {
+            "movie": "INSERT INTO movie (movie_id, name, description, release_date, "
+            "director) VALUES (?, ?, ?, ?, ?)",
+            "actor": "INSERT INTO actor (actor_id, name, dob, movies_count) "
+            "VALUES (?, ?, ?, ?)",
+            "genre": "INSERT OR IGNORE INTO movie_genre (movie_id, genre_id) "
+            "VALUES (?, ?)",
+            "link": "INSERT OR IGNORE INTO movie_actor (movie_id, actor_id) "
+            "VALUES (?, ?)",
+        }[kind]
+        self.conn.executemany(sql, rows)
+
+    def import_records(self, kind, records, source=None):
+        if kind not in FIELDS:
+            raise ValueError(f"Unknown record kind: {kind}")
+        stats = ImportStats(kind)
+        done = 0
+        if source is not None:
+            row = self.conn.execute(
+                "SELECT rows_done FROM import_progress WHERE source=?", (source,)
+            ).fetchone()
+            done = stats.resumed_from = row[0] if row else 0
+
+        start = time.perf_counter()
+        # Rows before `done` were committed by an earlier run.
+        for batch in batched(islice(records, done, None), self.batch_size):
+            try:
+                self._insert(kind, self._rows(kind, batch, stats))
+                done += len(batch)
+                if source is not None:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO import_progress (source, rows_done) "
+                        "VALUES (?, ?)",
+                        (source, done),
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                self._ids.clear()  # may hold IDs from the rolled-back batch
+                raise
+            stats.rows += len(batch)
+            stats.seconds = time.perf_counter() - start
+            if self.progress:
+                self.progress(stats)
+
+        if source is not None:
+            self.conn.execute("DELETE FROM import_progress WHERE source=?", (source,))
+            self.conn.commit()
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def import_file(self, kind, path):
+        path = Path(path).resolve()
+        return self.import_records(kind, read_records(path), source=f"{kind}:{path}")
+
+    def run(self, sources):
+        """Import {kind: path-or-iterable} in dependency order."""
+        results = []
+        for kind in IMPORT_ORDER:
+            source = sources.get(kind)
+            if source is None:
+                continue
+            if isinstance(source, (str, Path)):
+                results.append(self.import_file(kind, source))
+            else:
+                results.append(self.import_records(kind, source))
+        return results
+
+
+def print_progress(stats):
+    print(
+        f"{stats.kind}: {stats.resumed_from + stats.rows:,} rows "
+        f"({stats.rows_per_sec:,.0f} rows/s)"
+    )
@@ -1,7 +1,37 @@
+import os
 from getpass import getpass
 from pathlib import Path
 
-from moviedb import MovieDB, UserInfo
+from moviedb import UserInfo, open_moviedb
+
+try:
+    import readline  # Tab completion of names; not available on Windows.
+except ImportError:
+    readline = None
+
+
+def ask_name(db, prompt, kind="movie"):
+    """input() with Tab completing movie (or actor) names, most popular
+    first, through db.autocomplete()."""
+    if readline is None:
+        return input(prompt)
+
+    def complete(text, state):
+        # With no word delimiters, `text` is the whole line typed so far.
+        if state == 0:
+            complete.matches = [c.name for c in db.autocomplete(text, kind)]
+        return complete.matches[state] if state < len(complete.matches) else None
+
+    old_completer = readline.get_completer()
+    old_delims = readline.get_completer_delims()
+    readline.set_completer(complete)
+    readline.set_completer_delims("")
+    readline.parse_and_bind("tab: complete")
+    try:
+        return input(prompt)
+    finally:
+        readline.set_completer(old_completer)
+        readline.set_completer_delims(old_delims)
 
 
 def handle_login_or_signup(db):
@@ -59,11 +89,12 @@ def handle_add_movie_with_genres_actors(db):
         db.add_genre(name, genre)
 
     while True:
-        actor_name = input("Add actor name (or leave blank to finish actors): ").strip()
+        actor_name = ask_name(
+            db, "Add actor name (or leave blank to finish actors): ", kind="actor"
+        ).strip()
         if not actor_name:
             break
-        db.cur.execute("SELECT actor_id FROM actor WHERE name=?", (actor_name,))
-        if not db.cur.fetchone():
+        if db.find_actor_id(actor_name) is None:
             dob = input(f"DOB for {actor_name} (YYYY-MM-DD): ")
             movies_count = int(input(f"Movies count for {actor_name}: "))
             db.add_actor(actor_name, dob, movies_count)
@@ -71,7 +102,7 @@ def handle_add_movie_with_genres_actors(db):
 
 
 def handle_add_genre_to_existing_movie(db):
-    movie_name = input("Movie name: ")
+    movie_name = ask_name(db, "Movie name: ")
     genre = input("Genre: ")
     db.add_genre(movie_name, genre)
 
@@ -85,21 +116,21 @@ def handle_add_actor(db):
 
 
 def handle_link_actor_to_movie(db):
-    movie_name = input("Movie name: ")
-    actor_name = input("Actor name: ")
+    movie_name = ask_name(db, "Movie name: ")
+    actor_name = ask_name(db, "Actor name: ", kind="actor")
     db.link_actor_to_movie(movie_name, actor_name)
     print(f"✅ Actor '{actor_name}' linked to '{movie_name}'.")
 
 
 def handle_review_movie(db, user_id):
-    movie_name = input("Movie name to review: ")
+    movie_name = ask_name(db, "Movie name to review: ")
     rating = float(input("Your rating (0-10): "))
     review_text = input("Optional review: ")
     db.review_movie(user_id, movie_name, rating, review_text)
 
 
 def handle_toggle_watchlist(db, user_id):
-    movie_name = input("Movie name to toggle watchlist: ")
+    movie_name = ask_name(db, "Movie name to toggle watchlist: ")
     db.toggle_watchlist(user_id, movie_name)
 
 
@@ -140,7 +171,8 @@ def handle_menu_choice(db, user_id):
 def main(*args):
     current_file = Path(__file__).resolve()
     current_dir = current_file.parent
-    db = MovieDB(current_dir)
+    # MOVIEDB_BACKEND=sqlalchemy (or sharded) picks another backend.
+    db = open_moviedb(current_dir, os.environ.get("MOVIEDB_BACKEND", "sqlite3"))
 
     print("🎬 Welcome to MovieDB!\n")
 
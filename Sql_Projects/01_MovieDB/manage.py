@@ -0,0 +1,224 @@
+import argparse
+import time
+from pathlib import Path
+
+from importer import print_progress
+from migrations import schema_version
+from moviedb import MovieDB
+from snapshot import Snapshot, rating_histogram, reviews_per_genre_year
+from sqltrace import SQLTracer
+from synthetic import Scale, populate
+
+
+def cmd_import(db, args):
+    results = db.bulk_import(
+        movies=args.movies,
+        genres=args.genres,
+        actors=args.actors,
+        links=args.links,
+        batch_size=args.batch_size,
+        progress=print_progress,
+    )
+    for stats in results:
+        print(
+            f"✅ {stats.kind}: {stats.rows:,} rows in {stats.seconds:.1f}s "
+            f"({stats.rows_per_sec:,.0f} rows/s, {stats.skipped:,} skipped, "
+            f"resumed at row {stats.resumed_from:,})"
+        )
+
+
+def cmd_reindex(db, args):
+    db.rebuild_search_index()
+    print("✅ Full-text search index rebuilt.")
+
+
+def cmd_repair_ratings(db, args):
+    fixed = db.repair_rating_aggregates()
+    print(f"✅ Rating aggregates repaired for {fixed:,} movies.")
+
+
+def cmd_migrate(db, args):
+    # MovieDB() already applied pending migrations when it opened the file.
+    print(f"✅ Schema is at version {schema_version(db.conn)}.")
+
+
+def cmd_leaderboard(db, args):
+    if args.min_votes is not None or args.prior_mean is not None or args.rescore:
+        db.set_leaderboard_prior(args.min_votes, args.prior_mean)
+    for rank, entry in enumerate(db.leaderboard(args.limit, args.genre), start=1):
+        print(
+            f"{rank:>3}. {entry.name} – {entry.score:.2f} "
+            f"({entry.rating:.1f}/10, {entry.votes} votes)"
+        )
+
+
+def cmd_genres(db, args):
+    for genre, movies in db.genre_facets(args.keyword):
+        print(f"{genre:<20} {movies:>8,}")
+
+
+def cmd_complete(db, args):
+    for completion in db.autocomplete(args.prefix, args.kind, args.limit, args.by):
+        print(f"{completion.name}  ({completion.score:g})")
+
+
+def cmd_recommend_index(db, args):
+    start = time.perf_counter()
+    index = db.rebuild_recommendations(k=args.k, full=args.full)
+    print(
+        f"✅ Similarity index for {len(index.movie_ids):,} movies written to "
+        f"{db.recs_file} in {time.perf_counter() - start:.1f}s."
+    )
+
+
+def cmd_generate(db, args):
+    scale = Scale.from_rows(args.rows)
+    _, timings = populate(
+        db,
+        scale=scale,
+        seed=args.seed,
+        progress=lambda table, done: print(f"{table}: {done:,} rows"),
+    )
+    print(
+        f"✅ About {scale.total:,} synthetic rows (seed {args.seed}) "
+        f"in {sum(timings.values()):.1f}s."
+    )
+
+
+def cmd_compact(db, args):
+    deleted, freed = db.apply_login_retention(args.raw_days, full_vacuum=args.full)
+    print(f"✅ {deleted:,} login_history rows purged, {freed:,} pages freed.")
+
+
+def cmd_logins(db, args):
+    for day, logins in db.logins_per_day(args.start, args.end, args.user):
+        print(f"{day}  {logins:>8,}")
+
+
+def cmd_snapshot(db, args):
+    start = time.perf_counter()
+    path = db.export_snapshot(args.out, chunk_size=args.chunk_size)
+    size = path.stat().st_size / 2**20
+    print(
+        f"✅ Snapshot written to {path} ({size:.1f} MiB) "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+
+
+def cmd_report(args):
+    snapshot = Snapshot(args.snapshot)
+    print(f"Snapshot of {snapshot.created}\n\nRatings:")
+    for rating, reviews in rating_histogram(snapshot):
+        print(f"{rating:>3} {reviews:>10,}")
+    print("\nReviews per genre and release year:")
+    for genre, year, reviews, mean in reviews_per_genre_year(snapshot):
+        print(
+            f"{genre:<20} {year if year >= 0 else '?':>5} {reviews:>10,} {mean:>6.2f}"
+        )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="MovieDB maintenance commands")
+    parser.add_argument(
+        "--db-dir",
+        type=Path,
+        default=Path(__file__).resolve().parent,
+        help="Directory holding MovieDB.db",
+    )
+    parser.add_argument(
+        "--trace", action="store_true", help="Print SQL timings at exit"
+    )
+    parser.add_argument(
+        "--slow-ms", type=float, default=100.0, help="Slow-query threshold"
+    )
+    parser.add_argument("--slow-log", type=Path, help="Append slow queries here")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="Bulk import CSV/JSONL files")
+    p.add_argument("--movies", help="name,description,release_date,director")
+    p.add_argument("--genres", help="movie,genre")
+    p.add_argument("--actors", help="name,dob,movies_count")
+    p.add_argument("--links", help="movie,actor")
+    p.add_argument("--batch-size", type=int, default=50_000)
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("reindex", help="Backfill/rebuild the full-text index")
+    p.set_defaults(func=cmd_reindex)
+
+    p = sub.add_parser(
+        "repair-ratings", help="Recompute movie rating aggregates from reviews"
+    )
+    p.set_defaults(func=cmd_repair_ratings)
+
+    p = sub.add_parser("migrate", help="Apply pending schema migrations")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("leaderboard", help="Show or re-tune the top-movies chart")
+    p.add_argument("--limit", type=int, default=10)
+    p.add_argument("--genre")
+    p.add_argument("--min-votes", type=int, help="reviews needed to leave the prior")
+    p.add_argument("--prior-mean", type=float, help="default: mean of all ratings")
+    p.add_argument("--rescore", action="store_true", help="re-estimate the prior mean")
+    p.set_defaults(func=cmd_leaderboard)
+
+    p = sub.add_parser("genres", help="Movies per genre, optionally for a search")
+    p.add_argument("keyword", nargs="?")
+    p.set_defaults(func=cmd_genres)
+
+    p = sub.add_parser("complete", help="Autocomplete a movie or actor name")
+    p.add_argument("prefix")
+    p.add_argument("--kind", choices=["movie", "actor"], default="movie")
+    p.add_argument("--by", choices=["popularity", "rating"], default="popularity")
+    p.add_argument("--limit", type=int, default=10)
+    p.set_defaults(func=cmd_complete)
+
+    p = sub.add_parser(
+        "compact", help="Purge old login history and vacuum (e.g. from cron)"
+    )
+    p.add_argument("--raw-days", type=int, default=90, help="raw history to keep")
+    p.add_argument("--full", action="store_true", help="VACUUM the whole file")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser("logins", help="Logins per day, from the daily rollup")
+    p.add_argument("--start", default="", help="first day, YYYY-MM-DD")
+    p.add_argument("--end", default="9999-12-31", help="last day, YYYY-MM-DD")
+    p.add_argument("--user", type=int, help="only this user_id")
+    p.set_defaults(func=cmd_logins)
+
+    p = sub.add_parser("generate", help="Fill an empty database with fake data")
+    p.add_argument("--rows", type=int, default=100_000, help="total rows, roughly")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=cmd_generate)
+
+    p = sub.add_parser("snapshot", help="Export a columnar snapshot for reporting")
+    p.add_argument("--out", type=Path, help="default: MovieDB.snapshot.npz")
+    p.add_argument("--chunk-size", type=int, default=100_000, help="rows per fetch")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("report", help="Rating reports from a snapshot file")
+    p.add_argument("snapshot", type=Path)
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("recommend-index", help="Rebuild the item-item similarity index")
+    p.add_argument("--k", type=int, default=20, help="neighbours kept per movie")
+    p.add_argument("--full", action="store_true", help="ignore the previous index")
+    p.set_defaults(func=cmd_recommend_index)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "report":
+        return cmd_report(args)  # reads the snapshot only, never MovieDB.db
+    trace = None
+    if args.trace or args.slow_log:
+        trace = SQLTracer(args.slow_ms, args.slow_log, summary=args.trace)
+    db = MovieDB(args.db_dir, trace=trace)
+    try:
+        args.func(db, args)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
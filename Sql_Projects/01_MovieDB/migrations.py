@@ -0,0 +1,616 @@
+import sqlite3
+
+# Recomputes movie.rating_sum/rating_count/rating from `collection`, touching
+# only the movies whose stored aggregates are wrong.
+REPAIR_RATINGS_SQL = """
+    UPDATE movie SET
+        rating_sum = ifnull(agg.total, 0.0),
+        rating_count = ifnull(agg.n, 0),
+        rating = ifnull(agg.total / agg.n, 0.0)
+    FROM (
+        SELECT m.movie_id, SUM(c.rating) AS total, COUNT(c.rating) AS n
+        FROM movie AS m LEFT JOIN collection AS c USING (movie_id)
+        GROUP BY m.movie_id
+    ) AS agg
+    WHERE movie.movie_id = agg.movie_id
+      AND (movie.rating_sum IS NOT ifnull(agg.total, 0.0)
+           OR movie.rating_count IS NOT ifnull(agg.n, 0))
+"""
+
+BASELINE = """
+    CREATE TABLE IF NOT EXISTS user (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT,
+        last_name TEXT,
+        email TEXT UNIQUE,
+        password TEXT,
+        bio TEXT,
+        creation_date TEXT,
+        last_login TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS login_history (
+        history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        login_time TEXT,
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS movie (
+        movie_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        description TEXT,
+        release_date TEXT,
+        director TEXT,
+        rating REAL DEFAULT 0.0
+    );
+
+    CREATE TABLE IF NOT EXISTS genre (
+        genre_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        movie_id INTEGER,
+        genre TEXT,
+        FOREIGN KEY(movie_id) REFERENCES movie(movie_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS actor (
+        actor_id INTEGER PRIMARY KEY,
+        name TEXT,
+        dob TEXT,
+        movies_count INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS movie_actor (
+        movie_id INTEGER,
+        actor_id INTEGER,
+        FOREIGN KEY(movie_id) REFERENCES movie(movie_id),
+        FOREIGN KEY(actor_id) REFERENCES actor(actor_id),
+        PRIMARY KEY (movie_id, actor_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS collection (
+        user_id INTEGER,
+        movie_id INTEGER,
+        rating REAL,
+        watchlist BOOLEAN DEFAULT FALSE,
+        review TEXT,
+        PRIMARY KEY (user_id, movie_id),
+        FOREIGN KEY(user_id) REFERENCES user(user_id),
+        FOREIGN KEY(movie_id) REFERENCES movie(movie_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS friendlist (
+        user_id INTEGER,
+        friend_id INTEGER,
+        PRIMARY KEY (user_id, friend_id),
+        FOREIGN KEY(user_id) REFERENCES user(user_id),
+        FOREIGN KEY(friend_id) REFERENCES user(user_id)
+    );
+"""
+
+# Full-text index over movie.name/description. It is an external-content
+# table, so the text lives only in `movie` and the triggers keep it in sync.
+FULL_TEXT_SEARCH = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS movie_fts USING fts5(
+        name,
+        description,
+        content='movie',
+        content_rowid='movie_id',
+        prefix='2 3'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS movie_fts_ai AFTER INSERT ON movie BEGIN
+        INSERT INTO movie_fts (rowid, name, description)
+        VALUES (new.movie_id, new.name, new.description);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS movie_fts_ad AFTER DELETE ON movie BEGIN
+        INSERT INTO movie_fts (movie_fts, rowid, name, description)
+        VALUES ('delete', old.movie_id, old.name, old.description);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS movie_fts_au
+    AFTER UPDATE OF name, description ON movie BEGIN
+        INSERT INTO movie_fts (movie_fts, rowid, name, description)
+        VALUES ('delete', old.movie_id, old.name, old.description);
+        INSERT INTO movie_fts (rowid, name, description)
+        VALUES (new.movie_id, new.name, new.description);
+    END;
+
+    INSERT INTO movie_fts (movie_fts) VALUES ('rebuild');
+"""
+
+# movie.rating_sum/rating_count/rating follow every change to
+# collection.rating in O(1), instead of re-running AVG() per review.
+RATING_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS collection_rating_ai
+    AFTER INSERT ON collection WHEN new.rating IS NOT NULL BEGIN
+        UPDATE movie SET
+            rating_sum = rating_sum + new.rating,
+            rating_count = rating_count + 1,
+            rating = (rating_sum + new.rating) / (rating_count + 1)
+        WHERE movie_id = new.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS collection_rating_ad
+    AFTER DELETE ON collection WHEN old.rating IS NOT NULL BEGIN
+        UPDATE movie SET
+            rating_sum = rating_sum - old.rating,
+            rating_count = rating_count - 1,
+            rating = CASE WHEN rating_count > 1
+                THEN (rating_sum - old.rating) / (rating_count - 1)
+                ELSE 0.0 END
+        WHERE movie_id = old.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS collection_rating_au
+    AFTER UPDATE OF rating ON collection
+    WHEN old.rating IS NOT new.rating BEGIN
+        UPDATE movie SET
+            rating_sum = rating_sum - ifnull(old.rating, 0)
+                + ifnull(new.rating, 0),
+            rating_count = rating_count - (old.rating IS NOT NULL)
+                + (new.rating IS NOT NULL)
+        WHERE movie_id = old.movie_id;
+        UPDATE movie SET
+            rating = CASE WHEN rating_count > 0
+                THEN rating_sum / rating_count ELSE 0.0 END
+        WHERE movie_id = old.movie_id;
+    END;
+"""
+
+
+def add_rating_aggregates(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(movie)")}
+    if "rating_sum" not in columns:
+        conn.execute(
+            "ALTER TABLE movie ADD COLUMN rating_sum REAL NOT NULL DEFAULT 0.0"
+        )
+        conn.execute(
+            "ALTER TABLE movie ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0"
+        )
+    run_script(conn, RATING_TRIGGERS)
+    conn.execute(REPAIR_RATINGS_SQL)
+
+
+SECONDARY_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_movie_name ON movie (name);
+    CREATE INDEX IF NOT EXISTS idx_movie_rating ON movie (rating);
+    CREATE INDEX IF NOT EXISTS idx_actor_name ON actor (name);
+    CREATE INDEX IF NOT EXISTS idx_genre_movie ON genre (movie_id);
+    CREATE INDEX IF NOT EXISTS idx_collection_movie ON collection (movie_id);
+    CREATE INDEX IF NOT EXISTS idx_login_history_user ON login_history (user_id);
+"""
+
+# Materialized top-movies chart, overall and per genre. Scores are Bayesian
+# averages (sum + m*C) / (count + m): a movie needs about `min_votes` reviews
+# before its own average outweighs the prior mean C. The triggers hang off
+# movie.rating_sum/rating_count, which the collection triggers maintain.
+LEADERBOARD = """
+    CREATE TABLE IF NOT EXISTS leaderboard_config (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        min_votes INTEGER NOT NULL,
+        prior_mean REAL NOT NULL
+    );
+
+    INSERT OR IGNORE INTO leaderboard_config (id, min_votes, prior_mean)
+    SELECT 1, 10, ifnull(SUM(rating_sum) / SUM(rating_count), 5.0) FROM movie;
+
+    CREATE TABLE IF NOT EXISTS leaderboard (
+        movie_id INTEGER PRIMARY KEY,
+        score REAL NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_leaderboard_score
+    ON leaderboard (score DESC, movie_id);
+
+    CREATE TABLE IF NOT EXISTS genre_leaderboard (
+        genre TEXT,
+        movie_id INTEGER,
+        score REAL NOT NULL,
+        PRIMARY KEY (genre, movie_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_genre_leaderboard_score
+    ON genre_leaderboard (genre, score DESC, movie_id);
+
+    CREATE TRIGGER IF NOT EXISTS movie_leaderboard_au
+    AFTER UPDATE OF rating_sum, rating_count ON movie
+    WHEN new.rating_count > 0 BEGIN
+        INSERT INTO leaderboard (movie_id, score)
+        SELECT new.movie_id,
+               (new.rating_sum + min_votes * prior_mean)
+               / (new.rating_count + min_votes)
+        FROM leaderboard_config
+        WHERE id = 1
+        ON CONFLICT (movie_id) DO UPDATE SET score = excluded.score;
+
+        INSERT INTO genre_leaderboard (genre, movie_id, score)
+        SELECT genre.genre, new.movie_id, leaderboard.score
+        FROM genre JOIN leaderboard USING (movie_id)
+        WHERE genre.movie_id = new.movie_id
+        ON CONFLICT (genre, movie_id) DO UPDATE SET score = excluded.score;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS movie_leaderboard_unrated
+    AFTER UPDATE OF rating_count ON movie
+    WHEN new.rating_count = 0 BEGIN
+        DELETE FROM leaderboard WHERE movie_id = new.movie_id;
+        DELETE FROM genre_leaderboard WHERE movie_id = new.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS genre_leaderboard_ai
+    AFTER INSERT ON genre BEGIN
+        INSERT OR IGNORE INTO genre_leaderboard (genre, movie_id, score)
+        SELECT new.genre, movie_id, score
+        FROM leaderboard
+        WHERE movie_id = new.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS genre_leaderboard_ad
+    AFTER DELETE ON genre BEGIN
+        DELETE FROM genre_leaderboard
+        WHERE genre = old.genre AND movie_id = old.movie_id
+          AND NOT EXISTS (
+              SELECT 1 FROM genre
+              WHERE genre = old.genre AND movie_id = old.movie_id
+          );
+    END;
+"""
+
+# The rebuild as of the leaderboard migration; add_leaderboard() must keep
+# running it on old schemas. The current one is REBUILD_LEADERBOARD_SQL.
+REBUILD_LEADERBOARD_V5 = """
+    DELETE FROM leaderboard;
+    DELETE FROM genre_leaderboard;
+
+    INSERT INTO leaderboard (movie_id, score)
+    SELECT movie_id,
+           (rating_sum + min_votes * prior_mean) / (rating_count + min_votes)
+    FROM movie, leaderboard_config
+    WHERE rating_count > 0 AND leaderboard_config.id = 1;
+
+    INSERT OR IGNORE INTO genre_leaderboard (genre, movie_id, score)
+    SELECT genre.genre, movie_id, leaderboard.score
+    FROM genre JOIN leaderboard USING (movie_id);
+"""
+
+
+def add_leaderboard(conn):
+    run_script(conn, LEADERBOARD)
+    run_script(conn, REBUILD_LEADERBOARD_V5)
+
+
+# A login is a single UPDATE of user.last_login; this records it in
+# login_history as part of the same statement. Superseded by
+# LOGIN_HISTORY_BY_LOGIN below.
+LOGIN_HISTORY_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS user_login_au
+    AFTER UPDATE OF last_login ON user
+    BEGIN
+        INSERT INTO login_history (user_id, login_time)
+        VALUES (new.user_id, new.last_login);
+    END;
+"""
+
+# The trigger above also counted admin fixes and imports of last_login as
+# logins, so login() inserts the login_history row itself instead.
+LOGIN_HISTORY_BY_LOGIN = "DROP TRIGGER IF EXISTS user_login_au;"
+
+
+# Logins per day, overall and per user, counted by a trigger as
+# login_history rows are inserted, so raw history can be purged (see
+# retention.py) without losing the counts. Deleting raw rows deliberately
+# leaves the rollups alone.
+LOGIN_ROLLUPS = """
+    CREATE TABLE IF NOT EXISTS login_days (
+        day TEXT PRIMARY KEY,
+        logins INTEGER NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS login_daily (
+        day TEXT,
+        user_id INTEGER,
+        logins INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_login_daily_user ON login_daily (user_id, day);
+    CREATE INDEX IF NOT EXISTS idx_login_history_time ON login_history (login_time);
+
+    CREATE TRIGGER IF NOT EXISTS login_history_ai
+    AFTER INSERT ON login_history
+    WHEN new.login_time IS NOT NULL
+    BEGIN
+        INSERT INTO login_daily (day, user_id, logins)
+        VALUES (date(new.login_time), new.user_id, 1)
+        ON CONFLICT (day, user_id) DO UPDATE SET logins = logins + 1;
+        INSERT INTO login_days (day, logins) VALUES (date(new.login_time), 1)
+        ON CONFLICT (day) DO UPDATE SET logins = logins + 1;
+    END;
+
+    INSERT OR IGNORE INTO login_daily (day, user_id, logins)
+    SELECT date(login_time), user_id, COUNT(*) FROM login_history
+    WHERE login_time IS NOT NULL
+    GROUP BY date(login_time), user_id;
+
+    INSERT OR IGNORE INTO login_days (day, logins)
+    SELECT day, SUM(logins) FROM login_daily GROUP BY day;
+"""
+
+
+# Genres become a dimension table (one row per name) plus a movie_genre
+# join table. The free-text `genre` table is renamed away, its names are
+# deduplicated into the new `genre`, and everything that read it (the
+# genre leaderboard and its triggers) is rebuilt on genre_id.
+GENRE_DIMENSION = """
+    DROP TRIGGER IF EXISTS movie_leaderboard_au;
+    DROP TRIGGER IF EXISTS movie_leaderboard_unrated;
+    DROP TRIGGER IF EXISTS genre_leaderboard_ai;
+    DROP TRIGGER IF EXISTS genre_leaderboard_ad;
+    DROP INDEX IF EXISTS idx_genre_movie;
+    DROP TABLE IF EXISTS genre_leaderboard;
+    ALTER TABLE genre RENAME TO genre_legacy;
+
+    CREATE TABLE genre (
+        genre_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE movie_genre (
+        movie_id INTEGER NOT NULL REFERENCES movie (movie_id),
+        genre_id INTEGER NOT NULL REFERENCES genre (genre_id),
+        PRIMARY KEY (movie_id, genre_id)
+    ) WITHOUT ROWID;
+
+    -- Both directions are covering: a movie's genres come from the primary
+    -- key, a genre's movies (and counts per genre) from this index.
+    CREATE INDEX idx_movie_genre_genre ON movie_genre (genre_id, movie_id);
+
+    INSERT INTO genre (name)
+    SELECT genre_name(genre) AS name FROM genre_legacy
+    WHERE name IS NOT NULL
+    GROUP BY name
+    ORDER BY MIN(genre_id);
+
+    INSERT OR IGNORE INTO movie_genre (movie_id, genre_id)
+    SELECT legacy.movie_id, genre.genre_id
+    FROM genre_legacy AS legacy JOIN genre ON genre.name = genre_name(legacy.genre)
+    WHERE legacy.movie_id IS NOT NULL;
+
+    DROP TABLE genre_legacy;
+
+    CREATE TABLE genre_leaderboard (
+        genre_id INTEGER,
+        movie_id INTEGER,
+        score REAL NOT NULL,
+        PRIMARY KEY (genre_id, movie_id)
+    );
+
+    CREATE INDEX idx_genre_leaderboard_score
+    ON genre_leaderboard (genre_id, score DESC, movie_id);
+
+    CREATE TRIGGER movie_leaderboard_au
+    AFTER UPDATE OF rating_sum, rating_count ON movie
+    WHEN new.rating_count > 0 BEGIN
+        INSERT INTO leaderboard (movie_id, score)
+        SELECT new.movie_id,
+               (new.rating_sum + min_votes * prior_mean)
+               / (new.rating_count + min_votes)
+        FROM leaderboard_config
+        WHERE id = 1
+        ON CONFLICT (movie_id) DO UPDATE SET score = excluded.score;
+
+        INSERT INTO genre_leaderboard (genre_id, movie_id, score)
+        SELECT movie_genre.genre_id, new.movie_id, leaderboard.score
+        FROM movie_genre JOIN leaderboard USING (movie_id)
+        WHERE movie_genre.movie_id = new.movie_id
+        ON CONFLICT (genre_id, movie_id) DO UPDATE SET score = excluded.score;
+    END;
+
+    CREATE TRIGGER movie_leaderboard_unrated
+    AFTER UPDATE OF rating_count ON movie
+    WHEN new.rating_count = 0 BEGIN
+        DELETE FROM leaderboard WHERE movie_id = new.movie_id;
+        DELETE FROM genre_leaderboard WHERE (genre_id, movie_id) IN (
+            SELECT genre_id, movie_id FROM movie_genre
+            WHERE movie_id = new.movie_id
+        );
+    END;
+
+    CREATE TRIGGER movie_genre_leaderboard_ai
+    AFTER INSERT ON movie_genre BEGIN
+        INSERT OR IGNORE INTO genre_leaderboard (genre_id, movie_id, score)
+        SELECT new.genre_id, movie_id, score
+        FROM leaderboard
+        WHERE movie_id = new.movie_id;
+    END;
+
+    CREATE TRIGGER movie_genre_leaderboard_ad
+    AFTER DELETE ON movie_genre BEGIN
+        DELETE FROM genre_leaderboard
+        WHERE genre_id = old.genre_id AND movie_id = old.movie_id;
+    END;
+"""
+
+REBUILD_LEADERBOARD_SQL = """
+    DELETE FROM leaderboard;
+    DELETE FROM genre_leaderboard;
+
+    INSERT INTO leaderboard (movie_id, score)
+    SELECT movie_id,
+           (rating_sum + min_votes * prior_mean) / (rating_count + min_votes)
+    FROM movie, leaderboard_config
+    WHERE rating_count > 0 AND leaderboard_config.id = 1;
+
+    INSERT INTO genre_leaderboard (genre_id, movie_id, score)
+    SELECT movie_genre.genre_id, movie_id, leaderboard.score
+    FROM movie_genre JOIN leaderboard USING (movie_id);
+"""
+
+
+def genre_name(name):
+    """A genre name as the genre table stores it: whitespace trimmed and
+    collapsed, or None for a blank one. add_genre() and the importers use
+    it too, so " Crime" and "Crime" are always the same genre."""
+    name = " ".join((name or "").split())
+    return name or None
+
+
+def add_genre_dimension(conn):
+    conn.create_function("genre_name", 1, genre_name, deterministic=True)
+    run_script(conn, GENRE_DIMENSION)
+    run_script(conn, REBUILD_LEADERBOARD_SQL)
+
+
+# Append-only: the position in this list is the schema version stored in
+# PRAGMA user_version. Every step must also cope with databases created
+# before versioning existed (hence the IF NOT EXISTS everywhere).
+MIGRATIONS = [
+    ("baseline schema", BASELINE),
+    ("full-text search index", FULL_TEXT_SEARCH),
+    ("incremental rating aggregates", add_rating_aggregates),
+    ("secondary indexes", SECONDARY_INDEXES),
+    ("top-movies leaderboard", add_leaderboard),
+    ("login history trigger", LOGIN_HISTORY_TRIGGER),
+    ("daily login rollups", LOGIN_ROLLUPS),
+    ("genre dimension table", add_genre_dimension),
+    (
+        "cast index by actor",
+        "CREATE INDEX IF NOT EXISTS idx_movie_actor_actor ON movie_actor (actor_id);",
+    ),
+    ("login history written by login()", LOGIN_HISTORY_BY_LOGIN),
+]
+
+
+# The per-user tables of a ShardedMovieDB shard (see sharded.py). Users get
+# their IDs from the catalog's user_directory, so user_id is not
+# AUTOINCREMENT here. Triggers only see tables of their own file, so
+# instead of updating catalog.movie, reviews are summed per movie in
+# movie_votes; `changes` counts what sync_ratings() has not folded into the
+# catalog yet.
+SHARD_BASELINE = """
+    CREATE TABLE IF NOT EXISTS user (
+        user_id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        email TEXT UNIQUE,
+        password TEXT,
+        bio TEXT,
+        creation_date TEXT,
+        last_login TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS login_history (
+        history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        login_time TEXT,
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_login_history_user ON login_history (user_id);
+
+    CREATE TABLE IF NOT EXISTS collection (
+        user_id INTEGER,
+        movie_id INTEGER,
+        rating REAL,
+        watchlist BOOLEAN DEFAULT FALSE,
+        review TEXT,
+        PRIMARY KEY (user_id, movie_id),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS friendlist (
+        user_id INTEGER,
+        friend_id INTEGER,
+        PRIMARY KEY (user_id, friend_id),
+        FOREIGN KEY(user_id) REFERENCES user(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS movie_votes (
+        movie_id INTEGER PRIMARY KEY,
+        rating_sum REAL NOT NULL,
+        rating_count INTEGER NOT NULL,
+        changes INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_movie_votes_changed
+    ON movie_votes (movie_id) WHERE changes > 0;
+
+    CREATE TRIGGER IF NOT EXISTS collection_votes_ai
+    AFTER INSERT ON collection WHEN new.rating IS NOT NULL BEGIN
+        INSERT INTO movie_votes (movie_id, rating_sum, rating_count, changes)
+        VALUES (new.movie_id, new.rating, 1, 1)
+        ON CONFLICT (movie_id) DO UPDATE SET
+            rating_sum = rating_sum + excluded.rating_sum,
+            rating_count = rating_count + 1,
+            changes = changes + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS collection_votes_ad
+    AFTER DELETE ON collection WHEN old.rating IS NOT NULL BEGIN
+        UPDATE movie_votes SET
+            rating_sum = rating_sum - old.rating,
+            rating_count = rating_count - 1,
+            changes = changes + 1
+        WHERE movie_id = old.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS collection_votes_au
+    AFTER UPDATE OF rating ON collection
+    WHEN old.rating IS NOT new.rating BEGIN
+        INSERT INTO movie_votes (movie_id, rating_sum, rating_count, changes)
+        VALUES (
+            new.movie_id,
+            ifnull(new.rating, 0) - ifnull(old.rating, 0),
+            (new.rating IS NOT NULL) - (old.rating IS NOT NULL),
+            1
+        )
+        ON CONFLICT (movie_id) DO UPDATE SET
+            rating_sum = rating_sum + excluded.rating_sum,
+            rating_count = rating_count + excluded.rating_count,
+            changes = changes + 1;
+    END;
+"""
+
+# Same rules as MIGRATIONS, for the shard files.
+SHARD_MIGRATIONS = [
+    ("user shard schema", SHARD_BASELINE),
+    ("login history trigger", LOGIN_HISTORY_TRIGGER),
+    ("daily login rollups", LOGIN_ROLLUPS),
+    ("login history written by login()", LOGIN_HISTORY_BY_LOGIN),
+]
+
+
+def run_script(conn, script):
+    # Unlike executescript(), this stays inside the current transaction.
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Apply pending migrations, each one in its own transaction."""
+    applied = []
+    for version, (description, step) in enumerate(migrations, start=1):
+        if version <= schema_version(conn):
+            continue
+        conn.execute("BEGIN")
+        try:
+            if callable(step):
+                step(conn)
+            else:
+                run_script(conn, step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, description))
+    return applied
@@ -1,6 +1,28 @@
+import json
 import sqlite3
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import islice
+
+from autocomplete import PrefixIndex
+from cache import MISSING, LRUCache
+from explain import QueryPlanAuditor
+from group_commit import GroupCommitter
+from importer import BulkImporter
+from migrations import (
+    REBUILD_LEADERBOARD_SQL,
+    REPAIR_RATINGS_SQL,
+    genre_name,
+    migrate,
+    run_script,
+)
+from pool import ReaderPool, connect_writer
+from recommend import ItemSimilarityIndex, build_index
+from retention import LoginRetention, PeriodicTask
+from snapshot import export_snapshot
+from social import FriendGraph
 
 
 @dataclass
@@ -12,84 +34,257 @@ class UserInfo:
     bio: str
 
 
+@dataclass(frozen=True)
+class MovieRow:
+    movie_id: int
+    name: str
+    rating: float
+    rating_count: int
+    release_date: str
+    director: str
+
+    @property
+    def cursor(self):
+        """Keyset to pass as `after=` to continue right after this row."""
+        return (self.rating, self.movie_id)
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    movie_id: int
+    name: str  # with [highlighted] matches
+    snippet: str
+    rating: float
+    score: float  # bm25, lower is better
+
+    @property
+    def cursor(self):
+        return (self.score, self.movie_id)
+
+
+@dataclass(frozen=True)
+class LeaderboardEntry:
+    movie_id: int
+    name: str
+    score: float  # Bayesian average
+    rating: float  # plain average
+    votes: int
+
+
+@dataclass(frozen=True)
+class FriendPick:
+    movie_id: int
+    name: str
+    friends_rating: float  # average over the friends who rated it highly
+    fans: int  # how many friends rated it highly
+
+
+@dataclass(frozen=True)
+class Recommendation:
+    movie_id: int
+    name: str
+    score: float  # sum of similarity * rating over the user's rated movies
+
+
 class MovieDB:
-    def __init__(self, db_path):
-        self.conn = sqlite3.connect(db_path / "MovieDB.db")
+    def __init__(
+        self,
+        db_path,
+        explain=False,
+        concurrent=False,
+        readers=4,
+        name_cache=4096,
+        group_commit=None,
+        trace=None,
+        retention=None,
+    ):
+        self.db_file = db_path / "MovieDB.db"
+        # concurrent=True makes the instance safe to share between threads:
+        # WAL journaling, one writer connection that every write goes
+        # through in turn, and a pool of read-only connections for queries.
+        if concurrent:
+            self.conn = connect_writer(self.db_file)
+        else:
+            # Group commit may commit from its timer thread.
+            self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
         self.cur = self.conn.cursor()
+        self._write_lock = threading.RLock()
+        # group_commit=GroupCommit(...) buffers writes and commits them in
+        # groups; see group_commit.py for the durability trade-off.
+        self.committer = GroupCommitter(self.conn, self._write_lock, group_commit)
+        # name -> ID lookups done by nearly every method; name_cache=0
+        # disables them (e.g. to benchmark the uncached path).
+        self.name_cache = {
+            "movie": LRUCache(name_cache),
+            "actor": LRUCache(name_cache),
+        }
+        # Prefix indexes for autocomplete(), one per (kind, ranking), each
+        # loaded on first use and then kept up to date by add_movie/actor.
+        self._completions = {}
+        self._completions_lock = threading.Lock()
+        # INSERT OR REPLACE into `collection` must fire the delete trigger
+        # for the replaced row, or its rating would never be subtracted.
+        self.cur.execute("PRAGMA recursive_triggers = ON")
+        # Takes effect for new files (and at the next full VACUUM), so that
+        # vacuum() can free pages without rewriting the whole file.
+        self.cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
         self.create_tables()
 
+        # explain=True audits the query plan of every statement issued, so
+        # tests can fail on anything that falls back to a full table scan.
+        self.explain = None
+        if explain:
+            self.explain = QueryPlanAuditor(self.db_file)
+        # trace=SQLTracer(...) times every statement and public method call
+        # and logs the slow ones; see sqltrace.py.
+        self.tracer = trace
+        row_factory = trace.count_row if trace else None
+        self.conn.row_factory = self.cur.row_factory = row_factory
+        self.conn.set_trace_callback(self._trace_callback())
+
+        self._friend_graph = None
+        self._graph_lock = threading.Lock()
+
+        # Item-item similarity index for recommend(), rebuilt offline by
+        # rebuild_recommendations() and reloaded when the file changes.
+        self.recs_file = self.db_file.with_name("MovieDB.recs.npz")
+        self._recs = None
+        self._recs_mtime = None
+        self._recs_lock = threading.Lock()
+
+        self.readers = None
+        if concurrent:
+            self.readers = ReaderPool(
+                self.db_file,
+                size=readers,
+                trace=self._trace_callback(),
+                row_factory=row_factory,
+            )
+        if trace:
+            trace.instrument(self)
+
+        # retention=LoginRetention(...) purges old login_history rows and
+        # vacuums in the background; see retention.py.
+        self.retention = retention or LoginRetention()
+        self._retention_task = None
+        if retention and retention.every:
+            self._retention_task = PeriodicTask(
+                retention.every, self.apply_login_retention
+            )
+
+    def _trace_callback(self):
+        # The tracer goes first so the auditor's EXPLAIN is not billed to
+        # the statement before.
+        callbacks = [callback for callback in (self.tracer, self.explain) if callback]
+        if len(callbacks) < 2:
+            return callbacks[0] if callbacks else None
+
+        def trace(statement):
+            for callback in callbacks:
+                callback(statement)
+
+        return trace
+
     def create_tables(self):
-        self.cur.executescript("""
-            BEGIN;
-            CREATE TABLE IF NOT EXISTS user (
-                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                first_name TEXT,
-                last_name TEXT,
-                email TEXT UNIQUE,
-                password TEXT,
-                bio TEXT,
-                creation_date TEXT,
-                last_login TEXT
-            );
-
-            CREATE TABLE IF NOT EXISTS login_history (
-                history_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                login_time TEXT,
-                FOREIGN KEY(user_id) REFERENCES user(user_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS movie (
-                movie_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                description TEXT,
-                release_date TEXT,
-                director TEXT,
-                rating REAL DEFAULT 0.0
-            );
-
-            CREATE TABLE IF NOT EXISTS genre (
-                genre_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                movie_id INTEGER,
-                genre TEXT,
-                FOREIGN KEY(movie_id) REFERENCES movie(movie_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS actor (
-                actor_id INTEGER PRIMARY KEY,
-                name TEXT,
-                dob TEXT,
-                movies_count INTEGER
-            );
-
-            CREATE TABLE IF NOT EXISTS movie_actor (
-                movie_id INTEGER,
-                actor_id INTEGER,
-                FOREIGN KEY(movie_id) REFERENCES movie(movie_id),
-                FOREIGN KEY(actor_id) REFERENCES actor(actor_id),
-                PRIMARY KEY (movie_id, actor_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS collection (
-                user_id INTEGER,
-                movie_id INTEGER,
-                rating REAL,
-                watchlist BOOLEAN DEFAULT FALSE,
-                review TEXT,
-                PRIMARY KEY (user_id, movie_id),
-                FOREIGN KEY(user_id) REFERENCES user(user_id),
-                FOREIGN KEY(movie_id) REFERENCES movie(movie_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS friendlist (
-                user_id INTEGER,
-                friend_id INTEGER,
-                PRIMARY KEY (user_id, friend_id),
-                FOREIGN KEY(user_id) REFERENCES user(user_id),
-                FOREIGN KEY(friend_id) REFERENCES user(user_id)
-            );
-            COMMIT;
-        """)
+        with self._write_lock:
+            return migrate(self.conn)
+
+    @contextmanager
+    def _writing(self):
+        """Serialize a write and commit it (or roll it back on error)."""
+        with self._write_lock:
+            # While commits are being grouped, a savepoint makes a failing
+            # write roll back alone instead of with everything buffered.
+            buffered = self.committer.buffering
+            if buffered:
+                if not self.conn.in_transaction:
+                    # Otherwise RELEASE of the outermost savepoint commits.
+                    self.cur.execute("BEGIN")
+                self.cur.execute("SAVEPOINT write")
+            try:
+                yield self.cur
+                if buffered:
+                    self.cur.execute("RELEASE write")
+                self.committer.written()
+            except BaseException:
+                if buffered:
+                    self.cur.execute("ROLLBACK TO write")
+                    self.cur.execute("RELEASE write")
+                else:
+                    self.conn.rollback()
+                # Cached IDs may belong to rows that were just rolled back.
+                self._clear_name_cache()
+                raise
+
+    @contextmanager
+    def transaction(self):
+        """Make the writes inside the `with` block atomic: they are all
+        committed together, or all rolled back if the block raises.
+
+        The write lock is held for the whole block, so writes from other
+        threads wait until it ends; keep it short.
+        """
+        with self._write_lock, self.committer.batch():
+            if not self.conn.in_transaction:
+                self.cur.execute("BEGIN")
+            self.cur.execute("SAVEPOINT txn")
+            try:
+                yield self
+            except BaseException:
+                self.cur.execute("ROLLBACK TO txn")
+                self.cur.execute("RELEASE txn")
+                self._clear_name_cache()
+                raise
+            self.cur.execute("RELEASE txn")
+
+    def batch(self):
+        """Commit every write made inside the `with` block once, at the end."""
+        return self.committer.batch()
+
+    def flush(self):
+        """Commit writes buffered by group commit right now."""
+        self.committer.flush()
+
+    @contextmanager
+    def _reading(self):
+        if self.readers is None:
+            with self._write_lock:
+                yield self.cur
+        else:
+            with self.readers.connection() as conn:
+                yield conn.cursor()
+
+    def _lookup_id(self, cur, table, name):
+        cache = self.name_cache[table]
+        row_id = cache.get(name)
+        if row_id is MISSING:
+            # A reader connection doesn't see writes that group commit hasn't
+            # committed yet, nor ones committed while it looks; its answer
+            # is only cached if neither could have been the case.
+            reader = cur is not self.cur
+            version = cache.version if reader else None
+            cur.execute(f"SELECT {table}_id FROM {table} WHERE name=?", (name,))
+            row = cur.fetchone()
+            row_id = row[0] if row else None
+            if not (reader and self.committer.pending):
+                cache.put(name, row_id, version)  # "not found" is cached too
+        return row_id
+
+    def _clear_name_cache(self):
+        for cache in self.name_cache.values():
+            cache.clear()
+        self._drop_completions()  # may list names that were rolled back
+
+    def find_movie_id(self, name):
+        with self._reading() as cur:
+            return self._lookup_id(cur, "movie", name)
+
+    def find_actor_id(self, name):
+        with self._reading() as cur:
+            return self._lookup_id(cur, "actor", name)
+
+    def cache_stats(self):
+        return {table: cache.stats() for table, cache in self.name_cache.items()}
 
     def signup(self, user: UserInfo):
         sql = (
@@ -107,161 +302,664 @@ class MovieDB:
             datetime.now(),
         )
 
-        self.cur.execute(sql, values)
-        self.conn.commit()
+        with self._writing() as cur:
+            cur.execute(sql, values)
 
     def login(self, email, password):
-        self.cur.execute(
-            "SELECT user_id FROM user WHERE email=? AND password=?", (email, password)
-        )
-        user = self.cur.fetchone()
-        if user:
-            now = datetime.now()
-            self.cur.execute(
-                "UPDATE user SET last_login=? WHERE user_id=?", (now, user[0])
+        now = datetime.now()
+        with self._writing() as cur:
+            cur.execute(
+                "UPDATE user SET last_login=? WHERE email=? AND password=? "
+                "RETURNING user_id",
+                (now, email, password),
             )
-            self.cur.execute(
-                "INSERT INTO login_history (user_id, login_time) VALUES (?, ?)",
-                (user[0], now),
-            )
-            self.conn.commit()
-            return user[0]
-        return None
+            user = cur.fetchall()
+            if user:
+                cur.execute(
+                    "INSERT INTO login_history (user_id, login_time) VALUES (?, ?)",
+                    (user[0][0], now),
+                )
+        return user[0][0] if user else None
 
     def add_movie(self, name, desc, date, director):
-        self.cur.execute(
-            """
-            INSERT INTO movie (name, description, release_date, director)
-            VALUES (?, ?, ?, ?)
-        """,
-            (name, desc, date, director),
-        )
-        self.conn.commit()
+        with self._writing() as cur:
+            cur.execute(
+                """
+                INSERT INTO movie (name, description, release_date, director)
+                VALUES (?, ?, ?, ?)
+            """,
+                (name, desc, date, director),
+            )
+            movie_id = cur.lastrowid
+        self.name_cache["movie"].invalidate(name)
+        self._index_name("movie", name, movie_id)
         print("Movie added successfully.\n")
 
     def add_genre(self, movie_name, genre):
-        self.cur.execute("SELECT movie_id FROM movie WHERE name=?", (movie_name,))
-        movie = self.cur.fetchone()
-        if movie:
-            self.cur.execute(
-                "INSERT INTO genre (movie_id, genre) VALUES (?, ?)", (movie[0], genre)
-            )
-            self.conn.commit()
+        genre = genre_name(genre)
+        with self._writing() as cur:
+            movie_id = self._lookup_id(cur, "movie", movie_name)
+            if movie_id and genre:
+                cur.execute(
+                    "INSERT INTO genre (name) VALUES (?) ON CONFLICT (name) DO NOTHING",
+                    (genre,),
+                )
+                cur.execute(
+                    "INSERT OR IGNORE INTO movie_genre (movie_id, genre_id) "
+                    "SELECT ?, genre_id FROM genre WHERE name=?",
+                    (movie_id, genre),
+                )
 
     def add_actor(self, name, dob, movies_count):
-        self.cur.execute(
-            "INSERT INTO actor (name, dob, movies_count) VALUES (?, ?, ?)",
-            (name, dob, movies_count),
-        )
-        self.conn.commit()
+        with self._writing() as cur:
+            cur.execute(
+                "INSERT INTO actor (name, dob, movies_count) VALUES (?, ?, ?)",
+                (name, dob, movies_count),
+            )
+            actor_id = cur.lastrowid
+        self.name_cache["actor"].invalidate(name)
+        self._index_name("actor", name, actor_id)
 
     def link_actor_to_movie(self, movie_name, actor_name):
-        self.cur.execute("SELECT movie_id FROM movie WHERE name=?", (movie_name,))
-        movie = self.cur.fetchone()
-        self.cur.execute("SELECT actor_id FROM actor WHERE name=?", (actor_name,))
-        actor = self.cur.fetchone()
-        if movie and actor:
-            self.cur.execute(
-                "INSERT OR IGNORE INTO movie_actor (movie_id, actor_id) VALUES (?, ?)",
-                (movie[0], actor[0]),
-            )
-            self.conn.commit()
+        with self._writing() as cur:
+            movie_id = self._lookup_id(cur, "movie", movie_name)
+            actor_id = self._lookup_id(cur, "actor", actor_name)
+            if movie_id and actor_id:
+                cur.execute(
+                    "INSERT OR IGNORE INTO movie_actor (movie_id, actor_id) "
+                    "VALUES (?, ?)",
+                    (movie_id, actor_id),
+                )
 
     def review_movie(self, user_id, movie_name, rating, review_text=""):
-        self.cur.execute("SELECT movie_id FROM movie WHERE name=?", (movie_name,))
-        row = self.cur.fetchone()
-        if not row:
-            print("Movie not found.")
-            return
-        movie_id = row[0]
-
-        self.cur.execute(
-            """
-            INSERT OR REPLACE INTO collection (user_id, movie_id, rating, review)
-            VALUES (?, ?, ?, ?)
-        """,
-            (user_id, movie_id, rating, review_text),
-        )
+        with self._writing() as cur:
+            movie_id = self._lookup_id(cur, "movie", movie_name)
+            if not movie_id:
+                print("Movie not found.")
+                return
 
-        self.cur.execute(
-            "SELECT AVG(rating) FROM collection WHERE movie_id=?", (movie_id,)
-        )
-        avg_rating = self.cur.fetchone()[0]
-        self.cur.execute(
-            "UPDATE movie SET rating=? WHERE movie_id=?", (avg_rating, movie_id)
-        )
-        self.conn.commit()
+            # The collection_rating_* triggers update movie.rating in O(1).
+            cur.execute(
+                """
+                INSERT INTO collection (user_id, movie_id, rating, review)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, movie_id) DO UPDATE
+                SET rating = excluded.rating, review = excluded.review
+            """,
+                (user_id, movie_id, rating, review_text),
+            )
         print("Review added.\n")
 
     def toggle_watchlist(self, user_id, movie_name):
-        self.cur.execute("SELECT movie_id FROM movie WHERE name=?", (movie_name,))
-        row = self.cur.fetchone()
-        if row:
-            movie_id = row[0]
-            self.cur.execute(
-                "SELECT watchlist FROM collection WHERE user_id=? AND movie_id=?",
+        """Flip the movie in or out of the user's watchlist and return the
+        new state (None if there is no such movie)."""
+        with self._writing() as cur:
+            movie_id = self._lookup_id(cur, "movie", movie_name)
+            if not movie_id:
+                return None
+            # Read and flip in one statement, so concurrent toggles from
+            # other connections can't both see the same old value.
+            cur.execute(
+                """
+                INSERT INTO collection (user_id, movie_id, watchlist)
+                VALUES (?, ?, TRUE)
+                ON CONFLICT (user_id, movie_id)
+                DO UPDATE SET watchlist = NOT ifnull(watchlist, FALSE)
+                RETURNING watchlist
+                """,
                 (user_id, movie_id),
             )
-            entry = self.cur.fetchone()
-            if entry:
-                new_val = not entry[0]
-                self.cur.execute(
-                    "UPDATE collection SET watchlist=? WHERE user_id=? AND movie_id=?",
-                    (new_val, user_id, movie_id),
+            (watchlist,) = cur.fetchall()[0]
+        print("Watchlist updated.\n")
+        return bool(watchlist)
+
+    def rename_movie(self, old_name, new_name):
+        with self._writing() as cur:
+            cur.execute("UPDATE movie SET name=? WHERE name=?", (new_name, old_name))
+        self.name_cache["movie"].invalidate(old_name, new_name)
+        self._drop_completions("movie")
+
+    def rename_actor(self, old_name, new_name):
+        with self._writing() as cur:
+            cur.execute("UPDATE actor SET name=? WHERE name=?", (new_name, old_name))
+        self.name_cache["actor"].invalidate(old_name, new_name)
+        self._drop_completions("actor")
+
+    # How autocomplete() ranks names: SQL returning (name, id, score) rows.
+    # Popularity is the number of reviews (movies) or cast links (actors);
+    # "rating" is the leaderboard's Bayesian average, 0 while unrated.
+    COMPLETION_SOURCES = {
+        ("movie", "popularity"): "SELECT name, movie_id, rating_count FROM movie "
+        "ORDER BY name",
+        ("movie", "rating"): "SELECT movie.name, movie_id, ifnull(board.score, 0) "
+        "FROM movie LEFT JOIN leaderboard AS board USING (movie_id) "
+        "ORDER BY movie.name",
+        ("actor", "popularity"): "SELECT name, actor_id, (SELECT COUNT(*) "
+        "FROM movie_actor WHERE movie_actor.actor_id = actor.actor_id) "
+        "FROM actor ORDER BY name",
+    }
+
+    def autocomplete(self, prefix, kind="movie", limit=10, by="popularity"):
+        """Top `limit` movie (or actor) names starting with `prefix`,
+        ignoring case, as Completions ranked `by` "popularity" or "rating".
+
+        Served from an in-memory PrefixIndex (see autocomplete.py) that is
+        loaded from the database on first use; names added through MovieDB
+        show up immediately, ranked last until the index is reloaded.
+        Ranking scores are as of the load; reset_autocomplete() refreshes
+        them.
+        """
+        if (kind, by) not in self.COMPLETION_SOURCES:
+            raise ValueError(f"Can't autocomplete {kind} names by {by}")
+        with self._completions_lock:
+            index = self._completions.get((kind, by))
+            if index is None:
+                # Without a reader pool _reading() holds the write lock, so
+                # the index is built after the rows are read, not while.
+                with self._reading() as cur:
+                    cur.execute(self.COMPLETION_SOURCES[kind, by])
+                    rows = cur.fetchall()
+                index = self._completions[kind, by] = PrefixIndex().load(rows)
+            return index.complete(prefix, limit)
+
+    def reset_autocomplete(self):
+        """Drop the autocomplete indexes; the next call reloads them."""
+        self._drop_completions()
+
+    def _index_name(self, kind, name, row_id):
+        # Called once the write is done, so an index merge (see PrefixIndex)
+        # never holds up other writers.
+        if name is None:
+            return
+        with self._completions_lock:
+            for (indexed_kind, _), index in self._completions.items():
+                if indexed_kind == kind:
+                    index.add(name, row_id)
+
+    def _drop_completions(self, kind=None):
+        with self._completions_lock:
+            for key in list(self._completions):
+                if kind is None or key[0] == kind:
+                    del self._completions[key]
+
+    def add_friend(self, user_id, friend_email):
+        with self._writing() as cur:
+            cur.execute("SELECT user_id FROM user WHERE email=?", (friend_email,))
+            row = cur.fetchone()
+            if row:
+                friend_id = row[0]
+                cur.execute(
+                    "INSERT OR IGNORE INTO friendlist (user_id, friend_id) "
+                    "VALUES (?, ?)",
+                    (user_id, friend_id),
                 )
+        print("Friend added.\n" if row else "User not found.\n")
+
+    def _iter_keyset(self, sql, params, after, chunk_size, row_type, bind=tuple):
+        # One short query per chunk, continuing from the last row's key, so
+        # page 1000 costs the same as page 1 and no cursor (or pooled
+        # connection) is held while the caller works through the rows.
+        # `bind(key)` gives the key's parameters, in the order sql uses them.
+        while True:
+            with self._reading() as cur:
+                cur.arraysize = chunk_size
+                cur.execute(sql, (*params, *bind(after), chunk_size))
+                rows = [row_type(*row) for row in cur.fetchmany()]
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1].cursor
+
+    def iter_top_movies(self, after=None, chunk_size=500):
+        """Yield MovieRows by rating, best first, after the (rating, movie_id)
+        keyset `after` if given."""
+        # "(rating, movie_id) < (?, ?)" would only seek on rating, and scan
+        # every earlier row of a tie; the two halves each seek on the index
+        # and SQLite merges them in order.
+        sql = """
+            SELECT movie_id, name, rating, rating_count, release_date, director
+            FROM movie
+            WHERE rating = ? AND movie_id < ?
+            UNION ALL
+            SELECT movie_id, name, rating, rating_count, release_date, director
+            FROM movie
+            WHERE rating < ?
+            ORDER BY rating DESC, movie_id DESC
+            LIMIT ?
+        """
+        after = after or (float("inf"), 0)
+        return self._iter_keyset(
+            sql, (), after, chunk_size, MovieRow, bind=lambda key: (*key, key[0])
+        )
+
+    def friend_graph(self):
+        """The in-memory friend graph, caught up with new friendships."""
+        with self._graph_lock, self._reading() as cur:
+            if self._friend_graph is None:
+                self._friend_graph = FriendGraph().load(cur.connection)
             else:
-                self.cur.execute(
-                    """
-                    INSERT INTO collection (
-                        user_id,
-                        movie_id,
-                        watchlist
-                    )
-                    VALUES (?, ?, ?)
-                    """,
-                    (user_id, movie_id, True),
+                self._friend_graph.refresh(cur.connection)
+            return self._friend_graph
+
+    def friends_within(self, user_id, hops=2, cached=True):
+        """{user_id: distance} of everyone reachable in 1..hops friend steps."""
+        if cached:
+            return self.friend_graph().within(user_id, hops)
+        with self._reading() as cur:
+            cur.execute(
+                """
+                WITH RECURSIVE reach (user_id, depth) AS (
+                    SELECT friend_id, 1 FROM friendlist WHERE user_id = ?
+                    UNION
+                    SELECT f.friend_id, r.depth + 1
+                    FROM reach AS r JOIN friendlist AS f ON f.user_id = r.user_id
+                    WHERE r.depth < ?
                 )
+                SELECT user_id, MIN(depth) FROM reach
+                WHERE user_id != ?
+                GROUP BY user_id
+            """,
+                (user_id, hops, user_id),
+            )
+            return dict(cur.fetchall())
 
-            self.conn.commit()
-            print("Watchlist updated.\n")
+    def friend_suggestions(self, user_id, limit=20, cached=True):
+        """Friends-of-friends ranked by how many friends they share with
+        `user_id`, as [(user_id, mutual_friends)]."""
+        if cached:
+            counts = self.friend_graph().mutual_counts(user_id)
+            return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        with self._reading() as cur:
+            cur.execute(
+                """
+                SELECT fof.friend_id, COUNT(*) AS mutual
+                FROM friendlist AS f
+                JOIN friendlist AS fof ON fof.user_id = f.friend_id
+                WHERE f.user_id = ?
+                  AND fof.friend_id != f.user_id
+                  AND NOT EXISTS (
+                      SELECT 1 FROM friendlist AS mine
+                      WHERE mine.user_id = f.user_id
+                        AND mine.friend_id = fof.friend_id
+                  )
+                GROUP BY fof.friend_id
+                ORDER BY mutual DESC, fof.friend_id
+                LIMIT ?
+            """,
+                (user_id, limit),
+            )
+            return cur.fetchall()
 
-    def add_friend(self, user_id, friend_email):
-        self.cur.execute("SELECT user_id FROM user WHERE email=?", (friend_email,))
-        row = self.cur.fetchone()
-        if row:
-            friend_id = row[0]
-            self.cur.execute(
-                "INSERT OR IGNORE INTO friendlist (user_id, friend_id) VALUES (?, ?)",
-                (user_id, friend_id),
+    def friends_rated_highly(
+        self, user_id, min_rating=8.0, hops=1, limit=20, cached=True
+    ):
+        """Movies the user hasn't rated that friends (up to `hops` away)
+        rated at least `min_rating`, most fans first. One query in total,
+        however many friends there are."""
+        friends = list(self.friends_within(user_id, hops, cached=cached))
+        with self._reading() as cur:
+            cur.execute(
+                """
+                SELECT movie.movie_id, movie.name, AVG(c.rating), COUNT(*) AS fans
+                FROM json_each(?) AS friend
+                JOIN collection AS c ON c.user_id = friend.value
+                JOIN movie ON movie.movie_id = c.movie_id
+                WHERE c.rating >= ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM collection AS mine
+                      WHERE mine.user_id = ? AND mine.movie_id = c.movie_id
+                        AND mine.rating IS NOT NULL
+                  )
+                GROUP BY movie.movie_id
+                ORDER BY fans DESC, AVG(c.rating) DESC, movie.movie_id
+                LIMIT ?
+            """,
+                (json.dumps(friends), min_rating, user_id, limit),
             )
-            self.conn.commit()
-            print("Friend added.\n")
+            return [FriendPick(*row) for row in cur.fetchall()]
+
+    def rebuild_recommendations(self, k=20, full=False):
+        """Rebuild the similarity index file, reusing the previous one for
+        movies whose ratings have not changed unless `full`."""
+        with self._recs_lock, self._reading() as cur:
+            self._recs = build_index(cur.connection, self.recs_file, k=k, full=full)
+            self._recs_mtime = self.recs_file.stat().st_mtime_ns
+            return self._recs
+
+    def _similarity_index(self):
+        if not self.recs_file.exists():
+            return self.rebuild_recommendations()
+        with self._recs_lock:
+            mtime = self.recs_file.stat().st_mtime_ns
+            if self._recs is None or mtime != self._recs_mtime:
+                self._recs = ItemSimilarityIndex.load(self.recs_file)
+                self._recs_mtime = mtime
+            return self._recs
+
+    def recommend(self, user_id, limit=10):
+        """Movies similar to the ones `user_id` rated, best first.
+
+        Uses the precomputed index, so the cost depends on how many movies
+        the user rated, not on the number of ratings overall. The index is
+        only as fresh as the last rebuild_recommendations().
+        """
+        index = self._similarity_index()
+        with self._reading() as cur:
+            cur.execute(
+                "SELECT movie_id, rating FROM collection "
+                "WHERE user_id=? AND rating IS NOT NULL",
+                (user_id,),
+            )
+            picks = index.recommend(dict(cur.fetchall()), limit)
+            if not picks:
+                return []
+            cur.execute(
+                "SELECT movie_id, name FROM movie "
+                "WHERE movie_id IN (SELECT value FROM json_each(?))",
+                (json.dumps([movie_id for movie_id, _ in picks]),),
+            )
+            names = dict(cur.fetchall())
+        return [
+            Recommendation(movie_id, names.get(movie_id), score)
+            for movie_id, score in picks
+        ]
+
+    def leaderboard(self, limit=10, genre=None):
+        """Top movies by Bayesian average, overall or for one genre.
+
+        Reads `limit` rows of a trigger-maintained table, so the cost does
+        not depend on the size of the catalog.
+        """
+        if genre is None:
+            source, where, params = "leaderboard", "", (limit,)
         else:
-            print("User not found.\n")
+            source, params = "genre_leaderboard", (genre, limit)
+            where = "WHERE genre_id = (SELECT genre_id FROM genre WHERE name=?)"
+        with self._reading() as cur:
+            cur.execute(
+                f"""
+                SELECT movie_id, movie.name, board.score, movie.rating,
+                       movie.rating_count
+                FROM {source} AS board JOIN movie USING (movie_id)
+                {where}
+                ORDER BY board.score DESC, movie_id
+                LIMIT ?
+            """,
+                params,
+            )
+            return [LeaderboardEntry(*row) for row in cur.fetchall()]
+
+    def set_leaderboard_prior(self, min_votes=None, prior_mean=None):
+        """Change the Bayesian prior and rescore the leaderboard.
+
+        Without `prior_mean`, it is re-estimated as the mean of all ratings.
+        """
+        with self._writing() as cur:
+            if min_votes is not None:
+                cur.execute(
+                    "UPDATE leaderboard_config SET min_votes=? WHERE id=1",
+                    (min_votes,),
+                )
+            if prior_mean is None:
+                cur.execute(
+                    "SELECT ifnull(SUM(rating_sum) / SUM(rating_count), 5.0) FROM movie"
+                )
+                prior_mean = cur.fetchone()[0]
+            cur.execute(
+                "UPDATE leaderboard_config SET prior_mean=? WHERE id=1",
+                (prior_mean,),
+            )
+            run_script(self.conn, REBUILD_LEADERBOARD_SQL)
+
+    def show_top_movies(self, limit=5):
+        for entry in self.leaderboard(limit):
+            print(f"{entry.name} - {entry.rating:.1f}/10 ({entry.votes} votes)")
+
+    def repair_rating_aggregates(self):
+        """Recompute rating_sum/rating_count/rating from `collection`.
+
+        Returns the number of movies whose stored aggregates were wrong.
+        """
+        with self._writing() as cur:
+            cur.execute(REPAIR_RATINGS_SQL)
+            return cur.rowcount
 
-    def show_top_movies(self):
-        self.cur.execute("""
-            SELECT name, rating FROM movie
-            ORDER BY rating DESC
-            LIMIT 5
-        """)
-        for name, rating in self.cur.fetchall():
-            print(f"{name} - {rating}/10")
+    @staticmethod
+    def _fts_query(keyword):
+        # Quote every word so user input can't inject FTS5 syntax, and make
+        # each one a prefix match: "star wa" -> "star"* "wa"*
+        terms = ['"' + word.replace('"', '""') + '"*' for word in keyword.split()]
+        return " ".join(terms)
+
+    def iter_search(self, keyword, after=None, chunk_size=100, genre=None):
+        """Yield SearchHits best match first, after the (score, movie_id)
+        keyset `after` if given, optionally only movies of one genre.
+
+        bm25 scores aren't indexed, so every chunk scores and sorts all the
+        matches again: reading n hits costs n / chunk_size full searches.
+        That's meant for the first few pages; to go through every hit, pass
+        a chunk_size as large as the result is expected to be.
+        """
+        query = self._fts_query(keyword)
+        if not query:
+            return iter(())
+        params = (query,)
+        genre_filter = ""
+        if genre is not None:
+            params = (query, genre)
+            # A primary-key probe per match; "rowid IN (...)" would instead
+            # make FTS5 look up every movie of the genre.
+            genre_filter = """
+                AND EXISTS (
+                    SELECT 1 FROM movie_genre
+                    WHERE movie_id = movie_fts.rowid
+                    AND genre_id = (SELECT genre_id FROM genre WHERE name=?)
+                )"""
+        sql = f"""
+            SELECT movie_id, hit.name, snippet, movie.rating, score FROM (
+                SELECT rowid AS movie_id,
+                       highlight(movie_fts, 0, '[', ']') AS name,
+                       snippet(movie_fts, 1, '[', ']', '…', 12) AS snippet,
+                       bm25(movie_fts, 10.0, 1.0) AS score
+                FROM movie_fts
+                WHERE movie_fts MATCH ?{genre_filter}
+            ) AS hit
+            JOIN movie USING (movie_id)
+            WHERE (score, movie_id) > (?, ?)
+            ORDER BY score, movie_id
+            LIMIT ?
+        """
+        after = after or (float("-inf"), 0)
+        return self._iter_keyset(sql, params, after, chunk_size, SearchHit)
+
+    def search_movies(self, keyword, limit=20, genre=None):
+        hits = self.iter_search(keyword, chunk_size=limit, genre=genre)
+        return list(islice(hits, limit))
+
+    def genre_facets(self, keyword=None):
+        """[(genre, movies)] over the movies matching `keyword` (or all
+        movies), most movies first.
+
+        One grouped query: the search matches are joined to movie_genre's
+        primary key, so the counts come from the join table alone and no
+        genre name is read until the groups are done.
+        """
+        if keyword is None:
+            sql, params = (
+                """
+                SELECT genre.name, facet.movies FROM (
+                    SELECT genre_id, COUNT(*) AS movies
+                    FROM movie_genre
+                    GROUP BY genre_id
+                ) AS facet JOIN genre USING (genre_id)
+                ORDER BY facet.movies DESC, genre.name
+            """,
+                (),
+            )
+        else:
+            query = self._fts_query(keyword)
+            if not query:
+                return []
+            sql, params = (
+                """
+                SELECT genre.name, facet.movies FROM (
+                    SELECT movie_genre.genre_id, COUNT(*) AS movies
+                    FROM movie_fts
+                    JOIN movie_genre ON movie_genre.movie_id = movie_fts.rowid
+                    WHERE movie_fts MATCH ?
+                    GROUP BY movie_genre.genre_id
+                ) AS facet JOIN genre USING (genre_id)
+                ORDER BY facet.movies DESC, genre.name
+            """,
+                (query,),
+            )
+        with self._reading() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
 
     def search_movie(self, keyword):
-        self.cur.execute(
-            """
-            SELECT name, description, rating FROM movie
-            WHERE name LIKE ? OR description LIKE ?
-        """,
-            (f"%{keyword}%", f"%{keyword}%"),
-        )
-        results = self.cur.fetchall()
+        results = self.search_movies(keyword)
         if results:
-            for name, desc, rating in results:
-                print(f"{name} ({rating}/10)\n  {desc}\n")
+            for hit in results:
+                print(f"{hit.name} ({hit.rating}/10)\n  {hit.snippet}\n")
         else:
             print("No movies found.")
 
+    def rebuild_search_index(self):
+        with self._writing() as cur:
+            cur.execute("INSERT INTO movie_fts (movie_fts) VALUES ('rebuild')")
+
+    def bulk_import(
+        self,
+        movies=None,
+        genres=None,
+        actors=None,
+        links=None,
+        batch_size=50_000,
+        progress=None,
+    ):
+        importer = BulkImporter(self.conn, batch_size=batch_size, progress=progress)
+        with self._write_lock:
+            self.flush()  # a failing import rolls back, keep buffered writes
+            try:
+                return importer.run({
+                    "movie": movies,
+                    "genre": genres,
+                    "actor": actors,
+                    "link": links,
+                })
+            finally:
+                # Names cached as "not found" may exist now.
+                self._clear_name_cache()
+
+    def export_snapshot(self, path=None, chunk_size=100_000):
+        """Write a columnar .npz snapshot for reporting (see snapshot.py)
+        and return its path.
+
+        It is read over a separate read-only connection, so with WAL
+        (concurrent=True) writers carry on while it runs.
+        """
+        path = path or self.db_file.with_name("MovieDB.snapshot.npz")
+        self.flush()
+        # as_uri() escapes "?", "#" and "%" in the path, as sharded.py does.
+        uri = self.db_file.resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            export_snapshot(conn, path, chunk_size=chunk_size)
+        finally:
+            conn.close()
+        return path
+
+    def logins_per_day(self, start="", end="9999-12-31", user_id=None):
+        """[(day, logins)] for the ISO days from `start` to `end` inclusive,
+        overall or for one user. Reads only the daily rollup, so it keeps
+        working (and stays cheap) after raw history has been purged."""
+        with self._reading() as cur:
+            if user_id is None:
+                cur.execute(
+                    "SELECT day, logins FROM login_days "
+                    "WHERE day BETWEEN ? AND ? ORDER BY day",
+                    (start, end),
+                )
+            else:
+                cur.execute(
+                    "SELECT day, logins FROM login_daily "
+                    "WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                    (user_id, start, end),
+                )
+            return cur.fetchall()
+
+    def apply_login_retention(self, raw_days=None, full_vacuum=False):
+        """Delete login_history rows older than `raw_days` (default: the
+        retention policy's), then vacuum. Returns (rows deleted, pages freed).
+
+        Rows go in chunks, each its own transaction, so other writers are
+        never held up for long.
+        """
+        policy = self.retention
+        raw_days = policy.raw_days if raw_days is None else raw_days
+        cutoff = datetime.now() - timedelta(days=raw_days)
+        deleted = 0
+        while True:
+            with self._writing() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM login_history WHERE history_id IN (
+                        SELECT history_id FROM login_history
+                        WHERE login_time < ? LIMIT ?
+                    )
+                    """,
+                    (cutoff.isoformat(" "), policy.chunk_size),
+                )
+                count = cur.rowcount
+            deleted += count
+            if count < policy.chunk_size:
+                break
+        return deleted, self.vacuum(policy.vacuum_pages, full=full_vacuum)
+
+    def vacuum(self, pages=None, full=False):
+        """Give free pages back to the file system; returns how many.
+
+        Without `full`, this is PRAGMA incremental_vacuum, which only works
+        on files created with auto_vacuum=INCREMENTAL (all new ones). `full`
+        runs VACUUM, which rewrites the file and converts older ones.
+        """
+        with self._write_lock:
+            self.flush()
+            (before,) = self.cur.execute("PRAGMA freelist_count").fetchone()
+            if full:
+                self.cur.execute("VACUUM")
+            else:
+                (mode,) = self.cur.execute("PRAGMA auto_vacuum").fetchone()
+                if mode != 2:  # not INCREMENTAL
+                    return 0
+                self.cur.execute(f"PRAGMA incremental_vacuum({pages or 0})").fetchall()
+            (after,) = self.cur.execute("PRAGMA freelist_count").fetchone()
+            return before - after
+
     def close(self):
+        if self._retention_task:
+            self._retention_task.stop()
+        self.flush()
+        if self.readers:
+            self.readers.close()
         self.conn.close()
+        if self.explain:
+            self.explain.close()
+
+
+def open_moviedb(db_path, backend="sqlite3", **options):
+    """MovieDB on raw sqlite3, or with backend="sqlalchemy" the same API
+    on a pooled SQLAlchemy Core engine (see coredb.py), or with
+    backend="sharded" users split over several files (see sharded.py)."""
+    if backend == "sqlalchemy":
+        from coredb import CoreMovieDB  # imports this module
+
+        return CoreMovieDB(db_path, **options)
+    if backend == "sharded":
+        from sharded import ShardedMovieDB  # imports this module
+
+        return ShardedMovieDB(db_path, **options)
+    if backend != "sqlite3":
+        raise ValueError(f"Unknown backend: {backend}")
+    return MovieDB(db_path, **options)
@@ -0,0 +1,45 @@
+import queue
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def connect_writer(db_file, timeout=30.0, uri=False):
+    """Connection shared by all threads; MovieDB serializes its use."""
+    conn = sqlite3.connect(db_file, timeout=timeout, check_same_thread=False, uri=uri)
+    # WAL lets readers keep reading while the writer commits, and with WAL
+    # synchronous=NORMAL only gives up durability of the last commits on
+    # power loss, never consistency.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class ReaderPool:
+    """Fixed-size pool of read-only connections for concurrent readers."""
+
+    def __init__(self, db_file, size=4, trace=None, row_factory=None):
+        self._idle = queue.LifoQueue()
+        self._all = []
+        uri = Path(db_file).resolve().as_uri() + "?mode=ro"  # escapes ?, # and %
+        for _ in range(size):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            if trace:
+                conn.set_trace_callback(trace)
+            conn.row_factory = row_factory
+            self._all.append(conn)
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get()  # blocks while all connections are busy
+        try:
+            yield conn
+        finally:
+            # End the read transaction so the WAL can be checkpointed.
+            conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
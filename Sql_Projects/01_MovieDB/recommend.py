@@ -0,0 +1,232 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+
+def positions(sorted_ids, ids):
+    """Index of each of `ids` in `sorted_ids`, and whether it is there."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return pos, sorted_ids[pos] == ids
+
+
+@dataclass
+class RatingMatrix:
+    """User x movie ratings in CSR form, one row per movie.
+
+    Row i holds the ratings of movie `movie_ids[i]`: user indices
+    `users[indptr[i]:indptr[i + 1]]` and the ratings divided by the row's
+    L2 norm, so the dot product of two rows is their cosine similarity.
+    """
+
+    movie_ids: np.ndarray
+    indptr: np.ndarray
+    users: np.ndarray
+    values: np.ndarray
+    n_users: int
+    fingerprints: np.ndarray  # per movie, changes whenever its ratings do
+    _entry_rows: np.ndarray = None  # row of each rating, built on first use
+
+    @classmethod
+    def from_db(cls, conn, chunk_size=100_000):
+        cur = conn.execute(
+            "SELECT movie_id, user_id, rating FROM collection "
+            "WHERE rating IS NOT NULL ORDER BY movie_id, user_id"
+        )
+        chunks = []
+        while rows := cur.fetchmany(chunk_size):
+            chunks.append(np.array(rows, dtype=np.float64))
+        data = np.concatenate(chunks) if chunks else np.empty((0, 3))
+        movie_col = data[:, 0].astype(np.int64)
+        user_col = data[:, 1].astype(np.int64)
+        ratings = data[:, 2]
+
+        movie_ids, item = np.unique(movie_col, return_inverse=True)
+        user_ids, users = np.unique(user_col, return_inverse=True)
+        indptr = np.zeros(len(movie_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(item, minlength=len(movie_ids)), out=indptr[1:])
+
+        norms = np.sqrt(np.bincount(item, weights=ratings**2))
+        norms[norms == 0] = 1.0
+        fingerprints = np.stack(
+            [
+                np.bincount(item, minlength=len(movie_ids)),
+                np.bincount(item, weights=ratings),
+                np.bincount(item, weights=ratings * user_col),
+            ],
+            axis=1,
+        )
+        return cls(
+            movie_ids=movie_ids,
+            indptr=indptr,
+            users=users.astype(np.int64),
+            values=(ratings / norms[item]).astype(np.float32),
+            n_users=len(user_ids),
+            fingerprints=fingerprints,
+        )
+
+    def similarities(self, rows, nnz_per_chunk=2_000_000):
+        """Cosine similarity of every movie with each movie in `rows`,
+        as an (n_movies, len(rows)) array."""
+        dense = np.zeros((self.n_users, len(rows)), dtype=np.float32)
+        raters = np.zeros(self.n_users, dtype=bool)
+        for col, row in enumerate(rows):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            dense[self.users[start:end], col] = self.values[start:end]
+            raters[self.users[start:end]] = True
+
+        if self._entry_rows is None:
+            self._entry_rows = np.repeat(
+                np.arange(len(self.movie_ids)), np.diff(self.indptr)
+            )
+        # Only ratings by users who rated a batch movie contribute; they
+        # stay sorted by movie, so each movie's products are one run.
+        entries = np.flatnonzero(raters[self.users])
+        sims = np.zeros((len(self.movie_ids), len(rows)), dtype=np.float32)
+        step = max(nnz_per_chunk // len(rows), 1)  # bounds the temporary
+        for lo in range(0, len(entries), step):
+            chunk = entries[lo : lo + step]
+            products = self.values[chunk, None] * dense[self.users[chunk]]
+            movies = self._entry_rows[chunk]
+            starts = np.flatnonzero(np.diff(movies, prepend=-1))
+            sims[movies[starts]] += np.add.reduceat(products, starts, axis=0)
+        return sims
+
+
+class ItemSimilarityIndex:
+    """Top-k most similar movies for every rated movie, saved as .npz."""
+
+    def __init__(self, movie_ids, neighbors, scores, fingerprints):
+        self.movie_ids = movie_ids
+        self.neighbors = neighbors  # movie IDs, -1 = empty slot
+        self.scores = scores  # cosine similarity, -inf = empty slot
+        self.fingerprints = fingerprints
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def save(self, path):
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp,
+            movie_ids=self.movie_ids,
+            neighbors=self.neighbors,
+            scores=self.scores,
+            fingerprints=self.fingerprints,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def build(cls, matrix, k=20, batch_size=128, previous=None):
+        """Compute the index, reusing `previous` for unchanged movies.
+
+        Only movies whose ratings changed ("dirty") get their similarity
+        column computed. Every other movie keeps its old neighbours minus
+        the dirty ones, merged with its fresh similarities to the dirty
+        movies; the few whose list would then need a neighbour it never
+        stored are recomputed as well.
+        """
+        n = len(matrix.movie_ids)
+        neighbors = np.full((n, k), -1, dtype=np.int64)
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        dirty = np.ones(n, dtype=bool)
+        old_kth = np.full(n, -np.inf, dtype=np.float32)
+
+        if previous is not None and previous.k == k and len(previous.movie_ids):
+            pos, known = positions(previous.movie_ids, matrix.movie_ids)
+            same = known & np.all(previous.fingerprints[pos] == matrix.fingerprints, 1)
+            dirty = ~same
+            neighbors[same] = previous.neighbors[pos[same]]
+            scores[same] = previous.scores[pos[same]]
+            old_kth[same] = scores[same, -1]
+            # Neighbours whose ratings changed are re-scored below.
+            stale = np.isin(neighbors, matrix.movie_ids[dirty]) | ~np.isin(
+                neighbors, matrix.movie_ids
+            )
+            neighbors[stale], scores[stale] = -1, -np.inf
+
+        index = cls(matrix.movie_ids, neighbors, scores, matrix.fingerprints)
+        clean_rows = np.flatnonzero(~dirty)
+        index._update(matrix, np.flatnonzero(dirty), batch_size, clean_rows)
+        # Lists that lost a neighbour and could not refill it from the dirty
+        # movies may be missing an unchanged one: recompute those in full.
+        incomplete = ~dirty & (index.scores[:, -1] < old_kth)
+        index._update(matrix, np.flatnonzero(incomplete), batch_size)
+        return index
+
+    def _update(self, matrix, rows, batch_size, merge_into=()):
+        k = self.k
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            sims = matrix.similarities(batch)
+            sims[sims <= 0] = -np.inf  # no users in common
+            sims[batch, np.arange(len(batch))] = -np.inf  # not your own neighbour
+
+            # The batch movies' own lists: top k of their columns, made
+            # contiguous first since partitioning down a column is slow.
+            columns = np.ascontiguousarray(-sims.T)
+            top = np.argpartition(columns, min(k, len(sims) - 1), axis=1)[:, :k]
+            top_scores = -np.take_along_axis(columns, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            self.scores[batch, : top.shape[1]] = top_scores
+            self.neighbors[batch, : top.shape[1]] = np.where(
+                np.isfinite(top_scores), self.movie_ids[top], -1
+            )
+
+            if len(merge_into):
+                # Unchanged movies may now have a batch movie in their top k.
+                self._merge(merge_into, sims[merge_into], self.movie_ids[batch])
+
+    def _merge(self, rows, new_scores, new_ids):
+        scores = np.concatenate([self.scores[rows], new_scores], axis=1)
+        ids = np.concatenate(
+            [self.neighbors[rows], np.broadcast_to(new_ids, new_scores.shape)], axis=1
+        )
+        best = np.argsort(-scores, axis=1, kind="stable")[:, : self.k]
+        self.scores[rows] = np.take_along_axis(scores, best, axis=1)
+        self.neighbors[rows] = np.where(
+            np.isfinite(self.scores[rows]), np.take_along_axis(ids, best, axis=1), -1
+        )
+
+    def recommend(self, ratings, k=10):
+        """Top-k (movie_id, score) for a user's {movie_id: rating}.
+
+        A candidate scores sum(similarity * rating) over the rated movies
+        it is a neighbour of.
+        """
+        rated = np.fromiter(ratings, dtype=np.int64, count=len(ratings))
+        values = np.fromiter(ratings.values(), dtype=np.float32, count=len(ratings))
+        pos, found = positions(self.movie_ids, rated)
+        rows, values = pos[found], values[found]
+
+        candidates = self.neighbors[rows]
+        keep = (candidates >= 0) & ~np.isin(candidates, rated)
+        # Multiply only kept slots: an empty slot's -inf times a 0 rating is nan.
+        weights = (
+            self.scores[rows][keep] * np.broadcast_to(values[:, None], keep.shape)[keep]
+        )
+        movie_ids, inverse = np.unique(candidates[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=weights)
+        best = np.argsort(-totals, kind="stable")[:k]
+        return [(int(movie_ids[i]), float(totals[i])) for i in best]
+
+
+def build_index(conn, path, k=20, full=False):
+    """(Re)build the index file at `path`, incrementally unless `full`."""
+    previous = None
+    if not full and os.path.exists(path):
+        previous = ItemSimilarityIndex.load(path)
+    matrix = RatingMatrix.from_db(conn)
+    index = ItemSimilarityIndex.build(matrix, k=k, previous=previous)
+    index.save(path)
+    return index
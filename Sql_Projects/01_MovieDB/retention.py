@@ -0,0 +1,50 @@
+import threading
+from dataclasses import dataclass
+
+
+@dataclass
+class LoginRetention:
+    """How long raw login_history rows are kept.
+
+    Daily per-user counts are kept forever in login_daily (a trigger counts
+    every login as it is inserted), so purging raw rows loses the time of
+    day of old logins but no counts. Every `every` seconds, rows older than
+    `raw_days` are deleted `chunk_size` at a time and up to `vacuum_pages`
+    free pages (None = all) are handed back to the file system.
+    """
+
+    raw_days: int = 90
+    every: float = 3600.0
+    chunk_size: int = 10_000
+    vacuum_pages: int | None = None
+
+
+class PeriodicTask:
+    """Runs `func` every `interval` seconds on a daemon timer thread."""
+
+    def __init__(self, interval, func):
+        self.interval = interval
+        self.func = func
+        self._timer = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._schedule()
+
+    def _schedule(self):
+        with self._lock:
+            if not self._stopped:
+                self._timer = threading.Timer(self.interval, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        try:
+            self.func()
+        finally:
+            self._schedule()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._timer:
+                self._timer.cancel()
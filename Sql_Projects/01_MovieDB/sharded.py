@@ -0,0 +1,459 @@
+import heapq
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+from cache import MISSING, LRUCache
+from migrations import SHARD_MIGRATIONS, migrate, run_script
+from moviedb import FriendPick, MovieDB, UserInfo
+from pool import connect_writer
+from retention import PeriodicTask
+
+# Catalog tables only a ShardedMovieDB uses. Every user_id comes from
+# user_directory, which is also where login() and add_friend() find the
+# user of an email, so the catalog is written once per signup and
+# otherwise only read.
+CATALOG_TABLES = """
+    CREATE TABLE IF NOT EXISTS user_directory (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS shard_config (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        shards INTEGER NOT NULL
+    );
+"""
+
+
+def shard_of(user_id, shards):
+    """Index of the shard holding `user_id`, out of `shards`.
+
+    A multiplicative (Fibonacci) hash rather than user_id % shards, so the
+    spread does not depend on any pattern in how IDs are handed out.
+    """
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) * shards >> 64
+
+
+class Shard:
+    """One shard file, with its own connection and lock, and the catalog
+    ATTACHed read-only as `catalog` so queries can join movie names."""
+
+    def __init__(self, path, catalog_file):
+        self.path = path
+        self.conn = connect_writer(path.resolve().as_uri(), uri=True)
+        self.conn.execute("PRAGMA recursive_triggers = ON")
+        self.lock = threading.RLock()
+        migrate(self.conn, SHARD_MIGRATIONS)
+        # Read-only, so nothing a shard does can take the catalog's write
+        # lock; with WAL, reading it never waits for the catalog's writer.
+        self.conn.execute(
+            "ATTACH DATABASE ? AS catalog",
+            (catalog_file.resolve().as_uri() + "?mode=ro",),
+        )
+
+    @contextmanager
+    def writing(self):
+        with self.lock:
+            try:
+                yield self.conn.cursor()
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class ShardedMovieDB:
+    """MovieDB with the per-user tables split over `shards` SQLite files.
+
+    The catalog (movies, actors, genres, search, leaderboards) stays in
+    MovieDB.db, served by a MovieDB. Users, their reviews and watchlist
+    (`collection`), login history and friend lists go to
+    MovieDB.shard<i>.db by a hash of user_id, each file with its own
+    connection, so writes for users on different shards commit in parallel
+    instead of queueing for one file's write lock.
+
+    A trigger can only touch tables in its own file, so reviews can't keep
+    catalog.movie's rating aggregates up to date the way they do in
+    MovieDB. Each shard sums ratings per movie in `movie_votes` instead,
+    and sync_ratings() (every `sync_every` seconds) folds them into the
+    catalog, whose triggers then update the leaderboards. Until then,
+    ratings and leaderboards are that much behind.
+
+    The number of shards is fixed when the files are created.
+    """
+
+    # Catalog methods, served by the catalog's MovieDB as they are.
+    CATALOG_METHODS = frozenset({
+        "find_movie_id",
+        "find_actor_id",
+        "add_movie",
+        "add_genre",
+        "add_actor",
+        "link_actor_to_movie",
+        "rename_movie",
+        "rename_actor",
+        "autocomplete",
+        "reset_autocomplete",
+        "iter_top_movies",
+        "leaderboard",
+        "show_top_movies",
+        "set_leaderboard_prior",
+        "iter_search",
+        "search_movies",
+        "search_movie",
+        "genre_facets",
+        "rebuild_search_index",
+        "bulk_import",
+    })
+
+    def __init__(
+        self, db_path, shards=4, sync_every=60.0, name_cache=4096, **catalog_options
+    ):
+        catalog_options.setdefault("concurrent", True)
+        self.catalog = MovieDB(db_path, name_cache=name_cache, **catalog_options)
+        with self.catalog._writing() as cur:
+            run_script(self.catalog.conn, CATALOG_TABLES)
+            cur.execute(
+                "INSERT OR IGNORE INTO shard_config (id, shards) VALUES (1, ?)",
+                (shards,),
+            )
+            cur.execute("SELECT shards FROM shard_config WHERE id = 1")
+            (created_with,) = cur.fetchone()
+        if created_with != shards:
+            self.catalog.close()
+            raise ValueError(
+                f"{db_path} has {created_with} shards, can't open it with {shards}"
+            )
+
+        self.shards = [
+            Shard(db_path / f"MovieDB.shard{i}.db", self.catalog.db_file)
+            for i in range(shards)
+        ]
+        self._pool = ThreadPoolExecutor(shards, thread_name_prefix="shard")
+        self._user_ids = LRUCache(name_cache)  # email -> user_id
+        self._sync_lock = threading.Lock()
+        self._sync_task = None
+        if sync_every:
+            self._sync_task = PeriodicTask(sync_every, self.sync_ratings)
+
+    def __getattr__(self, name):
+        if name in self.CATALOG_METHODS:
+            return getattr(self.catalog, name)
+        raise AttributeError(f"{type(self).__name__} has no attribute {name!r}")
+
+    def shard_for(self, user_id):
+        return self.shards[shard_of(user_id, len(self.shards))]
+
+    def scatter(self, func, shards=None):
+        """[func(shard) for each shard (default: all)], run concurrently."""
+        return list(self._pool.map(func, self.shards if shards is None else shards))
+
+    def query_shards(self, sql, params=()):
+        """Every shard's rows for `sql`, concatenated."""
+        results = self.scatter(lambda shard: shard.query(sql, params))
+        return [row for rows in results for row in rows]
+
+    def top_across_shards(self, sql, params, limit, key):
+        """The first `limit` rows of `sql` over all shards.
+
+        Each shard must return its rows sorted by `key`; it only needs to
+        return `limit` of them, as no row further down can make the cut.
+        The sorted lists are merged without sorting them again.
+        """
+        results = self.scatter(lambda shard: shard.query(sql, params))
+        return list(islice(heapq.merge(*results, key=key), limit))
+
+    def _user_id(self, email):
+        user_id = self._user_ids.get(email)
+        if user_id is MISSING:
+            # As in MovieDB._lookup_id: a signup that lands while this looks,
+            # or that group commit still holds, must not be cached as a miss.
+            version = self._user_ids.version
+            with self.catalog._reading() as cur:
+                cur.execute(
+                    "SELECT user_id FROM user_directory WHERE email=?", (email,)
+                )
+                row = cur.fetchone()
+            user_id = row[0] if row else None
+            if not self.catalog.committer.pending:
+                self._user_ids.put(email, user_id, version)
+        return user_id
+
+    def signup(self, user: UserInfo):
+        """Create the user on its shard; returns the new user_id."""
+        with self.catalog._writing() as cur:
+            cur.execute(
+                "INSERT INTO user_directory (email) VALUES (?) RETURNING user_id",
+                (user.email,),
+            )
+            ((user_id,),) = cur.fetchall()
+        self._user_ids.invalidate(user.email)
+        now = datetime.now().isoformat(" ")
+        try:
+            with self.shard_for(user_id).writing() as cur:
+                cur.execute(
+                    "INSERT INTO user (user_id, first_name, last_name, email, "
+                    "password, bio, creation_date, last_login) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        user_id,
+                        user.fname,
+                        user.lname,
+                        user.email,
+                        user.password,
+                        user.bio,
+                        now,
+                        now,
+                    ),
+                )
+        except BaseException:
+            with self.catalog._writing() as cur:
+                cur.execute("DELETE FROM user_directory WHERE user_id=?", (user_id,))
+            self._user_ids.invalidate(user.email)
+            raise
+        return user_id
+
+    def login(self, email, password):
+        user_id = self._user_id(email)
+        if user_id is None:
+            return None
+        now = datetime.now().isoformat(" ")
+        with self.shard_for(user_id).writing() as cur:
+            cur.execute(
+                "UPDATE user SET last_login=? WHERE user_id=? AND password=? "
+                "RETURNING user_id",
+                (now, user_id, password),
+            )
+            user = cur.fetchall()
+            if user:
+                cur.execute(
+                    "INSERT INTO login_history (user_id, login_time) VALUES (?, ?)",
+                    (user_id, now),
+                )
+        return user[0][0] if user else None
+
+    def review_movie(self, user_id, movie_name, rating, review_text=""):
+        movie_id = self.catalog.find_movie_id(movie_name)
+        if not movie_id:
+            print("Movie not found.")
+            return
+        with self.shard_for(user_id).writing() as cur:
+            # The collection_votes_* triggers update movie_votes.
+            cur.execute(
+                """
+                INSERT INTO collection (user_id, movie_id, rating, review)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, movie_id) DO UPDATE
+                SET rating = excluded.rating, review = excluded.review
+            """,
+                (user_id, movie_id, rating, review_text),
+            )
+        print("Review added.\n")
+
+    def toggle_watchlist(self, user_id, movie_name):
+        """Flip the movie in or out of the user's watchlist and return the
+        new state (None if there is no such movie)."""
+        movie_id = self.catalog.find_movie_id(movie_name)
+        if not movie_id:
+            return None
+        with self.shard_for(user_id).writing() as cur:
+            cur.execute(
+                """
+                INSERT INTO collection (user_id, movie_id, watchlist)
+                VALUES (?, ?, TRUE)
+                ON CONFLICT (user_id, movie_id)
+                DO UPDATE SET watchlist = NOT ifnull(watchlist, FALSE)
+                RETURNING watchlist
+                """,
+                (user_id, movie_id),
+            )
+            (watchlist,) = cur.fetchall()[0]
+        print("Watchlist updated.\n")
+        return bool(watchlist)
+
+    def add_friend(self, user_id, friend_email):
+        """Friendships are stored on the shard of `user_id`, the user who
+        added the friend."""
+        friend_id = self._user_id(friend_email)
+        if friend_id:
+            with self.shard_for(user_id).writing() as cur:
+                cur.execute(
+                    "INSERT OR IGNORE INTO friendlist (user_id, friend_id) "
+                    "VALUES (?, ?)",
+                    (user_id, friend_id),
+                )
+        print("Friend added.\n" if friend_id else "User not found.\n")
+
+    def reviews(self, user_id):
+        """[(movie name, rating, review)] of one user, by movie name: one
+        shard, joined with the attached catalog."""
+        return self.shard_for(user_id).query(
+            """
+            SELECT movie.name, c.rating, c.review
+            FROM collection AS c JOIN catalog.movie AS movie USING (movie_id)
+            WHERE c.user_id = ? AND c.rating IS NOT NULL
+            ORDER BY movie.name
+        """,
+            (user_id,),
+        )
+
+    def count_users(self):
+        return sum(count for (count,) in self.query_shards("SELECT COUNT(*) FROM user"))
+
+    def top_reviewers(self, limit=10):
+        """[(user_id, reviews)] of the users with the most reviews. A user's
+        reviews are all on one shard, so each shard's top `limit` is exact."""
+        return self.top_across_shards(
+            """
+            SELECT user_id, COUNT(*) AS reviews FROM collection
+            WHERE rating IS NOT NULL
+            GROUP BY user_id
+            ORDER BY reviews DESC, user_id
+            LIMIT ?
+        """,
+            (limit,),
+            limit,
+            key=lambda row: (-row[1], row[0]),
+        )
+
+    def logins_per_day(self, start="", end="9999-12-31", user_id=None):
+        """[(day, logins)] from the daily rollups, as MovieDB.logins_per_day:
+        one shard for a user, the sum over all of them otherwise."""
+        if user_id is not None:
+            return self.shard_for(user_id).query(
+                "SELECT day, logins FROM login_daily "
+                "WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (user_id, start, end),
+            )
+        totals = Counter()
+        for day, logins in self.query_shards(
+            "SELECT day, logins FROM login_days WHERE day BETWEEN ? AND ?",
+            (start, end),
+        ):
+            totals[day] += logins
+        return sorted(totals.items())
+
+    def friends_rated_highly(self, user_id, min_rating=8.0, limit=20):
+        """Movies the user hasn't rated that friends rated at least
+        `min_rating`, most fans first, as MovieDB.friends_rated_highly with
+        hops=1. Only the shards holding a friend are asked, once each."""
+        home = self.shard_for(user_id)
+        friends = home.query(
+            "SELECT friend_id FROM friendlist WHERE user_id=?", (user_id,)
+        )
+        rated = {
+            movie_id
+            for (movie_id,) in home.query(
+                "SELECT movie_id FROM collection "
+                "WHERE user_id=? AND rating IS NOT NULL",
+                (user_id,),
+            )
+        }
+        by_shard = {}
+        for (friend_id,) in friends:
+            by_shard.setdefault(self.shard_for(friend_id), []).append(friend_id)
+
+        sql = """
+            SELECT c.movie_id, SUM(c.rating), COUNT(*)
+            FROM json_each(?) AS friend
+            JOIN collection AS c ON c.user_id = friend.value
+            WHERE c.rating >= ?
+            GROUP BY c.movie_id
+        """
+        results = self.scatter(
+            lambda shard: shard.query(sql, (json.dumps(by_shard[shard]), min_rating)),
+            list(by_shard),
+        )
+        totals = {}
+        for rows in results:
+            for movie_id, total, fans in rows:
+                if movie_id not in rated:
+                    old_total, old_fans = totals.get(movie_id, (0.0, 0))
+                    totals[movie_id] = (old_total + total, old_fans + fans)
+        best = sorted(
+            totals.items(),
+            key=lambda item: (-item[1][1], -item[1][0] / item[1][1], item[0]),
+        )[:limit]
+        if not best:
+            return []
+        with self.catalog._reading() as cur:
+            cur.execute(
+                "SELECT movie_id, name FROM movie "
+                "WHERE movie_id IN (SELECT value FROM json_each(?))",
+                (json.dumps([movie_id for movie_id, _ in best]),),
+            )
+            names = dict(cur.fetchall())
+        return [
+            FriendPick(movie_id, names.get(movie_id), total / fans, fans)
+            for movie_id, (total, fans) in best
+        ]
+
+    def sync_ratings(self):
+        """Fold the ratings changed since the last call into the catalog's
+        movie.rating_sum/rating_count/rating, and through its triggers into
+        the leaderboards. Returns the number of movies updated.
+
+        Only movies with unsynced changes on some shard are summed across
+        all shards; the cost follows the number of movies reviewed since
+        the last sync, not the number of reviews or of movies.
+        """
+        with self._sync_lock:
+            changed = self.scatter(
+                lambda shard: shard.query(
+                    "SELECT movie_id, changes FROM movie_votes WHERE changes > 0"
+                )
+            )
+            movie_ids = {movie_id for rows in changed for movie_id, _ in rows}
+            if not movie_ids:
+                return 0
+            totals = {movie_id: (0.0, 0) for movie_id in movie_ids}
+            for movie_id, rating_sum, rating_count in self.query_shards(
+                "SELECT movie_id, rating_sum, rating_count FROM movie_votes "
+                "WHERE movie_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted(movie_ids)),),
+            ):
+                old_sum, old_count = totals[movie_id]
+                totals[movie_id] = (old_sum + rating_sum, old_count + rating_count)
+
+            with self.catalog._writing() as cur:
+                cur.executemany(
+                    "UPDATE movie SET rating_sum=?, rating_count=?, rating=? "
+                    "WHERE movie_id=?",
+                    [
+                        (total, count, total / count if count else 0.0, movie_id)
+                        for movie_id, (total, count) in totals.items()
+                    ],
+                )
+
+            # Subtract what was seen rather than zeroing, so reviews written
+            # since are picked up by the next sync.
+            def settle(shard, rows):
+                with shard.writing() as cur:
+                    cur.executemany(
+                        "UPDATE movie_votes SET changes = changes - ? "
+                        "WHERE movie_id = ?",
+                        [(changes, movie_id) for movie_id, changes in rows],
+                    )
+
+            list(self._pool.map(settle, self.shards, changed))
+            return len(movie_ids)
+
+    def close(self):
+        if self._sync_task:
+            self._sync_task.stop()
+        self._pool.shutdown()
+        for shard in self.shards:
+            shard.close()
+        self.catalog.close()
@@ -0,0 +1,389 @@
+import json
+import os
+from bisect import bisect_left
+from datetime import datetime
+
+import numpy as np
+
+# What a snapshot holds: the columns reporting needs, and never emails,
+# passwords or review texts. Types are the snapshot's, not SQLite's:
+# "int" (NULL = -1), "real" (NULL = nan), "bool" (NULL = False) and
+# "text", dictionary-encoded.
+SNAPSHOT_TABLES = {
+    "movie": {
+        "movie_id": "int",
+        "name": "text",
+        "release_date": "text",
+        "director": "text",
+        "rating": "real",
+        "rating_count": "int",
+    },
+    "genre": {"genre_id": "int", "name": "text"},
+    "movie_genre": {"movie_id": "int", "genre_id": "int"},
+    "actor": {"actor_id": "int", "name": "text", "dob": "text"},
+    "movie_actor": {"movie_id": "int", "actor_id": "int"},
+    "collection": {
+        "user_id": "int",
+        "movie_id": "int",
+        "rating": "real",
+        "watchlist": "bool",
+    },
+    "user": {"user_id": "int", "creation_date": "text", "last_login": "text"},
+    "friendlist": {"user_id": "int", "friend_id": "int"},
+    "login_daily": {"day": "text", "user_id": "int", "logins": "int"},
+}
+
+
+class NumberColumn:
+    def __init__(self, dtype, null):
+        self.dtype = dtype
+        self.null = null
+        self.chunks = []
+
+    def add(self, values):
+        self.chunks.append(
+            np.array([self.null if v is None else v for v in values], self.dtype)
+        )
+
+    def finish(self):
+        if not self.chunks:
+            return {"": np.empty(0, self.dtype)}
+        return {"": np.concatenate(self.chunks)}
+
+
+class TextColumn:
+    """Strings streamed in as int32 codes, numbered in order of first
+    appearance and renumbered by sorted value at the end, so that code
+    order is string order."""
+
+    def __init__(self):
+        self.codes = {}
+        self.chunks = []
+
+    def add(self, values):
+        codes = self.codes
+        self.chunks.append(
+            np.fromiter(
+                (
+                    -1 if v is None else codes.setdefault(str(v), len(codes))
+                    for v in values
+                ),
+                dtype=np.int32,
+                count=len(values),
+            )
+        )
+
+    def finish(self):
+        values = list(self.codes)
+        order = sorted(range(len(values)), key=values.__getitem__)
+        rank = np.empty(len(values) + 1, dtype=np.int32)
+        rank[order] = np.arange(len(values), dtype=np.int32)
+        rank[-1] = -1  # code -1 (NULL) indexes this slot
+        codes = np.concatenate(self.chunks) if self.chunks else np.empty(0, np.int32)
+        encoded = [values[i].encode() for i in order]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return {
+            ".codes": rank[codes],
+            ".dict": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            ".offsets": offsets,
+        }
+
+
+COLUMN_TYPES = {
+    "int": lambda: NumberColumn(np.int64, -1),
+    "real": lambda: NumberColumn(np.float64, np.nan),
+    "bool": lambda: NumberColumn(np.bool_, False),
+    "text": TextColumn,
+}
+
+
+def export_snapshot(conn, path, tables=SNAPSHOT_TABLES, chunk_size=100_000):
+    """Write `tables` ({table: {column: type}}) to a compressed .npz.
+
+    Everything is read in one transaction, so the tables are consistent
+    with each other, `chunk_size` rows at a time, so only the columnar
+    copy is ever held in memory. Returns the snapshot's metadata.
+    """
+    arrays = {}
+    meta = {"created": datetime.now().isoformat(" "), "tables": {}}
+    conn.execute("BEGIN")
+    try:
+        for table, columns in tables.items():
+            builders = [COLUMN_TYPES[kind]() for kind in columns.values()]
+            cur = conn.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            rows = 0
+            while chunk := cur.fetchmany(chunk_size):
+                for builder, values in zip(builders, zip(*chunk)):
+                    builder.add(values)
+                rows += len(chunk)
+            for name, builder in zip(columns, builders):
+                for suffix, array in builder.finish().items():
+                    arrays[f"{table}.{name}{suffix}"] = array
+            meta["tables"][table] = {"rows": rows, "columns": columns}
+    finally:
+        conn.rollback()
+
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    tmp = f"{path}.tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+    return meta
+
+
+class Dictionary:
+    """The sorted distinct values of a text column, stored as UTF-8 bytes
+    and offsets; a code is an index into it."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._values = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def values(self):
+        if self._values is None:
+            data = self.data.tobytes()
+            bounds = self.offsets.tolist()
+            self._values = [
+                data[start:end].decode() for start, end in zip(bounds, bounds[1:])
+            ]
+        return self._values
+
+    def code(self, value):
+        """The code of `value`, or -1 if the column never holds it."""
+        values = self.values()
+        i = bisect_left(values, value)
+        return i if i < len(values) and values[i] == value else -1
+
+    def decode(self, codes):
+        values = self.values()
+        return [values[code] if code >= 0 else None for code in codes.tolist()]
+
+
+class Frame:
+    """Columns of equal length, as NumPy arrays.
+
+    Text columns hold int32 codes into a sorted Dictionary (-1 = NULL), so
+    filtering, joining, grouping and sorting on them all work on integers;
+    strings are only decoded by rows(), for the rows that are left.
+    """
+
+    def __init__(self, columns, dictionaries=None):
+        self.columns = dict(columns)
+        self.dictionaries = dict(dictionaries or {})
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _with(self, columns):
+        dictionaries = {
+            name: dictionary
+            for name, dictionary in self.dictionaries.items()
+            if name in columns
+        }
+        return Frame(columns, dictionaries)
+
+    def equals(self, column, value):
+        """Row mask of `column == value`; for text, one integer compare."""
+        if column in self.dictionaries:
+            value = self.dictionaries[column].code(value)
+            if value < 0:  # never there; -1 would match the NULLs
+                return np.zeros(len(self), dtype=bool)
+        return self.columns[column] == value
+
+    def where(self, mask):
+        return self._with({name: values[mask] for name, values in self.columns.items()})
+
+    def select(self, *names):
+        return self._with({name: self.columns[name] for name in names})
+
+    def map_text(self, column, func, name, dtype=np.int64, null=-1):
+        """Add column `name` = func(value) of a text column. `func` runs once
+        per distinct value, not per row; NULL (and None results) give `null`."""
+        dictionary = self.dictionaries[column]
+        mapped = [func(value) for value in dictionary.values()]
+        table = np.array([null if v is None else v for v in mapped] + [null], dtype)
+        frame = Frame(self.columns, self.dictionaries)
+        frame.columns[name] = table[self.columns[column]]
+        return frame
+
+    def join(self, other, on, right_on=None, columns=None):
+        """Inner equi-join: one row per pair of matching keys, with this
+        frame's columns and `columns` of `other` (default: all but its key;
+        a dict renames them). Keys must be numbers: text codes of two
+        tables index different dictionaries."""
+        right_on = right_on or on
+        if on in self.dictionaries or right_on in other.dictionaries:
+            raise ValueError("Can't join on a text column")
+        if columns is None:
+            columns = [name for name in other.columns if name != right_on]
+        if not isinstance(columns, dict):
+            columns = {name: name for name in columns}
+        clash = set(columns.values()) & set(self.columns)
+        if clash:
+            raise ValueError(f"Both frames have {sorted(clash)}; rename them")
+
+        # Sort the right keys once; each left key then matches one run.
+        order = np.argsort(other.columns[right_on], kind="stable")
+        sorted_keys = other.columns[right_on][order]
+        keys = self.columns[on]
+        lo = np.searchsorted(sorted_keys, keys, "left")
+        counts = np.searchsorted(sorted_keys, keys, "right") - lo
+        left = np.repeat(np.arange(len(keys)), counts)
+        run_starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        right = order[np.arange(len(left)) + run_starts]
+
+        result = {name: values[left] for name, values in self.columns.items()}
+        dictionaries = dict(self.dictionaries)
+        for name, new_name in columns.items():
+            result[new_name] = other.columns[name][right]
+            if name in other.dictionaries:
+                dictionaries[new_name] = other.dictionaries[name]
+        return Frame(result, dictionaries)
+
+    def group_by(self, keys, **aggregates):
+        """One row per distinct `keys` (a column or a list of them), in key
+        order, with name=(column, func) aggregates: func is "count", "sum",
+        "mean", "min" or "max" and skips nan; (None, "count") counts rows."""
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        # Number each key's distinct values, and combine the numbers into
+        # one integer per row to group on.
+        group = np.zeros(len(self), dtype=np.int64)
+        levels = []
+        for key in keys:
+            values, codes = np.unique(self.columns[key], return_inverse=True)
+            levels.append(values)
+            group = group * max(len(values), 1) + codes
+        groups, inverse = np.unique(group, return_inverse=True)
+
+        result = {}
+        rest = groups
+        for key, values in reversed(list(zip(keys, levels))):
+            result[key] = values[rest % max(len(values), 1)]
+            rest = rest // max(len(values), 1)
+        result = {key: result[key] for key in keys}
+
+        n = len(groups)
+        for name, (column, func) in aggregates.items():
+            if column is None:
+                if func != "count":
+                    raise ValueError("Only count can do without a column")
+                result[name] = np.bincount(inverse, minlength=n)
+                continue
+            values = self.columns[column].astype(np.float64)
+            valid = ~np.isnan(values)
+            rows, values = inverse[valid], values[valid]
+            counts = np.bincount(rows, minlength=n)
+            if func == "count":
+                result[name] = counts
+            elif func in ("sum", "mean"):
+                sums = np.bincount(rows, weights=values, minlength=n)
+                if func == "mean":
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        sums = sums / counts
+                result[name] = sums
+            elif func in ("min", "max"):
+                ufunc, start = (
+                    (np.fmin, np.inf) if func == "min" else (np.fmax, -np.inf)
+                )
+                out = np.full(n, start)
+                ufunc.at(out, rows, values)
+                out[counts == 0] = np.nan
+                result[name] = out
+            else:
+                raise ValueError(f"Unknown aggregate: {func}")
+        return self._with(result)
+
+    def sort_by(self, column, descending=False):
+        order = np.argsort(self.columns[column], kind="stable")
+        if descending:
+            order = order[::-1]
+        return self.where(order)
+
+    def head(self, n):
+        return self.where(slice(0, n))
+
+    def rows(self):
+        """The rows as tuples of Python values, text decoded."""
+        columns = [
+            self.dictionaries[name].decode(values)
+            if name in self.dictionaries
+            else values.tolist()
+            for name, values in self.columns.items()
+        ]
+        return list(zip(*columns))
+
+
+class Snapshot:
+    """A snapshot file in memory; snapshot["movie"] is the movie Frame."""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        self.meta = json.loads(arrays.pop("meta").tobytes())
+        self.created = self.meta["created"]
+        self.tables = {}
+        for table, info in self.meta["tables"].items():
+            columns, dictionaries = {}, {}
+            for name, kind in info["columns"].items():
+                key = f"{table}.{name}"
+                if kind == "text":
+                    columns[name] = arrays[f"{key}.codes"]
+                    dictionaries[name] = Dictionary(
+                        arrays[f"{key}.dict"], arrays[f"{key}.offsets"]
+                    )
+                else:
+                    columns[name] = arrays[key]
+            self.tables[table] = Frame(columns, dictionaries)
+
+    def __getitem__(self, table):
+        return self.tables[table]
+
+
+def release_year(date):
+    year = date[:4]
+    return int(year) if year.isdigit() else None
+
+
+def rating_histogram(snapshot):
+    """[(rating, reviews)] for the whole-number ratings 0 to 10, and for
+    any below or above that range (the schema doesn't forbid them)."""
+    ratings = snapshot["collection"]["rating"]
+    ratings = np.rint(ratings[~np.isnan(ratings)]).astype(np.int64)
+    # bincount only takes non-negative values: count from the lowest one.
+    low = min(int(ratings.min(initial=0)), 0)
+    counts = np.bincount(ratings - low, minlength=11 - low)
+    return list(enumerate(counts.tolist(), start=low))
+
+
+def reviews_per_genre_year(snapshot):
+    """[(genre, release year, reviews, mean rating)], by genre and year.
+
+    Reviews are counted per movie first, so the joins only see one row
+    per movie rather than one per review.
+    """
+    collection = snapshot["collection"]
+    per_movie = collection.where(~np.isnan(collection["rating"])).group_by(
+        "movie_id", reviews=(None, "count"), rating_sum=("rating", "sum")
+    )
+    movies = snapshot["movie"].map_text("release_date", release_year, "year")
+    report = (
+        per_movie.join(snapshot["movie_genre"], "movie_id")
+        .join(movies, "movie_id", columns=["year"])
+        .join(snapshot["genre"], "genre_id", columns={"name": "genre"})
+        .group_by(
+            ["genre", "year"],
+            reviews=("reviews", "sum"),
+            rating_sum=("rating_sum", "sum"),
+        )
+    )
+    return [
+        (genre, year, int(reviews), rating_sum / reviews)
+        for genre, year, reviews, rating_sum in report.rows()
+    ]
@@ -0,0 +1,122 @@
+from array import array
+from collections import Counter
+
+
+class FriendGraph:
+    """In-memory friend graph in CSR form (two flat integer arrays).
+
+    `targets[offsets[u]:offsets[u + 1]]` are the friends user `u` added.
+    Edges added after the last build go to a small side table and are
+    merged into the arrays once there are `compact_after` of them, so
+    neither a new friendship nor a refresh ever re-reads the whole table.
+
+    The arrays and the side table are published together as one
+    `(offsets, targets, extra)` tuple, and each query reads it once, so a
+    query running next to a compact() sees one generation of the graph.
+    Only one thread at a time may load/refresh/add (MovieDB holds its
+    `_graph_lock`); queries need no lock.
+    """
+
+    def __init__(self, compact_after=10_000):
+        self.compact_after = compact_after
+        self._state = (array("q", [0]), array("q"), {})
+        self.last_rowid = 0
+        self._extra_count = 0
+
+    def load(self, conn):
+        """Rebuild from scratch out of the friendlist table."""
+        offsets, targets = array("q", [0]), array("q")
+        rows = conn.execute(
+            "SELECT user_id, friend_id FROM friendlist ORDER BY user_id, friend_id"
+        )
+        for user_id, friend_id in rows:
+            while len(offsets) <= user_id:
+                offsets.append(len(targets))
+            targets.append(friend_id)
+        offsets.append(len(targets))
+        (self.last_rowid,) = conn.execute(
+            "SELECT ifnull(MAX(rowid), 0) FROM friendlist"
+        ).fetchone()
+        self._state, self._extra_count = (offsets, targets, {}), 0
+        return self
+
+    def refresh(self, conn):
+        """Pick up friendships inserted since the last load/refresh.
+
+        Friendlist rows are never deleted by MovieDB; after deleting some by
+        hand, call load() instead.
+        """
+        rows = conn.execute(
+            "SELECT rowid, user_id, friend_id FROM friendlist WHERE rowid > ?",
+            (self.last_rowid,),
+        ).fetchall()
+        for rowid, user_id, friend_id in rows:
+            self.add(user_id, friend_id)
+            self.last_rowid = max(self.last_rowid, rowid)
+        return self
+
+    def add(self, user_id, friend_id):
+        if friend_id in self.friends(user_id):
+            return
+        # A new list rather than append(), so none a query holds changes.
+        extra = self._state[2]
+        extra[user_id] = [*extra.get(user_id, ()), friend_id]
+        self._extra_count += 1
+        if self._extra_count >= self.compact_after:
+            self.compact()
+
+    def compact(self):
+        """Merge the side table into the CSR arrays."""
+        state = self._state
+        offsets, _, extra = state
+        users = max(len(offsets) - 1, max(extra, default=-1) + 1)
+        new_offsets, new_targets = array("q", [0]), array("q")
+        for user_id in range(users):
+            new_targets.extend(sorted(self._friends(state, user_id)))
+            new_offsets.append(len(new_targets))
+        self._state, self._extra_count = (new_offsets, new_targets, {}), 0
+
+    @staticmethod
+    def _friends(state, user_id):
+        offsets, targets, extra = state
+        if user_id + 1 < len(offsets):
+            friends = targets[offsets[user_id] : offsets[user_id + 1]].tolist()
+        else:
+            friends = []
+        return friends + extra.get(user_id, [])
+
+    def friends(self, user_id):
+        return self._friends(self._state, user_id)
+
+    def within(self, user_id, hops=2):
+        """{user: distance} for everyone reachable in 1..hops steps."""
+        state = self._state
+        seen = {user_id: 0}
+        frontier = [user_id]
+        for depth in range(1, hops + 1):
+            next_frontier = []
+            for user in frontier:
+                for friend in self._friends(state, user):
+                    if friend not in seen:
+                        seen[friend] = depth
+                        next_frontier.append(friend)
+            frontier = next_frontier
+        del seen[user_id]
+        return seen
+
+    def mutual_counts(self, user_id):
+        """Friends-of-friends that aren't friends yet, with the number of
+        friends they have in common with `user_id`."""
+        state = self._state
+        friends = set(self._friends(state, user_id))
+        counts = Counter(
+            candidate
+            for friend in friends
+            for candidate in self._friends(state, friend)
+            if candidate != user_id and candidate not in friends
+        )
+        return counts
+
+    def mutual(self, user_id, other_id):
+        state = self._state
+        return set(self._friends(state, user_id)) & set(self._friends(state, other_id))
@@ -0,0 +1,153 @@
+import atexit
+import inspect
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from functools import wraps
+
+# Trace callbacks get statements with their parameters filled in. Putting
+# placeholders back groups every execution of a statement under one key.
+LITERAL = re.compile(
+    r"'(?:[^']|'')*'|\bX'[0-9A-Fa-f]*'|(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b"
+)
+
+
+def normalize(statement):
+    return " ".join(LITERAL.sub("?", statement).split())
+
+
+@dataclass
+class Stats:
+    calls: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    rows: int = 0
+
+    def add(self, seconds, rows):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows
+
+
+class SQLTracer:
+    """Per-statement and per-method timings for MovieDB.
+
+    Installed as a connection's trace callback it learns when each
+    statement starts; a statement is timed until the next one starts on the
+    same thread or the MovieDB method that ran it returns, so its time
+    includes fetching its rows. Rows are counted by a row factory.
+    Statements run outside a MovieDB method (e.g. on `db.cur` directly, or
+    while iterating an iter_* generator) are counted but not timed.
+
+    Statements slower than `slow_ms` are appended to `slow_log`, normalized
+    so that no parameter (a password, say) ends up in the file, and a
+    summary is printed at exit unless `summary=False`.
+    """
+
+    def __init__(self, slow_ms=100.0, slow_log=None, summary=True):
+        self.slow_seconds = slow_ms / 1000
+        self.slow_log = slow_log
+        self.statements = {}
+        self.methods = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if summary:
+            atexit.register(self.report)
+
+    def _state(self):
+        local = self._local
+        if not hasattr(local, "methods"):
+            local.methods = []  # traced methods running on this thread
+            local.statement = None  # raw text of the statement being timed
+            local.start = 0.0
+            local.rows = 0  # rows of the current statement
+            local.total_rows = 0
+        return local
+
+    def __call__(self, statement):
+        now = time.perf_counter()
+        local = self._state()
+        if statement == local.statement or statement.startswith("--"):
+            # Trigger programs repeat their statement's text and virtual
+            # tables (FTS5) trace their own SQL as comments: both are part
+            # of the statement being timed.
+            return
+        self._finish(local, now)
+        local.statement, local.start, local.rows = statement, now, 0
+
+    def count_row(self, cursor, row):
+        """Row factory that counts rows and returns them unchanged."""
+        local = self._state()
+        local.rows += 1
+        local.total_rows += 1
+        return row
+
+    def _finish(self, local, now):
+        if local.statement is None:
+            return
+        timed = bool(local.methods)
+        seconds = now - local.start if timed else 0.0
+        with self._lock:
+            stats = self.statements.setdefault(normalize(local.statement), Stats())
+            stats.add(seconds, local.rows)
+        if timed and seconds >= self.slow_seconds:
+            self._log_slow(local.methods[-1], seconds, local.rows, local.statement)
+        local.statement = None
+
+    def _log_slow(self, method, seconds, rows, statement):
+        if self.slow_log is None:
+            return
+        line = (
+            f"{datetime.now().isoformat(timespec='milliseconds')} "
+            f"{seconds * 1e3:.1f} ms rows={rows} {method}: "
+            f"{normalize(statement)}\n"
+        )
+        with self._lock, open(self.slow_log, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def wrap(self, name, func):
+        @wraps(func)
+        def traced(*args, **kwargs):
+            local = self._state()
+            self._finish(local, time.perf_counter())
+            local.methods.append(name)
+            rows_before = local.total_rows
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                now = time.perf_counter()
+                self._finish(local, now)
+                local.methods.pop()
+                with self._lock:
+                    stats = self.methods.setdefault(name, Stats())
+                    stats.add(now - start, local.total_rows - rows_before)
+
+        return traced
+
+    def instrument(self, obj):
+        """Time every public method of `obj`, on this instance only."""
+        for name, _ in inspect.getmembers(type(obj), inspect.isfunction):
+            if not name.startswith("_"):
+                setattr(obj, name, self.wrap(name, getattr(obj, name)))
+
+    def report(self, limit=20):
+        for title, table in (("statement", self.statements), ("method", self.methods)):
+            if not table:
+                continue
+            with self._lock:
+                rows = sorted(table.items(), key=lambda item: -item[1].seconds)
+            print(
+                f"\n{'calls':>8} {'total ms':>10} {'avg ms':>8} {'max ms':>8} "
+                f"{'rows':>9}  {title}"
+            )
+            for key, stats in rows[:limit]:
+                print(
+                    f"{stats.calls:>8,} {stats.seconds * 1e3:>10.1f} "
+                    f"{stats.seconds / stats.calls * 1e3:>8.2f} "
+                    f"{stats.max_seconds * 1e3:>8.2f} {stats.rows:>9,}  "
+                    f"{key[:100]}"
+                )
@@ -0,0 +1,246 @@
+import random
+import time
+from dataclasses import dataclass, fields
+from datetime import date, datetime, timedelta
+
+from importer import batched
+
+# How a row budget is split between tables, roughly what a live site has:
+# most rows are ratings, and there are far more ratings than movies.
+SHARES = {
+    "users": 0.05,
+    "movies": 0.04,
+    "actors": 0.03,
+    "genres": 0.07,
+    "links": 0.12,
+    "reviews": 0.45,
+    "watchlist": 0.10,
+    "friendships": 0.14,
+}
+
+GENRES = (
+    "Drama", "Comedy", "Action", "Thriller", "Horror", "Romance", "Sci-Fi",
+    "Documentary", "Animation", "Crime", "Fantasy", "Adventure", "Mystery",
+    "Family", "War", "Western", "Musical", "History",
+)  # fmt: skip
+FIRST_NAMES = (
+    "Ann", "Bob", "Carla", "Dev", "Emma", "Farid", "Grace", "Hiro", "Ines",
+    "Jon", "Kate", "Liam", "Mia", "Noor", "Omar", "Priya", "Quinn", "Rosa",
+    "Sam", "Tara", "Uma", "Victor", "Wen", "Yara", "Zoe",
+)  # fmt: skip
+LAST_NAMES = (
+    "Adams", "Baker", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Hughes",
+    "Ito", "Jones", "Khan", "Lopez", "Miller", "Nowak", "Okafor", "Patel",
+    "Rossi", "Smith", "Tanaka", "Weber",
+)  # fmt: skip
+ADJECTIVES = (
+    "Silent", "Broken", "Golden", "Last", "Hidden", "Crimson", "Lost", "Wild",
+    "Frozen", "Electric", "Midnight", "Burning", "Distant", "Savage", "Quiet",
+)  # fmt: skip
+NOUNS = (
+    "River", "Empire", "Heart", "Station", "Garden", "Signal", "Storm",
+    "Kingdom", "Mirror", "Harbor", "Machine", "Forest", "Promise", "Shadow",
+)  # fmt: skip
+PLOT_WORDS = (
+    "a detective", "two sisters", "a lonely robot", "the crew", "an heiress",
+    "a small town", "the rebels", "a chef", "an old soldier", "the band",
+    "must", "tries to", "refuses to", "sets out to", "learns to",
+    "escape", "solve a murder", "win the cup", "save the farm", "find home",
+    "in space", "in Paris", "during the war", "before dawn", "at sea",
+)  # fmt: skip
+
+
+@dataclass(frozen=True)
+class Scale:
+    """Row counts per table."""
+
+    users: int
+    movies: int
+    actors: int
+    genres: int
+    links: int
+    reviews: int
+    watchlist: int
+    friendships: int
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Split a total of `rows` rows between the tables by SHARES."""
+        return cls(**{
+            name: max(int(rows * share), 1) for name, share in SHARES.items()
+        })
+
+    @property
+    def total(self):
+        return sum(getattr(self, field.name) for field in fields(self))
+
+
+def skewed(rng, n, power):
+    """Index in [0, n) where low indices are much more likely (popular
+    movies, active users): the top 1% gets about 1% ** (1 / power)."""
+    return int(n * rng.random() ** power)
+
+
+class SyntheticData:
+    """Seeded record streams for every MovieDB table.
+
+    Each stream has its own RNG derived from the seed, so the same seed
+    produces the same rows whatever else is generated, and rows refer to
+    each other by position: movie i is named `movie_name(i)` and, loaded
+    into an empty database, gets ID i + 1.
+    """
+
+    def __init__(self, scale, seed=0):
+        self.scale = scale
+        self.seed = seed
+        # A movie's ratings scatter around its (hidden) quality.
+        rng = self._rng("quality")
+        self.quality = [rng.uniform(3.0, 9.0) for _ in range(scale.movies)]
+
+    def _rng(self, stream):
+        return random.Random(f"{self.seed}:{stream}")
+
+    @staticmethod
+    def movie_name(i):
+        return f"{ADJECTIVES[i % 15]} {NOUNS[i // 15 % 14]} {i // 210 + 1}"
+
+    @staticmethod
+    def actor_name(i):
+        return f"{FIRST_NAMES[i % 25]} {LAST_NAMES[i // 25 % 20]} {i // 500 + 1}"
+
+    @staticmethod
+    def email(i):
+        return f"user{i}@example.com"
+
+    def users(self):
+        rng = self._rng("users")
+        start = datetime(2020, 1, 1)
+        for i in range(self.scale.users):
+            joined = start + timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+            yield (
+                i + 1,
+                rng.choice(FIRST_NAMES),
+                rng.choice(LAST_NAMES),
+                self.email(i),
+                "password",
+                "Film fan." if rng.random() < 0.3 else "",
+                joined.isoformat(" "),
+                (joined + timedelta(days=rng.randrange(400))).isoformat(" "),
+            )
+
+    def movies(self):
+        rng = self._rng("movies")
+        for i in range(self.scale.movies):
+            plot = " ".join(rng.choice(PLOT_WORDS[j * 5 : j * 5 + 5]) for j in range(5))
+            released = date(1950, 1, 1) + timedelta(days=rng.randrange(75 * 365))
+            yield {
+                "name": self.movie_name(i),
+                "description": plot.capitalize() + ".",
+                "release_date": released.isoformat(),
+                "director": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            }
+
+    def actors(self):
+        rng = self._rng("actors")
+        for i in range(self.scale.actors):
+            born = date(1930, 1, 1) + timedelta(days=rng.randrange(70 * 365))
+            yield {
+                "name": self.actor_name(i),
+                "dob": born.isoformat(),
+                "movies_count": rng.randrange(1, 80),
+            }
+
+    def genres(self):
+        rng = self._rng("genres")
+        movies = self.scale.movies
+        for i in range(self.scale.genres):
+            # Every movie gets one genre before any gets a second.
+            yield {"movie": self.movie_name(i % movies), "genre": rng.choice(GENRES)}
+
+    def links(self):
+        rng = self._rng("links")
+        for _ in range(self.scale.links):
+            yield {
+                "movie": self.movie_name(skewed(rng, self.scale.movies, 2)),
+                "actor": self.actor_name(skewed(rng, self.scale.actors, 2)),
+            }
+
+    def reviews(self):
+        rng = self._rng("reviews")
+        for _ in range(self.scale.reviews):
+            movie = skewed(rng, self.scale.movies, 2.5)
+            rating = min(max(rng.gauss(self.quality[movie], 1.5), 0.0), 10.0)
+            yield (
+                skewed(rng, self.scale.users, 2) + 1,
+                movie + 1,
+                round(rating * 2) / 2,
+                "Loved it." if rng.random() < 0.1 else None,
+            )
+
+    def watchlist(self):
+        rng = self._rng("watchlist")
+        for _ in range(self.scale.watchlist):
+            yield (
+                skewed(rng, self.scale.users, 2) + 1,
+                skewed(rng, self.scale.movies, 2) + 1,
+            )
+
+    def friendships(self):
+        rng = self._rng("friendships")
+        users = self.scale.users
+        for _ in range(self.scale.friendships):
+            user = rng.randrange(users)
+            friend = skewed(rng, users, 2)  # popular users get added more
+            if friend != user:
+                yield (user + 1, friend + 1)
+
+
+# Rows that collide with an existing key (the same user rating a movie
+# twice) are dropped, so tables end up slightly below their share.
+INSERTS = {
+    "users": "INSERT OR IGNORE INTO user (user_id, first_name, last_name, email, "
+    "password, bio, creation_date, last_login) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "reviews": "INSERT OR IGNORE INTO collection (user_id, movie_id, rating, review) "
+    "VALUES (?, ?, ?, ?)",
+    "watchlist": "INSERT INTO collection (user_id, movie_id, watchlist) "
+    "VALUES (?, ?, TRUE) ON CONFLICT (user_id, movie_id) DO UPDATE SET watchlist=TRUE",
+    "friendships": "INSERT OR IGNORE INTO friendlist (user_id, friend_id) "
+    "VALUES (?, ?)",
+}
+
+
+def populate(db, rows=None, seed=0, scale=None, batch_size=50_000, progress=None):
+    """Fill an empty MovieDB with about `rows` synthetic rows (or exactly
+    `scale`), committing every `batch_size` rows.
+
+    Returns the SyntheticData used, to pick valid names and IDs from, and
+    {table: seconds}. `progress(table, rows_done)` is called after every
+    batch.
+    """
+    scale = scale or Scale.from_rows(rows)
+    data = SyntheticData(scale, seed)
+    timings = {}
+
+    start = time.perf_counter()
+    db.bulk_import(
+        movies=data.movies(),
+        genres=data.genres(),
+        actors=data.actors(),
+        links=data.links(),
+        batch_size=batch_size,
+    )
+    timings["catalog"] = time.perf_counter() - start
+    if progress:
+        progress("catalog", scale.movies + scale.actors + scale.genres + scale.links)
+
+    for table, sql in INSERTS.items():
+        start = time.perf_counter()
+        done = 0
+        for chunk in batched(getattr(data, table)(), batch_size):
+            with db.batch():
+                db.cur.executemany(sql, chunk)
+            done += len(chunk)
+            if progress:
+                progress(table, done)
+        timings[table] = time.perf_counter() - start
+    return data, timings
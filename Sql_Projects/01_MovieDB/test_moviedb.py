@@ -0,0 +1,901 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import migrations
+from autocomplete import PrefixIndex
+from cache import MISSING, LRUCache
+from group_commit import GroupCommit
+from moviedb import FriendPick, MovieDB, MovieRow, UserInfo
+from recommend import ItemSimilarityIndex, RatingMatrix
+from retention import LoginRetention
+from sharded import ShardedMovieDB, shard_of
+from social import FriendGraph
+from snapshot import Snapshot, rating_histogram, reviews_per_genre_year
+from sqltrace import SQLTracer
+from synthetic import Scale, SyntheticData, populate
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = MovieDB(tmp_path)
+    yield db
+    db.close()
+
+
+def write_csv(path, header, rows):
+    path.write_text("\n".join([header, *rows]) + "\n", encoding="utf-8")
+    return path
+
+
+def test_bulk_import_resolves_names_in_memory(db, tmp_path):
+    movies = write_csv(
+        tmp_path / "movies.csv",
+        "name,description,release_date,director",
+        ["Heat,Cops and robbers,1995-12-15,Mann", "Alien,In space,1979-05-25,Scott"],
+    )
+    actors = tmp_path / "actors.jsonl"
+    actors.write_text('{"name": "Pacino", "dob": "1940-04-25", "movies_count": 50}\n')
+    links = write_csv(tmp_path / "links.csv", "movie,actor", ["Heat,Pacino", "Nope,X"])
+    genres = write_csv(
+        tmp_path / "genres.csv", "movie,genre", ["Heat,Crime", "Alien, Crime ", "Heat,"]
+    )
+
+    results = db.bulk_import(movies=movies, actors=actors, links=links, genres=genres)
+
+    assert [(s.kind, s.rows, s.skipped) for s in results] == [
+        ("movie", 2, 0),
+        ("actor", 1, 0),
+        ("genre", 3, 1),
+        ("link", 2, 1),
+    ]
+    db.cur.execute("""
+        SELECT m.name, a.name FROM movie_actor ma
+        JOIN movie m USING (movie_id) JOIN actor a USING (actor_id)
+    """)
+    assert db.cur.fetchall() == [("Heat", "Pacino")]
+    assert db.genre_facets() == [("Crime", 2)]
+
+
+def test_bulk_import_resumes_after_failure(db, tmp_path):
+    rows = [f"Movie {i},,2000-01-01,Someone" for i in range(10)]
+    movies = write_csv(
+        tmp_path / "movies.csv", "name,description,release_date,director", rows
+    )
+    genres = tmp_path / "genres.jsonl"
+    genres.write_text('{"movie": "Movie 1", "genre": "Drama"}\n{"movie": \n')
+
+    db.bulk_import(movies=movies, batch_size=4)
+    with pytest.raises(ValueError):
+        db.bulk_import(genres=genres, batch_size=1)
+
+    genres.write_text(
+        '{"movie": "Movie 1", "genre": "Drama"}\n{"movie": "Movie 2", "genre": "War"}\n'
+    )
+    results = db.bulk_import(genres=genres, batch_size=4)
+    assert [(s.resumed_from, s.rows) for s in results] == [(1, 1)]
+    db.cur.execute("SELECT COUNT(*) FROM movie")
+    assert db.cur.fetchone() == (10,)
+    # Finished imports leave no progress behind to skip rows of a new file.
+    db.cur.execute("SELECT COUNT(*) FROM import_progress")
+    assert db.cur.fetchone() == (0,)
+    genres.write_text('{"movie": "Movie 3", "genre": "Drama"}\n')
+    assert db.bulk_import(genres=genres)[0].resumed_from == 0
+    db.cur.execute("SELECT name FROM genre ORDER BY genre_id")
+    assert db.cur.fetchall() == [("Drama",), ("War",)]
+
+
+def test_genre_facets_count_search_results_per_genre(db):
+    for name in ("Star Wars", "Star Trek", "Alien", "Stardust"):
+        db.add_movie(name, "", "", "")
+    db.add_genre("Star Wars", "Sci-Fi")
+    db.add_genre("Star Wars", "Adventure")
+    db.add_genre("Star Wars", "Sci-Fi")  # already linked
+    db.add_genre("Star Trek", "Sci-Fi")
+    db.add_genre("Alien", " Sci-Fi ")  # the same genre, trimmed
+    db.add_genre("Alien", "  ")  # blank, ignored
+    db.add_genre("Stardust", "Fantasy")
+    db.add_genre("Missing", "Drama")  # no such movie, no genre row either
+
+    assert db.genre_facets("star") == [("Sci-Fi", 2), ("Adventure", 1), ("Fantasy", 1)]
+    assert db.genre_facets() == [("Sci-Fi", 3), ("Adventure", 1), ("Fantasy", 1)]
+    assert db.genre_facets("nothing") == []
+    hits = db.search_movies("star", genre="Sci-Fi")
+    assert sorted(hit.name for hit in hits) == ["[Star] Trek", "[Star] Wars"]
+    assert db.search_movies("star", genre="Drama") == []
+    db.cur.execute("SELECT COUNT(*) FROM genre")
+    assert db.cur.fetchone() == (3,)
+
+
+def test_search_ranks_prefix_matches_and_highlights(db):
+    db.add_movie("Star Wars", "A galaxy far away", "1977-05-25", "Lucas")
+    db.add_movie("Stardust", "A fallen star", "2007-08-10", "Vaughn")
+    db.add_movie("Heat", "Cops and robbers", "1995-12-15", "Mann")
+
+    results = db.search_movies("star wa")
+    assert [hit.name for hit in results] == ["[Star] [Wars]"]
+    assert results[0].snippet == "A galaxy far away"
+
+    # Stardust also matches in its description, so it ranks first.
+    names = [hit.name for hit in db.search_movies("star")]
+    assert names == ["[Stardust]", "[Star] Wars"]
+
+    db.cur.execute("UPDATE movie SET name='Heat 2' WHERE name='Heat'")
+    assert db.search_movies("heat")[0].name == "[Heat] 2"
+    assert db.search_movies('"; DROP') == []
+
+
+def test_rebuild_search_index_backfills_existing_rows(db):
+    db.cur.execute("INSERT INTO movie (name, description) VALUES ('Alien', 'space')")
+    db.cur.execute("INSERT INTO movie_fts (movie_fts) VALUES ('delete-all')")
+    assert db.search_movies("alien") == []
+    db.rebuild_search_index()
+    assert db.search_movies("alien")[0].name == "[Alien]"
+
+
+def movie_rating(db, name):
+    db.cur.execute(
+        "SELECT rating, rating_sum, rating_count FROM movie WHERE name=?", (name,)
+    )
+    return db.cur.fetchone()
+
+
+def test_review_updates_rating_aggregates_incrementally(db):
+    db.add_movie("Heat", "", "1995-12-15", "Mann")
+    db.toggle_watchlist(1, "Heat")
+    db.review_movie(1, "Heat", 8.0)
+    db.review_movie(2, "Heat", 6.0)
+    assert movie_rating(db, "Heat") == (7.0, 14.0, 2)
+
+    db.review_movie(1, "Heat", 10.0)  # overwrite subtracts the old rating
+    assert movie_rating(db, "Heat") == (8.0, 16.0, 2)
+    db.cur.execute("SELECT watchlist FROM collection WHERE user_id=1")
+    assert db.cur.fetchone() == (1,)
+
+    db.cur.execute(
+        "INSERT OR REPLACE INTO collection (user_id, movie_id, rating) VALUES (2, 1, 4)"
+    )
+    assert movie_rating(db, "Heat") == (7.0, 14.0, 2)
+    db.cur.execute("DELETE FROM collection")
+    assert movie_rating(db, "Heat") == (0.0, 0.0, 0)
+
+
+def test_repair_rating_aggregates(db):
+    db.add_movie("Heat", "", "1995-12-15", "Mann")
+    db.add_movie("Alien", "", "1979-05-25", "Scott")
+    db.review_movie(1, "Heat", 9.0)
+    db.cur.execute("UPDATE movie SET rating_count=5 WHERE name='Heat'")
+    assert db.repair_rating_aggregates() == 1
+    assert movie_rating(db, "Heat") == (9.0, 9.0, 1)
+    assert db.repair_rating_aggregates() == 0
+
+
+def test_migrations_upgrade_unversioned_database(tmp_path):
+    conn = sqlite3.connect(tmp_path / "MovieDB.db")
+    conn.executescript(migrations.BASELINE)
+    conn.execute("INSERT INTO movie (name) VALUES ('Heat')")
+    conn.execute("INSERT INTO movie (name) VALUES ('Alien')")
+    conn.execute("INSERT INTO collection (user_id, movie_id, rating) VALUES (1, 1, 6)")
+    conn.executemany(
+        "INSERT INTO genre (movie_id, genre) VALUES (?, ?)",
+        [(1, "Crime"), (1, " Crime"), (1, "Drama"), (2, "Crime"), (2, "")],
+    )
+    conn.commit()
+    conn.close()
+
+    db = MovieDB(tmp_path)
+    assert migrations.schema_version(db.conn) == len(migrations.MIGRATIONS)
+    assert movie_rating(db, "Heat") == (6.0, 6.0, 1)
+    assert db.search_movies("heat")[0].name == "[Heat]"
+    assert db.genre_facets() == [("Crime", 2), ("Drama", 1)]
+    assert [e.name for e in db.leaderboard(genre="Drama")] == ["Heat"]
+    assert db.create_tables() == []
+    db.close()
+
+
+def test_no_statement_falls_back_to_a_full_table_scan(tmp_path):
+    db = MovieDB(tmp_path, explain=True)
+    db.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+    db.signup(UserInfo("Bob", "Ray", "bob@x.io", "pw", ""))
+    user_id = db.login("ann@x.io", "pw")
+    db.add_movie("Heat", "Cops and robbers", "1995-12-15", "Mann")
+    db.add_genre("Heat", "Crime")
+    db.add_actor("Pacino", "1940-04-25", 50)
+    db.link_actor_to_movie("Heat", "Pacino")
+    db.review_movie(user_id, "Heat", 9.0, "Great")
+    db.toggle_watchlist(user_id, "Heat")
+    db.add_friend(user_id, "bob@x.io")
+    db.show_top_movies()
+    db.search_movie("cops")
+    db.search_movies("cops", genre="Crime")
+    db.genre_facets()
+    db.genre_facets("cops")
+    db.leaderboard(genre="Crime")
+    db.autocomplete("he")
+    db.autocomplete("he", by="rating")
+    db.autocomplete("pa", kind="actor")
+    db.friends_within(user_id, hops=3, cached=False)
+    db.friend_suggestions(user_id, cached=False)
+    db.friends_rated_highly(user_id)
+    db.recommend(user_id)
+    db.logins_per_day()
+    db.logins_per_day(user_id=user_id)
+    db.apply_login_retention()
+
+    assert db.explain.plans
+    db.explain.report()
+    assert db.explain.full_scans == []
+    db.close()
+
+
+def test_reader_pool_opens_a_path_that_needs_escaping(tmp_path):
+    folder = tmp_path / "50% off? #1"
+    folder.mkdir()
+    db = MovieDB(folder, concurrent=True, readers=1, explain=True)
+    db.add_movie("Heat", "", "", "")
+    assert db.search_movies("heat")[0].name == "[Heat]"
+    assert db.explain.plans  # the auditor's own read-only connection
+    db.close()
+
+
+def test_concurrent_readers_and_serialized_writers(tmp_path):
+    db = MovieDB(tmp_path, concurrent=True, readers=2)
+    db.add_movie("Heat", "Cops and robbers", "1995-12-15", "Mann")
+    db.cur.execute("PRAGMA journal_mode")
+    assert db.cur.fetchone() == ("wal",)
+    errors = []
+
+    def review(writer):
+        for i in range(50):
+            db.review_movie(writer * 100 + i, "Heat", 5.0)
+
+    def search():
+        for _ in range(50):
+            db.search_movies("heat")
+
+    def run(work, *args):
+        try:
+            work(*args)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run, args=(review, w)) for w in range(2)]
+    threads += [threading.Thread(target=run, args=(search,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert movie_rating(db, "Heat") == (5.0, 500.0, 100)
+    db.close()
+
+
+def test_autocomplete_ranks_prefix_matches_and_sees_new_names(db):
+    for name in ("Star Wars", "Star Trek", "Stardust", "Alien", "star 80"):
+        db.add_movie(name, "", "", "")
+    for user_id in range(1, 4):
+        db.review_movie(user_id, "Star Trek", 6.0)
+    db.review_movie(1, "Stardust", 9.0)
+
+    names = [c.name for c in db.autocomplete("STAR")]
+    assert names == ["Star Trek", "Stardust", "star 80", "Star Wars"]
+    assert [c.name for c in db.autocomplete("star", limit=2)] == names[:2]
+    assert db.autocomplete("star ")[0].name == "Star Trek"
+    assert db.autocomplete("x") == []
+    db.set_leaderboard_prior(min_votes=1, prior_mean=5.0)
+    assert db.autocomplete("star", by="rating")[0].name == "Stardust"
+
+    db.add_movie("Starman", "", "", "")  # indexed without a reload
+    assert "Starman" in [c.name for c in db.autocomplete("starm")]
+    db.rename_movie("Alien", "Aliens")
+    assert [c.name for c in db.autocomplete("alien")] == ["Aliens"]
+
+    db.add_actor("Sigourney Weaver", "1949-10-08", 1)
+    db.add_actor("Sam Neill", "1947-09-14", 1)
+    db.link_actor_to_movie("Aliens", "Sigourney Weaver")
+    db.reset_autocomplete()
+    assert [c.name for c in db.autocomplete("s", kind="actor")] == [
+        "Sigourney Weaver",
+        "Sam Neill",
+    ]
+    with pytest.raises(ValueError):
+        db.autocomplete("s", kind="actor", by="rating")
+
+
+def test_prefix_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    words = ["ab", "abc", "b", "ba", "abd", "a", "c", "Ab", "bab"]
+    rows = [
+        (str(rng.choice(words)) + str(i % 3), i, float(rng.integers(5)))
+        for i in range(300)
+    ]
+    index = PrefixIndex(compact_after=7).load(rows[:250])
+    for row in rows[250:]:
+        index.add(*row)
+    index.add(*rows[0])  # already indexed: a name loaded and added by a write
+    index.add(*rows[-1])
+    assert len(index) == 300
+    for prefix in ("", "a", "AB", "abc", "b", "ba1", "z"):
+        expected = sorted(
+            (row for row in rows if row[0].casefold().startswith(prefix.casefold())),
+            key=lambda row: (-row[2], row[0].casefold()),
+        )[:10]
+        got = index.complete(prefix, 10)
+        assert [(c.score, c.name.casefold()) for c in got] == [
+            (row[2], row[0].casefold()) for row in expected
+        ]
+
+
+def test_name_cache_hits_and_invalidation(db):
+    assert db.find_movie_id("Heat") is None
+    db.add_movie("Heat", "", "1995-12-15", "Mann")
+    assert db.find_movie_id("Heat") == 1  # cached "not found" was dropped
+
+    db.review_movie(1, "Heat", 8.0)
+    db.toggle_watchlist(1, "Heat")
+    assert db.cache_stats()["movie"]["hits"] == 2
+
+    db.rename_movie("Heat", "Heat (1995)")
+    assert db.find_movie_id("Heat") is None
+    assert db.find_movie_id("Heat (1995)") == 1
+
+    db.add_actor("Pacino", "1940-04-25", 50)
+    db.rename_actor("Pacino", "Al Pacino")
+    db.link_actor_to_movie("Heat (1995)", "Al Pacino")
+    db.cur.execute("SELECT movie_id, actor_id FROM movie_actor")
+    assert db.cur.fetchall() == [(1, 1)]
+
+
+def test_name_cache_can_be_disabled(tmp_path):
+    db = MovieDB(tmp_path, name_cache=0)
+    db.add_movie("Heat", "", "1995-12-15", "Mann")
+    db.find_movie_id("Heat")
+    db.find_movie_id("Heat")
+    assert db.cache_stats()["movie"] == {"size": 0, "hits": 0, "misses": 0}
+    db.close()
+
+
+def committed_movies(tmp_path):
+    with sqlite3.connect(tmp_path / "MovieDB.db") as other:
+        return other.execute("SELECT COUNT(*) FROM movie").fetchone()[0]
+
+
+def test_group_commit_flushes_on_size_and_time(tmp_path):
+    db = MovieDB(tmp_path, group_commit=GroupCommit(max_writes=3, max_delay=0.05))
+    db.add_movie("A", "", "", "")
+    db.add_movie("B", "", "", "")
+    assert committed_movies(tmp_path) == 0
+    db.add_movie("C", "", "", "")
+    assert committed_movies(tmp_path) == 3
+
+    db.add_movie("D", "", "", "")
+    time.sleep(0.2)
+    assert committed_movies(tmp_path) == 4
+    db.close()
+
+
+def test_readers_dont_cache_misses_for_buffered_writes(tmp_path):
+    db = MovieDB(tmp_path, concurrent=True, group_commit=GroupCommit(max_delay=60))
+    db.add_movie("Heat", "", "", "")
+    assert db.find_movie_id("Heat") is None  # not committed yet
+    db.flush()
+    db.review_movie(1, "Heat", 8.0)
+    assert db.find_movie_id("Heat") == 1
+    db.flush()
+    assert movie_rating(db, "Heat")[0] == 8.0
+    db.close()
+
+
+def test_name_cache_drops_values_read_across_an_invalidation():
+    cache = LRUCache()
+    version = cache.version
+    cache.invalidate("Heat")  # a write landed while the value was read
+    cache.put("Heat", None, version)
+    assert cache.get("Heat") is MISSING
+    cache.put("Heat", 1, cache.version)
+    assert cache.get("Heat") == 1
+
+
+def test_batch_commits_once_and_isolates_failed_writes(db, tmp_path):
+    with db.batch():
+        db.add_movie("A", "", "", "")
+        with pytest.raises(sqlite3.IntegrityError):
+            db.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+            db.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+        db.add_movie("B", "", "", "")
+        assert committed_movies(tmp_path) == 0
+    assert committed_movies(tmp_path) == 2
+    db.cur.execute("SELECT COUNT(*) FROM user")
+    assert db.cur.fetchone() == (1,)
+
+
+def test_transaction_is_all_or_nothing(db, tmp_path):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_movie("A", "", "", "")
+            db.review_movie(1, "A", 8.0)
+            raise RuntimeError
+    assert committed_movies(tmp_path) == 0
+    assert db.find_movie_id("A") is None
+
+    with db.transaction():
+        db.add_movie("A", "", "", "")
+        with pytest.raises(RuntimeError), db.transaction():  # nested
+            db.add_movie("B", "", "", "")
+            raise RuntimeError
+        assert committed_movies(tmp_path) == 0
+    assert committed_movies(tmp_path) == 1
+
+
+def test_toggle_watchlist_and_login_are_single_upserts(db):
+    db.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+    db.add_movie("Heat", "", "", "")
+    db.review_movie(1, "Heat", 7.0)
+    assert [db.toggle_watchlist(1, "Heat") for _ in range(3)] == [True, False, True]
+    assert db.toggle_watchlist(2, "Heat") is True  # new row
+    assert db.toggle_watchlist(1, "Nope") is None
+    assert movie_rating(db, "Heat")[2] == 1  # the review is untouched
+
+    assert db.login("ann@x.io", "wrong") is None
+    assert db.login("ann@x.io", "pw") == 1
+    assert db.login("ann@x.io", "pw") == 1
+    db.cur.execute("SELECT user_id, login_time FROM login_history")
+    history = db.cur.fetchall()
+    db.cur.execute("SELECT last_login FROM user")
+    assert [user for user, _ in history] == [1, 1]
+    assert history[-1][1] == db.cur.fetchone()[0]
+    db.cur.execute("UPDATE user SET last_login='2020-01-01'")  # not a login
+    db.cur.execute("SELECT COUNT(*) FROM login_history")
+    assert db.cur.fetchone() == (2,)
+
+
+def test_keyset_pagination_streams_typed_rows(db):
+    movies = ({"name": f"Movie {i}", "description": "plot"} for i in range(7))
+    db.bulk_import(movies=movies)
+    for user_id, movie_id in enumerate([3, 3, 5, 1, 6]):
+        db.review_movie(user_id, f"Movie {movie_id}", 5.0 + movie_id % 2)
+
+    rows = list(db.iter_top_movies(chunk_size=2))
+    assert [row.movie_id for row in rows] == [6, 4, 2, 7, 5, 3, 1]
+    assert rows[0] == MovieRow(6, "Movie 5", 6.0, 1, None, None)
+
+    # Resuming from any row's cursor continues right after it.
+    assert list(db.iter_top_movies(after=rows[2].cursor, chunk_size=3)) == rows[3:]
+
+    hits = list(db.iter_search("plot", chunk_size=3))
+    assert sorted(hit.movie_id for hit in hits) == list(range(1, 8))
+    assert list(db.iter_search("plot", after=hits[3].cursor)) == hits[4:]
+
+
+def test_leaderboard_uses_bayesian_average_and_follows_reviews(db):
+    for name in ("Heat", "Alien", "Cats"):
+        db.add_movie(name, "", "", "")
+    db.add_genre("Heat", "Crime")
+    db.add_genre("Alien", "Horror")
+    db.set_leaderboard_prior(min_votes=2, prior_mean=5.0)
+
+    db.review_movie(1, "Cats", 10.0)  # one perfect review ...
+    for user_id in range(1, 5):  # ... vs four very good ones
+        db.review_movie(user_id, "Heat", 9.0)
+        db.review_movie(user_id, "Alien", 7.0)
+    db.add_genre("Cats", "Crime")
+
+    top = db.leaderboard()
+    assert [entry.name for entry in top] == ["Heat", "Cats", "Alien"]
+    assert top[0].score == pytest.approx((36 + 2 * 5.0) / (4 + 2))
+    assert [e.name for e in db.leaderboard(genre="Crime")] == ["Heat", "Cats"]
+
+    db.review_movie(1, "Heat", 0.0)
+    db.cur.execute("DELETE FROM collection WHERE movie_id=3")
+    assert [entry.name for entry in db.leaderboard()] == ["Alien", "Heat"]
+    assert [e.name for e in db.leaderboard(genre="Crime")] == ["Heat"]
+
+    db.set_leaderboard_prior()  # re-estimate the mean from all ratings
+    db.cur.execute("SELECT prior_mean FROM leaderboard_config")
+    assert db.cur.fetchone()[0] == pytest.approx((27 + 28) / 8)
+
+
+def test_friend_graph_queries_match_sql(db):
+    for name in "abcdef":
+        db.signup(UserInfo(name, "", f"{name}@x.io", "pw", ""))
+    for user, friend in ["ab", "ac", "bd", "cd", "ce", "df", "ba"]:
+        db.add_friend(ord(user) - 96, f"{friend}@x.io")
+
+    for cached in (False, True):
+        assert db.friends_within(1, hops=1, cached=cached) == {2: 1, 3: 1}
+        assert db.friends_within(1, hops=3, cached=cached) == {
+            2: 1,
+            3: 1,
+            4: 2,
+            5: 2,
+            6: 3,
+        }
+        assert db.friend_suggestions(1, cached=cached) == [(4, 2), (5, 1)]
+
+    # New friendships reach the cached graph incrementally.
+    graph = db.friend_graph()
+    db.add_friend(6, "a@x.io")
+    assert db.friend_graph() is graph
+    assert graph.friends(6) == [1]
+    graph.compact()
+    assert db.friends_within(6, hops=1) == {1: 1}
+
+    db.add_movie("Heat", "", "", "")
+    db.add_movie("Alien", "", "", "")
+    db.review_movie(2, "Heat", 9.0)
+    db.review_movie(3, "Heat", 8.0)
+    db.review_movie(3, "Alien", 9.5)
+    db.review_movie(4, "Alien", 10.0)  # friend of a friend
+    db.review_movie(1, "Alien", 2.0)  # already seen by user 1
+    picks = db.friends_rated_highly(1, hops=2)
+    assert picks == [FriendPick(1, "Heat", 8.5, 2)]
+
+
+def test_friend_graph_queries_read_one_generation_across_a_compact():
+    graph = FriendGraph(compact_after=100)
+    for user, friend in [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5)]:
+        graph.add(user, friend)
+    expected = graph.mutual_counts(1)
+    friends, calls = graph._friends, []
+
+    def compact_midway(state, user_id):
+        calls.append(user_id)
+        if len(calls) == 2:
+            graph.compact()  # another thread's refresh, mid-query
+        return friends(state, user_id)
+
+    graph._friends = compact_midway
+    assert graph.mutual_counts(1) == expected == {4: 2, 5: 1}
+    assert graph.within(1) == {2: 1, 3: 1, 4: 2, 5: 2}
+
+
+def test_recommendations_and_incremental_index_rebuild(db):
+    for name in ("Heat", "Ronin", "Alien", "Aliens", "Up"):
+        db.add_movie(name, "", "", "")
+    for user_id, ratings in {
+        1: {"Heat": 9, "Ronin": 8},
+        2: {"Heat": 8, "Ronin": 9, "Up": 2},
+        3: {"Alien": 9, "Aliens": 9},
+        4: {"Alien": 8, "Aliens": 7, "Up": 3},
+        5: {"Heat": 7},
+        6: {"Alien": 10},
+    }.items():
+        for movie, rating in ratings.items():
+            db.review_movie(user_id, movie, rating)
+
+    # Heat's fans liked Ronin; Alien's liked Aliens.
+    assert [r.name for r in db.recommend(5)][0] == "Ronin"
+    assert [r.name for r in db.recommend(6)][0] == "Aliens"
+    assert db.recommend(999) == []
+
+    rng = np.random.default_rng(0)
+    users, movies = rng.integers(1, 200, 3000), rng.integers(1, 300, 3000)
+    for user_id, movie_id in zip(users.tolist(), movies.tolist()):
+        db.cur.execute(
+            "INSERT OR REPLACE INTO collection (user_id, movie_id, rating) "
+            "VALUES (?, ?, ?)",
+            (user_id, movie_id, user_id % 10 + 1),
+        )
+    db.conn.commit()
+    previous = db.rebuild_recommendations(k=5)
+    db.cur.execute("DELETE FROM collection WHERE movie_id IN (1, 2)")
+    db.cur.execute("UPDATE collection SET rating = 1 WHERE user_id < 20")
+    db.conn.commit()
+
+    matrix = RatingMatrix.from_db(db.conn)
+    full = ItemSimilarityIndex.build(matrix, k=5)
+    incremental = ItemSimilarityIndex.build(matrix, k=5, previous=previous)
+    assert np.array_equal(incremental.movie_ids, full.movie_ids)
+    np.testing.assert_allclose(incremental.scores, full.scores, rtol=1e-5)
+
+
+def test_tracer_times_statements_and_logs_slow_ones(tmp_path, capsys):
+    slow_log = tmp_path / "slow.log"
+    tracer = SQLTracer(slow_ms=0, slow_log=slow_log, summary=False)
+    db = MovieDB(tmp_path, explain=True, trace=tracer)
+    for name in ("Heat", "Alien"):
+        db.add_movie(name, "", "", "")
+    db.review_movie(1, "Heat", 9.0)
+    assert [movie.name for movie in db.iter_top_movies()] == ["Heat", "Alien"]
+    db.close()
+
+    lookup = tracer.statements["SELECT movie_id FROM movie WHERE name=?"]
+    assert (lookup.calls, lookup.rows) == (1, 1)
+    assert lookup.seconds > 0 and lookup.max_seconds <= lookup.seconds
+    assert tracer.methods["add_movie"].calls == 2
+    assert tracer.methods["review_movie"].rows == 1
+    # Rows streamed by a generator are counted, not timed.
+    top = next(key for key in tracer.statements if "ORDER BY rating DESC" in key)
+    assert tracer.statements[top].rows == 2
+    assert tracer.statements[top].seconds == 0
+    logged = slow_log.read_text()
+    assert "review_movie: SELECT movie_id FROM movie WHERE name=?" in logged
+    assert "Heat" not in logged
+    assert db.explain.plans  # still audited alongside the tracer
+
+    tracer.report()
+    assert "review_movie" in capsys.readouterr().out
+
+
+def test_synthetic_data_is_seeded_and_loads(db):
+    scale = Scale.from_rows(2_000)
+    assert scale.total == 2_000
+    first, again = SyntheticData(scale, seed=7), SyntheticData(scale, seed=7)
+    assert list(first.reviews()) == list(again.reviews())
+    assert list(first.reviews()) != list(SyntheticData(scale, seed=8).reviews())
+
+    data, timings = populate(db, scale=scale, seed=7)
+    assert set(timings) == {"catalog", "users", "reviews", "watchlist", "friendships"}
+    db.cur.execute("SELECT COUNT(*) FROM movie")
+    assert db.cur.fetchone()[0] == scale.movies
+    assert db.find_movie_id(data.movie_name(5)) == 6
+    assert db.login(data.email(0), "password") == 1
+    assert db.repair_rating_aggregates() == 0  # triggers kept up
+    assert db.leaderboard(1)
+
+
+def test_login_history_retention_keeps_daily_counts(tmp_path):
+    db = MovieDB(tmp_path, retention=LoginRetention(raw_days=30, chunk_size=50))
+    db.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+    db.login("ann@x.io", "pw")
+    today = datetime.now().date().isoformat()
+    old = datetime.now() - timedelta(days=100)
+    db.cur.executemany(
+        "INSERT INTO login_history (user_id, login_time) VALUES (?, ?)",
+        [(1 + i % 2, (old + timedelta(days=i % 3)).isoformat(" ")) for i in range(120)],
+    )
+    db.cur.execute("DELETE FROM user")  # frees a few pages as well
+    db.conn.commit()
+    expected = [
+        ((old + timedelta(days=d)).date().isoformat(), 40) for d in range(3)
+    ] + [(today, 1)]
+    assert db.logins_per_day() == expected
+
+    deleted, freed = db.apply_login_retention()
+    assert deleted == 120
+    db.cur.execute("SELECT COUNT(*) FROM login_history")
+    assert db.cur.fetchone() == (1,)
+    assert db.logins_per_day() == expected  # counts survive the purge
+    assert db.logins_per_day(user_id=2) == [(day, 20) for day, _ in expected[:3]]
+    assert db.logins_per_day(start=today) == [(today, 1)]
+    db.cur.execute("PRAGMA auto_vacuum")
+    assert db.cur.fetchone() == (2,)  # incremental
+    assert db.vacuum() == 0  # apply_login_retention() already freed them
+    db.close()
+
+
+def test_sqlalchemy_backend_shares_the_sqlite_file(tmp_path):
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    from coredb import CoreMovieDB
+
+    (tmp_path / "new").mkdir()
+    CoreMovieDB(tmp_path / "new").close()  # a file it creates can be vacuumed
+    with sqlite3.connect(tmp_path / "new" / "MovieDB.db") as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone() == (2,)  # incremental
+
+    MovieDB(tmp_path).close()  # the Core backend opens a migrated file as is
+    core = CoreMovieDB(tmp_path)
+    core.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+    assert core.login("ann@x.io", "pw") == 1
+    assert core.login("ann@x.io", "nope") is None
+
+    core.add_movie("Old Heat", "", "1990-01-01", "Mann")
+    movies = [
+        {"name": "Heat", "description": "Cops and robbers", "release_date": "1995"},
+        {"name": "Alien", "description": "In space", "release_date": "1979"},
+        {"name": "Old Heat", "description": "A remake", "release_date": "2001"},
+    ]
+    results = core.bulk_import(
+        movies=movies,
+        actors=[{"name": "Pacino", "dob": "1940-04-25", "movies_count": 50}],
+        genres=[{"movie": "Heat", "genre": "Crime"}, {"movie": "Nope", "genre": "X"}],
+        links=[{"movie": "Heat", "actor": "Pacino"}],
+        batch_size=2,
+    )
+    assert [(s.kind, s.rows, s.skipped) for s in results] == [
+        ("movie", 3, 0),
+        ("actor", 1, 0),
+        ("genre", 2, 1),
+        ("link", 1, 0),
+    ]
+    assert core.find_movie_id("Old Heat") == 1  # the first row of a name wins
+    assert core.leaderboard(genre="X") == []  # "Nope" isn't a movie: no genre
+
+    with core.batch():
+        core.add_movie("Up", "", "", "")
+        with pytest.raises(sqlalchemy.exc.IntegrityError):
+            core.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+    assert core.find_movie_id("Up") == 5  # committed without the failed call
+    with pytest.raises(RuntimeError), core.transaction():
+        core.add_movie("Cars", "", "", "")
+        raise RuntimeError
+    assert core.find_movie_id("Cars") is None
+
+    with core.batch():
+        core.review_movie(1, "Heat", 9, "Great")
+        core.review_movie(1, "Alien", 7)
+    assert core.toggle_watchlist(1, "Heat") is True
+    assert core.toggle_watchlist(1, "Heat") is False
+    core.rename_movie("Alien", "Aliens")
+    assert [hit.name for hit in core.search_movies("aliens")] == ["[Aliens]"]
+    assert [c.name for c in core.autocomplete("a")] == ["Aliens"]
+    core.close()
+
+    db = MovieDB(tmp_path)  # triggers kept the aggregates up to date
+    db.cur.execute("SELECT name FROM genre")
+    assert db.cur.fetchall() == [("Crime",)]
+    assert [entry.name for entry in db.leaderboard(2)] == ["Heat", "Aliens"]
+    assert [entry.name for entry in db.leaderboard(genre="Crime")] == ["Heat"]
+    assert db.find_actor_id("Pacino") == 1
+    assert db.repair_rating_aggregates() == 0
+    db.close()
+
+
+def test_sqlalchemy_backend_caches_only_committed_names(tmp_path):
+    pytest.importorskip("sqlalchemy")
+    from coredb import CoreMovieDB
+
+    folder = tmp_path / "50% off? #1"
+    folder.mkdir()
+    core = CoreMovieDB(folder)
+    assert (folder / "MovieDB.db").exists()
+
+    seen = []
+    with core.batch():
+        core.add_movie("Up", "", "", "")
+        assert core.find_movie_id("Up") == 1  # this thread sees its own write
+        other = threading.Thread(target=lambda: seen.append(core.find_movie_id("Up")))
+        other.start()
+        other.join()
+    assert seen == [None]  # not committed when the other thread looked
+    assert core.find_movie_id("Up") == 1
+
+    for name in ("A", "B", "C", "D", "E"):
+        core.add_movie(name, "", "", "")
+        core.review_movie(1, name, 8)
+    core.review_movie(1, "Up", 9)
+    rows = list(core.iter_top_movies(chunk_size=2))  # pages end inside the tie
+    assert [row.name for row in rows] == ["Up", "E", "D", "C", "B", "A"]
+    core.close()
+
+
+def test_sharded_moviedb_splits_users_and_syncs_ratings(tmp_path):
+    db = ShardedMovieDB(tmp_path, shards=3, sync_every=None)
+    for name in ("Heat", "Alien", "Up"):
+        db.add_movie(name, "", "2000-01-01", "Nobody")
+    users = [
+        db.signup(UserInfo("U", str(i), f"u{i}@x.io", "pw", "")) for i in range(12)
+    ]
+    assert users == list(range(1, 13))
+    for i, shard in enumerate(db.shards):
+        for (user_id,) in shard.query("SELECT user_id FROM user"):
+            assert shard_of(user_id, 3) == i
+    assert db.count_users() == 12
+    with pytest.raises(sqlite3.IntegrityError):
+        db.signup(UserInfo("U", "0", "u0@x.io", "pw", ""))
+    assert db.login("u5@x.io", "pw") == 6
+    assert db.login("u5@x.io", "nope") is None
+    assert db.login("who@x.io", "pw") is None
+
+    for user_id in users:
+        db.review_movie(user_id, "Heat", 9)
+        db.review_movie(user_id, "Alien", user_id % 2 * 8)
+    db.review_movie(1, "Up", 10, "Fun")
+    db.review_movie(1, "Up", 6, "Fun")  # the update is counted once
+    assert db.reviews(1) == [("Alien", 8.0, ""), ("Heat", 9.0, ""), ("Up", 6.0, "Fun")]
+    assert db.toggle_watchlist(2, "Up") is True
+
+    assert db.leaderboard() == []  # not synced yet
+    assert db.sync_ratings() == 3
+    assert db.sync_ratings() == 0
+    assert [(e.name, e.rating, e.votes) for e in db.leaderboard()] == [
+        ("Heat", 9.0, 12),
+        ("Up", 6.0, 1),  # pulled towards the prior mean less than Alien
+        ("Alien", 4.0, 12),
+    ]
+    db.review_movie(2, "Up", 10)
+    assert db.sync_ratings() == 1
+    assert db.catalog.find_movie_id("Up") == 3
+    assert db.leaderboard()[1].votes == 2
+
+    assert db.top_reviewers(2) == [(1, 3), (2, 3)]
+    for friend in ("u1@x.io", "u2@x.io", "u3@x.io", "nobody@x.io"):
+        db.add_friend(1, friend)
+    picks = db.friends_rated_highly(1, min_rating=8)
+    assert [(p.name, p.fans) for p in picks] == []  # user 1 rated them all
+    picks = db.friends_rated_highly(12, min_rating=8)
+    assert picks == []  # no friends
+    db.add_friend(12, "u1@x.io")
+    db.add_friend(12, "u2@x.io")
+    picks = db.friends_rated_highly(12, min_rating=8)
+    assert [(p.name, p.friends_rating, p.fans) for p in picks] == [("Up", 10.0, 1)]
+    assert sum(n for _, n in db.logins_per_day()) == 1
+    db.close()
+
+    with pytest.raises(ValueError):
+        ShardedMovieDB(tmp_path, shards=4)
+
+
+def test_sharded_user_lookup_racing_a_signup_isnt_cached(tmp_path):
+    db = ShardedMovieDB(tmp_path, shards=2, sync_every=None)
+    reading = db.catalog._reading
+
+    @contextmanager
+    def signup_after_the_read():
+        with reading() as cur:
+            yield cur
+        db.catalog._reading = reading
+        db.signup(UserInfo("Ann", "Lee", "ann@x.io", "pw", ""))
+
+    db.catalog._reading = signup_after_the_read
+    assert db.login("ann@x.io", "pw") is None  # looked before the signup
+    assert db.login("ann@x.io", "pw") == 1
+    db.close()
+
+
+def test_snapshot_export_and_vectorized_reports(db, tmp_path):
+    db.add_movie("Heat", "", "1995-12-15", "Mann")
+    db.add_movie("Alien", "", "1979-05-25", "Scott")
+    db.add_movie("Thief", "", None, "Mann")
+    for movie, genre in (("Heat", "Crime"), ("Alien", "Horror"), ("Thief", "Crime")):
+        db.add_genre(movie, genre)
+    db.signup(UserInfo("Ann", "Lee", "ann@x.io", "secret", ""))
+    for user_id, movie, rating in ((1, "Heat", 9), (2, "Heat", 7), (1, "Alien", 8)):
+        db.review_movie(user_id, movie, rating, "private words")
+    db.review_movie(1, "Thief", 10)
+    db.toggle_watchlist(3, "Thief")  # a collection row without a rating
+
+    path = db.export_snapshot(tmp_path / "snap.npz", chunk_size=2)
+    with np.load(path) as data:
+        assert "collection.review.codes" not in data.files
+        assert not any("secret" in str(data[name]) for name in data.files)
+    snapshot = Snapshot(path)
+    movies = snapshot["movie"]
+    assert movies.rows()[2] == (3, "Thief", None, "Mann", 10.0, 1)
+    assert movies.dictionaries["director"].values() == ["Mann", "Scott"]
+    assert movies.where(movies.equals("director", "Mann"))["movie_id"].tolist() == [
+        1,
+        3,
+    ]
+    assert not movies.equals("director", "Nobody").any()
+
+    assert rating_histogram(snapshot)[7:] == [(7, 1), (8, 1), (9, 1), (10, 1)]
+    db.review_movie(2, "Alien", -2)  # nothing in the schema stops it
+    negative = Snapshot(db.export_snapshot(tmp_path / "negative.npz"))
+    assert rating_histogram(negative)[:3] == [(-2, 1), (-1, 0), (0, 0)]
+    assert len(rating_histogram(negative)) == 13
+    assert reviews_per_genre_year(snapshot) == [
+        ("Crime", -1, 1, 10.0),
+        ("Crime", 1995, 2, 8.0),
+        ("Horror", 1979, 1, 8.0),
+    ]
+    collection = snapshot["collection"]
+    per_user = (
+        collection.join(movies, "movie_id", columns={"director": "director"})
+        .group_by(
+            ["user_id", "director"],
+            reviews=("rating", "count"),
+            rows=(None, "count"),
+            best=("rating", "max"),
+        )
+        .sort_by("reviews", descending=True)
+    )
+    assert per_user.head(2).rows() == [(1, "Mann", 2, 2, 10.0), (2, "Mann", 1, 1, 7.0)]
+    *last, best = per_user.rows()[-1]
+    assert last == [3, "Mann", 0, 1] and np.isnan(best)  # no rating to take max of
+
+
+def test_snapshot_export_from_a_path_that_needs_escaping(tmp_path):
+    folder = tmp_path / "50% off? #1"
+    folder.mkdir()
+    db = MovieDB(folder)
+    db.add_movie("Heat", "", "1995-12-15", "Mann")
+    snapshot = Snapshot(db.export_snapshot())
+    assert snapshot["movie"].rows()[0][1] == "Heat"
+    db.close()